@@ -1,13 +1,37 @@
 import hashlib
 import hmac
+import json
 from fastapi import Security
 from fastapi.security import APIKeyHeader
+from src import metrics
 from src.models import AuthActor
-from src.config import logger, get_supabase_client
+from src.config import logger, get_supabase_client, AUTH_CACHE_TTL_SECONDS
 from src.exceptions import InvalidAPIKeyError, DatabaseError
+from src.shared_cache import cache as shared_cache
 
 api_key_header_scheme = APIKeyHeader(name="Authorization", auto_error=False)
 
+
+async def _keys_for_prefix(prefix: str) -> list[dict]:
+    """
+    Claves candidatas para un prefijo. Con la caché compartida activa, las filas (hash, no
+    la clave) se reutilizan entre workers durante `AUTH_CACHE_TTL_SECONDS`; una clave
+    revocada puede seguir aceptándose hasta que venza la entrada.
+    """
+    cached = await shared_cache.aget("api_keys", prefix)
+    if cached is not None:
+        return json.loads(cached)
+    with metrics.observe_supabase("api_keys", "select"):
+        response = await (
+            get_supabase_client().from_("api_keys")
+            .select("id_key, key_hash, id_user")
+            .eq("pre", prefix)
+            .execute()
+        )
+    if response.data and AUTH_CACHE_TTL_SECONDS > 0:
+        await shared_cache.aput("api_keys", prefix, json.dumps(response.data).encode("utf-8"), AUTH_CACHE_TTL_SECONDS)
+    return response.data
+
 async def verify_api_key(
     api_key_header: str = Security(api_key_header_scheme),
 ) -> AuthActor:
@@ -27,21 +51,16 @@ async def verify_api_key(
 
     try:
         # 1. Buscar claves candidatas usando el prefijo
-        response = await (
-            get_supabase_client().from_("api_keys")
-            .select("id_key, key_hash, id_user")
-            .eq("pre", prefix)
-            .execute()
-        )
+        candidates = await _keys_for_prefix(prefix)
 
-        if not response.data:
+        if not candidates:
             raise InvalidAPIKeyError()
 
         # 2. Hashear la clave proporcionada
         provided_key_hash = hashlib.sha256(provided_key.encode()).hexdigest()
 
         # 3. Comparar hashes
-        for key_data in response.data:
+        for key_data in candidates:
             stored_hash = key_data.get("key_hash")
             if stored_hash and hmac.compare_digest(provided_key_hash, stored_hash):
                 user_id = key_data.get("id_user")
@@ -1,10 +1,15 @@
 import logging
 import os
+import threading
 from dotenv import load_dotenv
-from openai import AsyncOpenAI
-from supabase import Client, create_async_client
 from pathlib import Path # Nueva importación
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
+
+from src.log_pipeline import setup_logging
+from src.openai_cassette import CASSETTE_MODES, wrap_client
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 
 # --- Configuración Inicial ---
@@ -15,30 +20,134 @@ LOG_DIR = Path("logs")
 LOG_DIR.mkdir(exist_ok=True) # Asegura que el directorio 'logs' exista
 LOG_FILE_PATH = LOG_DIR / "app.log"
 
-# Configuración básica del logging
-logging.basicConfig(
-    level=logging.INFO, 
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    filename=LOG_FILE_PATH, # Guardar logs en un archivo
-    filemode='a' # Anexar logs si el archivo ya existe
+# Logging no bloqueante: cola acotada + hilo de escritura con rotación y registros JSON.
+setup_logging(
+    LOG_FILE_PATH,
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    rotation=os.getenv("LOG_ROTATION", "size"), # 'size' o 'time'
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+    rotation_when=os.getenv("LOG_ROTATION_WHEN", "midnight"),
+    queue_size=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+    max_bytes_per_request=int(os.getenv("LOG_MAX_BYTES_PER_REQUEST", str(64 * 1024))),
+    payload_sample_rate=float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.0")),
 )
 logger = logging.getLogger(__name__)
 
-# Instancia de OpenAI
-try:
-    openai_client = AsyncOpenAI()
-except Exception as e:
-    logger.error(f"Error al inicializar el cliente de OpenAI: {e}")
-    raise Exception(f"Error al inicializar el cliente de OpenAI: {e}")
+# Presupuesto global de bytes en vuelo para imágenes y cuerpos de petición (por defecto 512 MiB).
+MEMORY_BUDGET_BYTES = int(os.getenv("MEMORY_BUDGET_BYTES", str(512 * 1024 * 1024)))
+
+# Diagnóstico (desactivado por defecto): detector de bloqueos del event loop y perfilado por trabajo.
+LOOP_STALL_THRESHOLD_MS = int(os.getenv("LOOP_STALL_THRESHOLD_MS", "0")) # 0 = desactivado
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0.0"))
+PROFILE_ALLOW_HEADER = os.getenv("PROFILE_ALLOW_HEADER", "false").lower() in ("1", "true", "yes")
+
+# Almacenamiento temporal de las subidas: los archivos pequeños se quedan en memoria y el resto va a disco con cuota.
+TEMP_DIR = Path(os.getenv("TEMP_DIR", "temp"))
+TEMP_MEMORY_MAX_FILE_BYTES = int(os.getenv("TEMP_MEMORY_MAX_FILE_BYTES", str(2 * 1024 * 1024)))
+TEMP_MEMORY_MAX_BYTES = int(os.getenv("TEMP_MEMORY_MAX_BYTES", str(128 * 1024 * 1024))) # 0 = todo a disco
+TEMP_DISK_QUOTA_BYTES = int(os.getenv("TEMP_DISK_QUOTA_BYTES", str(2 * 1024 * 1024 * 1024))) # 0 = sin cuota
+TEMP_SWEEP_INTERVAL_SECONDS = int(os.getenv("TEMP_SWEEP_INTERVAL_SECONDS", "300")) # 0 = solo al arrancar
+TEMP_ORPHAN_MAX_AGE_SECONDS = int(os.getenv("TEMP_ORPHAN_MAX_AGE_SECONDS", "3600"))
+
+# Claves de idempotencia de las subidas: vigencia y máximo de claves en memoria.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+
+# Subidas por lotes (`POST /{endpoint_id}/batch`).
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50000"))
+BATCH_MAX_ITEM_BYTES = int(os.getenv("BATCH_MAX_ITEM_BYTES", str(20 * 1024 * 1024))) # por entrada descomprimida
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8")) # trabajos simultáneos entre todos los lotes del proceso
+
+# Modo diferido (`priority: "deferred"`): lotes JSONL para la Batch API de OpenAI.
+DEFERRED_BATCH_DIR = Path(os.getenv("DEFERRED_BATCH_DIR", "deferred"))
+DEFERRED_BATCH_MAX_REQUESTS = int(os.getenv("DEFERRED_BATCH_MAX_REQUESTS", "1000"))
+DEFERRED_BATCH_MAX_BYTES = int(os.getenv("DEFERRED_BATCH_MAX_BYTES", str(100 * 1024 * 1024)))
+DEFERRED_BATCH_MAX_WAIT_SECONDS = float(os.getenv("DEFERRED_BATCH_MAX_WAIT_SECONDS", "60"))
+DEFERRED_POLL_INTERVAL_SECONDS = float(os.getenv("DEFERRED_POLL_INTERVAL_SECONDS", "30"))
+
+# Extracción de texto de PDF por defecto: por maquetación (columnas y encabezados) o la de `get_text()`.
+PDF_TEXT_LAYOUT = os.getenv("PDF_TEXT_LAYOUT", "true").lower() in ("1", "true", "yes")
+
+# Resultados comprimidos y direccionados por contenido (tabla `result_blobs`).
+RESULT_COMPRESSION = os.getenv("RESULT_COMPRESSION", "gzip").lower() # 'gzip' o 'zstd' (requiere `zstandard`)
+RESULT_COMPRESSION_LEVEL = int(os.getenv("RESULT_COMPRESSION_LEVEL", "0")) # 0 = nivel por defecto del códec
+RESULT_SPLIT_FIELD_BYTES = int(os.getenv("RESULT_SPLIT_FIELD_BYTES", str(16 * 1024)))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Compresión gzip de las respuestas de la API a partir de este tamaño (SSE y rangos quedan fuera).
+GZIP_MIN_SIZE_BYTES = int(os.getenv("GZIP_MIN_SIZE_BYTES", "1024"))
+
+# Lanzador multiproceso (`python -m src.launcher`): workers de la API, workers de CPU y reciclado.
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0")) # 0 = render, extracción y OCR en los hilos de cada worker
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "0")) # 0 = sin reciclado
+CPU_WORKER_MAX_JOBS = int(os.getenv("CPU_WORKER_MAX_JOBS", "500")) # 0 = sin reciclado
+WORKER_DRAIN_TIMEOUT_SECONDS = int(os.getenv("WORKER_DRAIN_TIMEOUT_SECONDS", "300"))
+CPU_TASK_TIMEOUT_SECONDS = float(os.getenv("CPU_TASK_TIMEOUT_SECONDS", "300"))
+
+# Caché compartida entre procesos (SQLite local): claves de API, endpoints y blobs de resultados.
+SHARED_CACHE_PATH = Path(os.getenv("SHARED_CACHE_PATH")) if os.getenv("SHARED_CACHE_PATH") else None # sin ruta = desactivada
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+AUTH_CACHE_TTL_SECONDS = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "30"))
+ENDPOINT_CACHE_TTL_SECONDS = float(os.getenv("ENDPOINT_CACHE_TTL_SECONDS", "30"))
+
+# Umbrales de saturación: por encima de cualquiera, /health/ready responde 503 y las subidas se rechazan.
+READY_MAX_QUEUED_JOBS = int(os.getenv("READY_MAX_QUEUED_JOBS", "50"))
+READY_MAX_IN_FLIGHT_JOBS = int(os.getenv("READY_MAX_IN_FLIGHT_JOBS", "20"))
+READY_MAX_LOOP_LAG_MS = int(os.getenv("READY_MAX_LOOP_LAG_MS", "500"))
+READY_MAX_TEMP_BYTES = int(os.getenv("READY_MAX_TEMP_BYTES", str(1024 * 1024 * 1024)))
+READY_MAX_DEPENDENCY_FAILURES = int(os.getenv("READY_MAX_DEPENDENCY_FAILURES", "5"))
+# Los fallos de una dependencia más antiguos que esto no cuentan: sin tráfico, la readiness se recupera sola.
+READY_DEPENDENCY_FAILURE_WINDOW_SECONDS = float(os.getenv("READY_DEPENDENCY_FAILURE_WINDOW_SECONDS", "60"))
+SHED_RETRY_AFTER_SECONDS = int(os.getenv("SHED_RETRY_AFTER_SECONDS", "5"))
+
+# Cassettes de OpenAI: 'off' (API real), 'record' (API real + grabación) o 'replay' (sin red).
+OPENAI_CASSETTE_MODE = os.getenv("OPENAI_CASSETTE_MODE", "off").lower()
+OPENAI_CASSETTE_DIR = Path(os.getenv("OPENAI_CASSETTE_DIR", "cassettes"))
+OPENAI_CASSETTE_LATENCY_SCALE = float(os.getenv("OPENAI_CASSETTE_LATENCY_SCALE", "0")) # 0 = sin esperas; 1 = latencia grabada
+if OPENAI_CASSETTE_MODE not in CASSETTE_MODES:
+    raise Exception(f"OPENAI_CASSETTE_MODE inválido: {OPENAI_CASSETTE_MODE}. Valores: {', '.join(CASSETTE_MODES)}")
+
+# Instancia de OpenAI: se crea en el primer uso (o en el calentamiento del arranque), de modo que
+# importar la app no carga el SDK. En modo replay no hace falta API Key: no hay cliente real.
+_openai_client_instance = None
+_openai_client_lock = threading.Lock() # el calentamiento lo crea desde un hilo del executor
+
+def get_openai_client():
+    global _openai_client_instance
+    if _openai_client_instance is not None:
+        return _openai_client_instance
+    with _openai_client_lock:
+        if _openai_client_instance is not None:
+            return _openai_client_instance
+        try:
+            real_client = None
+            if OPENAI_CASSETTE_MODE != "replay":
+                from openai import AsyncOpenAI
+                real_client = AsyncOpenAI()
+            _openai_client_instance = wrap_client(
+                real_client, OPENAI_CASSETTE_MODE, OPENAI_CASSETTE_DIR, OPENAI_CASSETTE_LATENCY_SCALE
+            )
+        except Exception as e:
+            logger.error(f"Error al inicializar el cliente de OpenAI: {e}")
+            raise Exception(f"Error al inicializar el cliente de OpenAI: {e}")
+    return _openai_client_instance
+
+def __getattr__(name: str):
+    # Compatibilidad con `from src.config import openai_client` (scripts de tests/).
+    if name == "openai_client":
+        return get_openai_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Declaración de Supabase Client (se inicializará en el evento de startup de FastAPI)
-_supabase_client_instance: Optional[Client] = None
+# Declaración de Supabase Client (se inicializa en el lifespan de FastAPI)
+_supabase_client_instance: Optional["Client"] = None
 
-def set_supabase_client(client: Client):
+def set_supabase_client(client: "Client"):
     global _supabase_client_instance
     _supabase_client_instance = client
 
-def get_supabase_client() -> Client:
+def get_supabase_client() -> "Client":
     if _supabase_client_instance is None:
         raise RuntimeError("Supabase client has not been initialized.")
     return _supabase_client_instance
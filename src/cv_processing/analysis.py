@@ -1,97 +1,216 @@
+import asyncio
+import functools
 import os
 import json
-import base64
-import io
 import mimetypes
 from pathlib import Path
 from typing import Tuple
-from PIL import Image
-import fitz
 
-from src.config import logger, openai_client
+from src.config import logger, get_openai_client
+from src.log_pipeline import log_payload_dump, request_id_var
 from src.exceptions import OpenAIError
 from src.models import Usage
+from src import metrics, timeline
+from . import extraction, memory, page_selection
+from .cpu_pool import pool as cpu_pool
+from .deferred import awaiting_batch, batcher as deferred_batcher, release_job_resources
+from .streaming import TopLevelFieldParser, broker
+from .page_selection import PageBudget, PageScore
+from .temp_storage import StoredFile, local_path, read_bytes
 
-async def extract_info_with_openai_vision(file_path: Path, output_schema: dict) -> Tuple[dict, Usage]:
-    if not file_path.exists():
+OPENAI_MODEL = "gpt-5-nano"
+
+def _plan_pdf_pages(file_path: StoredFile | Path, page_budget: PageBudget) -> list[PageScore]:
+    """
+    Puntúa las páginas del PDF y selecciona las más relevantes dentro del presupuesto,
+    sin rasterizar ninguna. Operación síncrona (CPU): se ejecuta en un executor.
+    """
+    document = extraction.open_pdf(file_path)
+    try:
+        scores = page_selection.score_pages(document)
+    finally:
+        document.close()
+    selected = page_selection.select_pages(scores, page_budget)
+    skipped = [s.index + 1 for s in scores if s not in selected]
+    if skipped:
+        logger.info(f"CV {file_path.name}: páginas descartadas para visión {skipped} (presupuesto {page_budget}).")
+    return selected
+
+def _render_pdf_pages(file_path: StoredFile | Path, pages: list[PageScore]) -> list[dict]:
+    """
+    Rasteriza únicamente las páginas elegidas (en un worker de CPU si el pool está activo).
+    Cada PNG se libera en cuanto la página queda codificada, de modo que solo sobreviven
+    las data URLs.
+    """
+    source = file_path.detached() if isinstance(file_path, StoredFile) else file_path
+    indexes = [p.index for p in pages]
+    pngs = dict(zip(indexes, cpu_pool.call(extraction.render_pages_png, source, indexes)))
+    content = []
+    for page_score in pages:
+        data_url = memory.bytes_to_data_url(pngs.pop(page_score.index), "image/png")
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": data_url, "detail": page_score.detail}
+        })
+    return content
+
+async def _stream_completion(**request) -> Tuple[str, Usage | None]:
+    """
+    Lanza la petición en modo streaming y devuelve el texto completo y el uso de tokens.
+    Cada campo de primer nivel del JSON se publica a los suscriptores SSE en cuanto se cierra.
+    """
+    request_id = request_id_var.get()
+    parser = TopLevelFieldParser()
+    parts: list[str] = []
+    usage = None
+    first_field = True
+    stream = await get_openai_client().chat.completions.create(
+        stream=True, stream_options={"include_usage": True}, **request
+    )
+    async for chunk in stream:
+        if chunk.usage:
+            usage = Usage.model_validate(chunk.usage.model_dump())
+        for choice in chunk.choices:
+            delta = choice.delta.content
+            if not delta:
+                continue
+            parts.append(delta)
+            for name, value in parser.feed(delta):
+                if first_field:
+                    timeline.mark("first_field", field=name)
+                    first_field = False
+                broker.publish(request_id, "field", {"name": name, "value": value, "source": "model"})
+    return "".join(parts), usage
+
+async def _realtime_completion(api: str, span_attrs: dict, **request) -> Tuple[str, Usage | None]:
+    with (
+        metrics.observe_openai(api, OPENAI_MODEL),
+        timeline.span("openai", api=api, **span_attrs) as call,
+    ):
+        json_text, usage = await _stream_completion(**request)
+        call["tokens"] = usage.total_tokens if usage else None
+    return json_text, usage
+
+async def _deferred_completion(api: str, span_attrs: dict, pending: asyncio.Future) -> Tuple[str, Usage | None]:
+    """Espera el resultado de una petición enviada a un lote diferido."""
+    # Mientras espera, el trabajo no cuenta como "en vuelo" (lo cuenta cv_deferred_requests_pending):
+    # un lote de horas no debe saturar la readiness ni ocupar la cuota temporal.
+    metrics.JOBS_IN_FLIGHT.dec()
+    await release_job_resources()
+    try:
+        with awaiting_batch(), timeline.span("openai", api=api, deferred=True, **span_attrs) as call:
+            json_text, usage = await pending
+            call["tokens"] = usage.total_tokens if usage else None
+    finally:
+        metrics.JOBS_IN_FLIGHT.inc()
+    # Sin streaming: los campos se publican a los suscriptores SSE todos a la vez.
+    request_id = request_id_var.get()
+    for name, value in TopLevelFieldParser().feed(json_text):
+        broker.publish(request_id, "field", {"name": name, "value": value, "source": "model"})
+    return json_text, usage
+
+def parse_response(label: str, json_text: str, usage: Usage | None) -> Tuple[dict, Usage]:
+    log_payload_dump(logger, f"{label} response", lambda: json_text)
+    json_text = json_text.strip()
+    if not json_text or usage is None:
+        raise OpenAIError(f"La API de {label} devolvió una respuesta vacía.")
+    metrics.record_token_usage(OPENAI_MODEL, usage.prompt_tokens, usage.completion_tokens)
+    return json.loads(json_text), usage
+
+def _image_file_content(file_path: StoredFile | Path, mime_type: str) -> list[dict]:
+    """
+    Codifica una imagen. En disco se lee por bloques, sin mantener a la vez los bytes
+    originales y su base64; en memoria se codifica directamente el buffer de la subida.
+    """
+    data = read_bytes(file_path)
+    if data is not None:
+        url = memory.bytes_to_data_url(data, mime_type)
+    else:
+        url = memory.file_to_data_url(local_path(file_path), mime_type)
+    return [{"type": "image_url", "image_url": {"url": url, "detail": "high"}}]
+
+async def extract_info_with_openai_vision(
+    file_path: StoredFile | Path, output_schema: dict, page_budget: PageBudget | None = None, deferred: bool = False
+) -> Tuple[dict, Usage]:
+    if isinstance(file_path, Path) and not file_path.exists():
         raise FileNotFoundError(f"Archivo no encontrado para OpenAI Vision: {file_path}")
 
     messages_content = [{"type": "text", "text": "Extrae toda la información de este archivo en formato JSON exacto."}]
     
     mime_type, _ = mimetypes.guess_type(file_path.name)
+    loop = asyncio.get_running_loop()
     
     if mime_type == "application/pdf":
         try:
-            document = fitz.open(file_path)
-            for page_num, page in enumerate(document):
-                if page_num >= 10:
-                    logger.warning(f"CV {file_path.name} tiene más de 10 páginas. Solo se procesarán las primeras 10.")
-                    break
-                pix = page.get_pixmap()
-                img_bytes = io.BytesIO()
-                Image.frombytes("RGB", [pix.width, pix.height], pix.samples).save(img_bytes, format="PNG")
-                base64_image = base64.b64encode(img_bytes.getvalue()).decode("utf-8")
-                messages_content.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/png;base64,{base64_image}", "detail": "high"}
-                })
-            document.close()
-            if len(messages_content) == 1:
-                raise OpenAIError(f"No se pudo extraer ninguna imagen de las páginas del PDF {file_path.name}.")
+            with metrics.observe_stage("vision_plan", mime_type):
+                pages = await loop.run_in_executor(None, _plan_pdf_pages, file_path, page_budget or PageBudget())
         except Exception as e:
             raise OpenAIError(f"Error al procesar PDF para OpenAI Vision {file_path.name}: {e}")
+        if not pages:
+            raise OpenAIError(f"No se pudo extraer ninguna imagen de las páginas del PDF {file_path.name}.")
+        footprint = sum(memory.estimate_page_footprint(p.width, p.height) for p in pages)
+        build_images = functools.partial(_render_pdf_pages, file_path, pages)
     elif mime_type and mime_type.startswith("image/"):
-        try:
-            with open(file_path, "rb") as image_file:
-                base64_image = base64.b64encode(image_file.read()).decode("utf-8")
-            messages_content.append({
-                "type": "image_url",
-                "image_url": {"url": f"data:{mime_type};base64,{base64_image}", "detail": "high"}
-            })
-        except Exception as e:
-            raise OpenAIError(f"Error al procesar imagen para OpenAI Vision {file_path.name}: {e}")
+        size = file_path.size if isinstance(file_path, StoredFile) else file_path.stat().st_size
+        footprint = memory.estimate_image_footprint(size)
+        build_images = functools.partial(_image_file_content, file_path, mime_type)
     else:
         raise OpenAIError(f"Tipo de archivo no soportado para OpenAI Vision: {mime_type} en {file_path.name}")
     
     schema_string = json.dumps(output_schema, indent=2, ensure_ascii=False)
     system_prompt = f"""
+    Eres un agente de IA autónomo. Tu objetivo es analizar las imágenes del documento y extraer la información solicitada en un formato JSON estricto.
+    ESQUEMA DE SALIDA REQUERIDO (DEBES SEGUIRLO ESTRICTAMENTE):
+    {schema_string}
     REGLAS ADICIONALES:
     - Tu respuesta debe ser ÚNICAMENTE el objeto JSON puro y válido. No incluyas texto introductorio, comentarios, ni bloques de código.
     - NO INCLUYAS las claves 'schema' o 'callbackURL' en el objeto JSON de tu respuesta.
     - Si el documento está en blanco, no contiene información relevante o no puedes extraer ningún dato, DEBES devolver un objeto JSON que se ajuste al esquema pero con todos sus campos establecidos en `null` o listas vacías `[]` según corresponda. NO devuelvas una cadena vacía.
     """
     
-    try:
-        # ---- START DEBUG LOGGING ----
-        logger.info("--- INICIO DEBUG: OpenAI Vision Request ---")
-        logger.info(f"Modelo: gpt-5-nano")
-        logger.info(f"System Prompt: {system_prompt}")
-        logger.info(f"Número de imágenes enviadas: {len(messages_content) - 1}")
-        # ---- FIN DEBUG LOGGING ----
-
-        response = await openai_client.chat.completions.create(
-            model="gpt-5-nano",
-            messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": messages_content}],
-            response_format={"type": "json_object"},
-            max_completion_tokens=20000,
-        )
+    pending = None
+    async with memory.memory_budget.reserve(footprint):
+        try:
+            with metrics.observe_stage("vision_render", mime_type), timeline.span("render"):
+                messages_content.extend(await loop.run_in_executor(None, build_images))
+        except Exception as e:
+            raise OpenAIError(f"Error al preparar las imágenes para OpenAI Vision {file_path.name}: {e}")
+
+        span_attrs = {"images": len(messages_content) - 1}
+        try:
+            logger.info(
+                f"OpenAI Vision request: modelo={OPENAI_MODEL}, imágenes={len(messages_content) - 1}, "
+                f"memoria reservada={footprint} bytes ({memory.memory_budget.snapshot()}), diferida={deferred}"
+            )
+            log_payload_dump(logger, "OpenAI Vision system prompt", lambda: system_prompt)
+
+            request = dict(
+                model=OPENAI_MODEL,
+                messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": messages_content}],
+                response_format={"type": "json_object"},
+                max_completion_tokens=20000,
+            )
+            if deferred:
+                # La petición ya está escrita en el JSONL del lote: la reserva se libera sin esperar al resultado.
+                pending = await deferred_batcher.enqueue("vision", request)
+            else:
+                json_text, usage = await _realtime_completion("vision", span_attrs, **request)
+        except Exception as e:
+            logger.exception(f"Error al procesar el CV con OpenAI Vision: {e}")
+            raise OpenAIError("Error en la llamada a la API de OpenAI Vision.")
+        finally:
+            # Suelta las data URLs antes de liberar la reserva.
+            messages_content.clear()
 
-        # ---- START DEBUG LOGGING ----
-        logger.info("--- INICIO DEBUG: OpenAI Vision Response ---")
-        logger.info(response.model_dump_json(indent=2))
-        logger.info("--- FIN DEBUG: OpenAI Vision Response ---")
-        # ---- FIN DEBUG LOGGING ----
-        
-        json_text = response.choices[0].message.content.strip()
-        if not json_text:
-            raise OpenAIError("La API de OpenAI devolvió una respuesta vacía.")
-        usage = Usage.model_validate(response.usage.model_dump())
-        return json.loads(json_text), usage
+    try:
+        if pending is not None:
+            json_text, usage = await _deferred_completion("vision", span_attrs, pending)
+        return parse_response("OpenAI Vision", json_text, usage)
     except Exception as e:
         logger.exception(f"Error al procesar el CV con OpenAI Vision: {e}")
         raise OpenAIError("Error en la llamada a la API de OpenAI Vision.")
 
-async def extract_info_from_text_with_openai(text: str, output_schema: dict) -> Tuple[dict, Usage]:
+async def extract_info_from_text_with_openai(text: str, output_schema: dict, deferred: bool = False) -> Tuple[dict, Usage]:
     if not text:
         raise ValueError("El texto de entrada no puede estar vacío.")
 
@@ -108,30 +227,21 @@ async def extract_info_from_text_with_openai(text: str, output_schema: dict) ->
     user_prompt = f"Analiza el siguiente texto y extrae la información en el formato JSON especificado:\n---\n{text}"
 
     try:
-        # ---- START DEBUG LOGGING ----
-        logger.info("--- INICIO DEBUG: OpenAI Text Request ---")
-        logger.info(f"Modelo: gpt-5-nano")
-        logger.info(f"System Prompt: {system_prompt}")
-        logger.info(f"Longitud del User Prompt: {len(user_prompt)}")
-        # ---- FIN DEBUG LOGGING ----
-
-        response = await openai_client.chat.completions.create(
-            model="gpt-5-nano",
+        logger.info(f"OpenAI Text request: modelo={OPENAI_MODEL}, longitud del user prompt={len(user_prompt)}, diferida={deferred}")
+        log_payload_dump(logger, "OpenAI Text system prompt", lambda: system_prompt)
+
+        request = dict(
+            model=OPENAI_MODEL,
             response_format={"type": "json_object"},
             messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}],
         )
-
-        # ---- START DEBUG LOGGING ----
-        logger.info("--- INICIO DEBUG: OpenAI Text Response ---")
-        logger.info(response.model_dump_json(indent=2))
-        logger.info("--- FIN DEBUG: OpenAI Text Response ---")
-        # ---- FIN DEBUG LOGGING ----
-        
-        json_text = response.choices[0].message.content.strip()
-        if not json_text:
-            raise OpenAIError("La API de OpenAI (texto) devolvió una respuesta vacía.")
-        usage = Usage.model_validate(response.usage.model_dump())
-        return json.loads(json_text), usage
+        span_attrs = {"chars": len(user_prompt)}
+        if deferred:
+            pending = await deferred_batcher.enqueue("text", request)
+            json_text, usage = await _deferred_completion("text", span_attrs, pending)
+        else:
+            json_text, usage = await _realtime_completion("text", span_attrs, **request)
+        return parse_response("OpenAI (texto)", json_text, usage)
     except Exception as e:
         logger.exception(f"Error en la API de OpenAI (texto): {e}")
         raise OpenAIError("Error en la llamada a la API de OpenAI (texto).")
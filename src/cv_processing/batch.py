@@ -0,0 +1,285 @@
+"""
+Subidas por lotes: muchos archivos (o archivos ZIP) en una sola petición HTTP.
+
+Un lote hace una sola verificación de API Key y de endpoint e inserta las filas de
+`requests` en bloque. Los archivos sueltos se guardan en el almacenamiento temporal al
+aceptar el lote. De los ZIP solo se guarda el archivo comprimido: cada entrada se
+descomprime (a memoria o a disco, según su tamaño) cuando un trabajador la toma, así
+que un ZIP con miles de CVs nunca está descomprimido entero.
+
+El procesamiento llama a `process_cv_and_callback` por elemento (mismo pipeline, mismo
+presupuesto de memoria y mismos webhooks por petición), con como mucho
+`BATCH_CONCURRENCY` elementos a la vez entre todos los lotes del proceso. Un elemento
+de un endpoint diferido ocupa su plaza solo hasta escribir su línea en el lote del
+proveedor: la espera del resultado (hasta 24 h) no bloquea al resto. Opcionalmente, al
+terminar todo el lote se envía un callback agregado con el estado de cada petición.
+"""
+import asyncio
+import io
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from uuid import UUID, uuid4
+
+from fastapi import UploadFile
+
+from src import metrics
+from src.config import logger, get_supabase_client, BATCH_CONCURRENCY, BATCH_MAX_ITEMS, BATCH_MAX_ITEM_BYTES
+from src.exceptions import InvalidBatchError
+from src.log_pipeline import request_id_var
+from src.models import AuthActor
+from .deferred import notify_on_wait
+from .service import close_after_cancel, process_cv_and_callback, send_callback
+from .temp_storage import StoredFile, storage
+
+SUPPORTED_SUFFIXES = (".pdf", ".docx", ".png", ".jpg", ".jpeg")
+# Filas por inserción en bloque (PostgREST acepta arrays; trozos acotados para no generar cuerpos enormes).
+_INSERT_CHUNK_ROWS = 500
+
+# Plazas compartidas por todos los lotes: N lotes a la vez no multiplican la concurrencia.
+_slots: asyncio.Semaphore | None = None
+
+BATCH_ITEMS_PENDING = metrics.registry.register(metrics.Gauge(
+    "cv_batch_items_pending", "Elementos de lotes aceptados que aún no han empezado a procesarse."))
+BATCHES_RUNNING = metrics.registry.register(metrics.Gauge(
+    "cv_batches_running",
+    "Lotes con elementos por empezar o en proceso, sin contar los que solo esperan un lote diferido "
+    "(el reciclado del worker espera a que terminen)."))
+
+
+@dataclass
+class _Archive:
+    stored: StoredFile
+    zip: zipfile.ZipFile
+
+
+@dataclass
+class BatchItem:
+    filename: str
+    upload: UploadFile | None = None
+    archive: _Archive | None = None
+    entry: zipfile.ZipInfo | None = None
+    request_id: str | None = None
+    stored: StoredFile | None = None
+    status: str = "queued"
+
+
+def _batch_slots() -> asyncio.Semaphore:
+    # Se crea perezosamente para quedar ligado al event loop que lo usa.
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+    return _slots
+
+
+def _open_archive(batch_id: str, index: int, upload: UploadFile) -> _Archive:
+    """Guarda un ZIP subido y abre su índice (síncrono: se llama desde el executor)."""
+    stored = storage.store(f"batch_{batch_id}_{index}", upload.filename or "archive.zip", upload.file, upload.size)
+    try:
+        source = io.BytesIO(stored.data) if stored.data is not None else stored.path
+        return _Archive(stored, zipfile.ZipFile(source))
+    except zipfile.BadZipFile:
+        storage.release(stored)
+        raise InvalidBatchError(f"El archivo '{upload.filename}' no es un ZIP válido.")
+
+
+def _zip_items(archive: _Archive, skipped: list[dict]) -> list[BatchItem]:
+    items = []
+    for entry in archive.zip.infolist():
+        path = PurePosixPath(entry.filename)
+        if entry.is_dir() or path.name.startswith(".") or "__MACOSX" in path.parts:
+            continue
+        if path.suffix.lower() not in SUPPORTED_SUFFIXES:
+            skipped.append({"filename": entry.filename, "reason": "tipo de archivo no soportado"})
+        elif entry.file_size > BATCH_MAX_ITEM_BYTES:
+            skipped.append({"filename": entry.filename, "reason": f"supera {BATCH_MAX_ITEM_BYTES} bytes descomprimido"})
+        else:
+            items.append(BatchItem(path.name, archive=archive, entry=entry))
+    return items
+
+
+class Batch:
+    def __init__(self, endpoint_id: UUID, actor: AuthActor, endpoint_data: dict, callback_url: str | None = None):
+        self.id = str(uuid4())
+        self.endpoint_id = endpoint_id
+        self.actor = actor
+        self.secret_webhook = endpoint_data.get("secret_webhook")
+        self.callback_url = callback_url
+        self.items: list[BatchItem] = []
+        self.skipped: list[dict] = []
+        self.archives: list[_Archive] = []
+        self._tasks: list[asyncio.Task] = [] # uno por elemento empezado
+
+    # --- aceptación ---
+
+    def collect(self, uploads: list[UploadFile]):
+        """Expande los ZIP y clasifica los archivos (síncrono: se llama desde el executor)."""
+        for index, upload in enumerate(uploads):
+            name = Path(upload.filename or "").name
+            if name.lower().endswith(".zip"):
+                archive = _open_archive(self.id, index, upload)
+                self.archives.append(archive)
+                self.items.extend(_zip_items(archive, self.skipped))
+            elif Path(name).suffix.lower() in SUPPORTED_SUFFIXES:
+                self.items.append(BatchItem(name, upload=upload))
+            else:
+                self.skipped.append({"filename": name, "reason": "tipo de archivo no soportado"})
+            if len(self.items) > BATCH_MAX_ITEMS:
+                raise InvalidBatchError(f"El lote supera el máximo de {BATCH_MAX_ITEMS} archivos.")
+
+    async def register(self):
+        """Inserta las filas de `requests` en bloque y asigna un `request_id` a cada elemento."""
+        row = {
+            "id_user": self.actor.user_id,
+            "id_key": str(self.actor.key_id),
+            "endpoint_id": str(self.endpoint_id),
+            "status": "processing",
+        }
+        supabase = get_supabase_client()
+        for start in range(0, len(self.items), _INSERT_CHUNK_ROWS):
+            chunk = self.items[start:start + _INSERT_CHUNK_ROWS]
+            with metrics.observe_supabase("requests", "insert"):
+                response = await supabase.from_("requests").insert([row] * len(chunk)).execute()
+            for item, inserted in zip(chunk, response.data):
+                item.request_id = str(inserted["id_request"])
+
+    def store_uploads(self):
+        """Guarda los archivos sueltos bajo su `request_id` (síncrono: se llama desde el executor)."""
+        for item in self.items:
+            if item.upload is not None:
+                item.stored = storage.store(item.request_id, item.filename, item.upload.file, item.upload.size)
+                item.upload = None
+
+    async def abort(self, error: str):
+        """El lote no llega a aceptarse: cierra como fallidas las filas ya insertadas y libera los archivos."""
+        registered = [item.request_id for item in self.items if item.request_id is not None]
+        if registered:
+            await _mark_failed(registered, error)
+        await asyncio.get_running_loop().run_in_executor(None, self._discard)
+
+    def _discard(self):
+        for item in self.items:
+            if item.stored is not None:
+                storage.release(item.stored)
+        self._close_archives()
+
+    def _close_archives(self):
+        for archive in self.archives:
+            archive.zip.close()
+            storage.release(archive.stored)
+        self.archives.clear()
+
+    def summary(self) -> dict:
+        return {
+            "batch_id": self.id,
+            "items": [{"filename": item.filename, "request_id": item.request_id} for item in self.items],
+            "skipped": self.skipped,
+        }
+
+    # --- procesamiento ---
+
+    def _extract(self, item: BatchItem) -> StoredFile:
+        with item.archive.zip.open(item.entry) as source:
+            return storage.store(item.request_id, item.filename, source, item.entry.file_size)
+
+    async def _process(self, item: BatchItem, waiting: asyncio.Event):
+        BATCH_ITEMS_PENDING.dec()
+        request_id_var.set(item.request_id)
+        stored = item.stored
+        if stored is None:
+            try:
+                stored = await asyncio.get_running_loop().run_in_executor(None, self._extract, item)
+            except Exception as e:
+                logger.error(f"No se pudo descomprimir '{item.entry.filename}' del lote {self.id}: {e}")
+                item.status = "failed"
+                await _mark_failed([item.request_id], f"No se pudo descomprimir el archivo del ZIP: {e}")
+                return
+        metrics.JOBS_QUEUED.inc()
+        item.status = "processing" # si se cancela, lo cierra `process_cv_and_callback`
+        with notify_on_wait(waiting.set):
+            item.status = await process_cv_and_callback(UUID(item.request_id), stored, source="batch")
+
+    async def _worker(self, queue):
+        """Toma elementos mientras el anterior termina o queda esperando su lote diferido (y suelta la plaza)."""
+        slots = _batch_slots()
+        loop = asyncio.get_running_loop()
+        for item in queue:
+            async with slots:
+                waiting = asyncio.Event()
+                task = loop.create_task(self._process(item, waiting))
+                self._tasks.append(task)
+                waiter = loop.create_task(waiting.wait())
+                try:
+                    await asyncio.wait((task, waiter), return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    waiter.cancel()
+
+    async def run(self):
+        """Procesa todos los elementos con la concurrencia global de lotes y envía el callback agregado."""
+        BATCH_ITEMS_PENDING.inc(len(self.items))
+        BATCHES_RUNNING.inc()
+        loop = asyncio.get_running_loop()
+        queue = iter(self.items) # compartido: cada trabajador toma el siguiente elemento libre
+        running = True
+        try:
+            workers = min(BATCH_CONCURRENCY, len(self.items))
+            await asyncio.gather(*(self._worker(queue) for _ in range(workers)))
+            # Todos empezados: los ZIP ya no hacen falta, y lo que queda solo espera su lote diferido
+            # (el reciclado del worker no lo espera: el lote lo adopta otro proceso).
+            await loop.run_in_executor(None, self._close_archives)
+            running = False
+            BATCHES_RUNNING.dec()
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            for task in self._tasks:
+                task.cancel() # los que esperan su lote diferido quedan para quien lo adopte
+            # El worker se para sin haber terminado el lote: lo que no empezó no puede quedarse en 'processing'.
+            queued = [item.request_id for item in self.items if item.status == "queued"]
+            logger.error(f"Lote {self.id} cancelado por la parada del worker: {len(queued)} elementos sin empezar se cierran como fallidos.")
+            if queued:
+                close_after_cancel(_mark_failed(queued, "El lote se interrumpió porque el worker se detuvo."))
+            raise
+        finally:
+            if running:
+                BATCHES_RUNNING.dec()
+            BATCH_ITEMS_PENDING.dec(len(self.items) - len(self._tasks)) # los no empezados
+            await loop.run_in_executor(None, self._close_archives)
+
+        completed = sum(1 for item in self.items if item.status == "completed")
+        logger.info(f"Lote {self.id} terminado: {completed}/{len(self.items)} completados.")
+        if self.callback_url:
+            payload = {
+                "batch_id": self.id,
+                "status": "completed",
+                "total": len(self.items),
+                "completed": completed,
+                "failed": len(self.items) - completed,
+                "items": [
+                    {"request_id": item.request_id, "filename": item.filename, "status": item.status}
+                    for item in self.items
+                ],
+                "skipped": self.skipped,
+            }
+            await send_callback(self.callback_url, payload, self.id, self.endpoint_id, self.secret_webhook)
+
+
+async def _mark_failed(request_ids: list[str], error: str):
+    """Cierra como fallidas peticiones que no llegaron al pipeline (primero el log, después el estado)."""
+    supabase = get_supabase_client()
+    try:
+        for start in range(0, len(request_ids), _INSERT_CHUNK_ROWS):
+            chunk = request_ids[start:start + _INSERT_CHUNK_ROWS]
+            with metrics.observe_supabase("request_logs", "insert"):
+                await supabase.from_("request_logs").insert([
+                    {
+                        "id_request": id_request,
+                        "payload_out": {"request_id": id_request, "status": "failed", "error": error, "data": None},
+                        "error": error,
+                        "credit_use": 0,
+                    }
+                    for id_request in chunk
+                ]).execute()
+            with metrics.observe_supabase("requests", "update"):
+                await supabase.from_("requests").update({"status": "failed"}).in_("id_request", chunk).execute()
+    except Exception as e:
+        logger.exception(f"Error al registrar el fallo de {len(request_ids)} peticiones ({request_ids[0]}...): {e}")
@@ -0,0 +1,140 @@
+"""
+Workers de CPU compartidos por los workers de la API (`src/launcher.py`, `CPU_WORKERS`).
+
+El render de páginas, la extracción de texto y el OCR son trabajo de CPU que en un worker
+de la API compite por el GIL con el event loop. Con el lanzador, el proceso maestro crea
+antes de hacer fork una cola de tareas común y una cola de resultados por hueco de worker
+de la API (`slot`), y arranca procesos dedicados que consumen la cola de tareas.
+
+- Worker de la API: `call(fn, *args)` desde un hilo del executor encola la tarea y espera
+  su futuro; un hilo lector resuelve los futuros con los resultados de su cola.
+- Worker de CPU: ejecuta tareas hasta `CPU_WORKER_MAX_JOBS` y termina; el maestro lo
+  sustituye. Si muere a mitad de una tarea, el maestro avisa y la tarea falla en lugar
+  de esperar a `CPU_TASK_TIMEOUT_SECONDS`.
+
+Sin lanzador (o con `CPU_WORKERS=0`) el pool no está activo y `call` ejecuta la función en
+el hilo actual, como antes. Las funciones y argumentos viajan serializados (pickle): los
+archivos se pasan con `StoredFile.detached()`.
+"""
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import threading
+from typing import Callable, Iterable
+
+from src import metrics
+from src.config import logger, CPU_TASK_TIMEOUT_SECONDS
+from src.exceptions import FileProcessingError
+
+
+class CpuPool:
+    def __init__(self):
+        self._tasks = None # (slot, id de tarea, función, argumentos)
+        self._results: list = [] # por slot: (tipo, id de tarea, pid del worker de CPU, valor)
+        self._slot: int | None = None
+        self._pending: dict[tuple, concurrent.futures.Future] = {}
+        self._running: dict[tuple, int] = {} # id de tarea -> pid del worker de CPU que la ejecuta
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self._slot is not None
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    # --- proceso maestro ---
+
+    def create(self, slots: int):
+        """Crea las colas antes de hacer fork: los hijos las heredan."""
+        context = multiprocessing.get_context("fork")
+        self._tasks = context.SimpleQueue()
+        self._results = [context.SimpleQueue() for _ in range(slots)]
+
+    def notify_worker_exit(self, pid: int, slots: Iterable[int]):
+        """Un worker de CPU ha terminado: las tareas que tenía en curso no van a responder."""
+        for slot in slots:
+            self._results[slot].put(("exited", None, pid, None))
+
+    def discard_results(self, slot: int):
+        """Vacía la cola de un slot cuyo worker de la API ha terminado, antes de reutilizarlo."""
+        while not self._results[slot].empty():
+            self._results[slot].get()
+
+    # --- worker de CPU ---
+
+    def serve(self, max_jobs: int):
+        done = 0
+        while not max_jobs or done < max_jobs:
+            slot, task_id, fn, args = self._tasks.get()
+            results = self._results[slot]
+            results.put(("started", task_id, os.getpid(), None))
+            try:
+                outcome = ("ok", task_id, os.getpid(), fn(*args))
+            except Exception as e:
+                outcome = ("error", task_id, os.getpid(), e)
+            try:
+                results.put(outcome)
+            except Exception as e: # resultado o excepción que no se puede serializar
+                results.put(("error", task_id, os.getpid(), FileProcessingError(f"Resultado no serializable: {e}")))
+            done += 1
+
+    # --- worker de la API ---
+
+    def attach(self, slot: int):
+        """Activa el pool en este worker de la API (tras el fork) y arranca el hilo lector."""
+        self._slot = slot
+        threading.Thread(target=self._read_results, name="cpu-pool-results", daemon=True).start()
+
+    def _read_results(self):
+        results = self._results[self._slot]
+        while True:
+            kind, task_id, pid, value = results.get()
+            with self._lock:
+                if kind == "started":
+                    if task_id in self._pending:
+                        self._running[task_id] = pid
+                    continue
+                if kind == "exited":
+                    lost = FileProcessingError("El worker de CPU terminó sin completar la tarea.")
+                    outcomes = [(self._pending.get(tid), "error", lost) for tid, p in self._running.items() if p == pid]
+                else:
+                    # Las tareas de un worker anterior en el mismo slot no tienen futuro: se ignoran.
+                    outcomes = [(self._pending.get(task_id), kind, value)]
+            for future, outcome, result in outcomes:
+                if future is None or future.done():
+                    continue
+                if outcome == "ok":
+                    future.set_result(result)
+                else:
+                    future.set_exception(result)
+
+    def call(self, fn: Callable, *args):
+        """
+        Ejecuta `fn(*args)` en un worker de CPU y espera el resultado (síncrono: se llama
+        desde el executor). Sin pool activo, la ejecuta en el hilo actual.
+        """
+        if not self.active:
+            return fn(*args)
+        task_id = (os.getpid(), next(self._ids))
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            self._pending[task_id] = future
+        try:
+            self._tasks.put((self._slot, task_id, fn, args))
+            return future.result(timeout=CPU_TASK_TIMEOUT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            logger.error(f"Tarea de CPU {getattr(fn, '__name__', fn)} sin resultado tras {CPU_TASK_TIMEOUT_SECONDS} s.")
+            raise FileProcessingError("El procesamiento del archivo superó el tiempo máximo.")
+        finally:
+            with self._lock:
+                self._pending.pop(task_id, None)
+                self._running.pop(task_id, None)
+
+
+pool = CpuPool()
+
+metrics.register_callback_gauge(
+    "cv_cpu_tasks_pending", "Tareas de este worker esperando a un worker de CPU.", pool.pending)
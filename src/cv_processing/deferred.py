@@ -0,0 +1,463 @@
+"""
+Modo diferido (`priority: "deferred"` en el `info` del endpoint): las llamadas al modelo
+se envían a la Batch API de OpenAI en lugar de hacerse en tiempo real.
+
+El trabajo se prepara igual que en tiempo real (extracción, render, prompts) y la
+petición a `/v1/chat/completions` se escribe como una línea del JSONL del lote en
+curso (`DEFERRED_BATCH_DIR`). Desde ese momento las imágenes ya no están en memoria: el
+trabajo solo espera un futuro, y libera el archivo temporal y su estado en vivo
+(`DeferredJob.release`). El lote se envía al llegar a `DEFERRED_BATCH_MAX_REQUESTS`
+líneas, a `DEFERRED_BATCH_MAX_BYTES` o a los `DEFERRED_BATCH_MAX_WAIT_SECONDS` desde la
+primera línea. Un sondeo periódico consulta los lotes enviados y, al terminar, resuelve
+cada futuro con el contenido y el uso de tokens, de modo que `process_cv_and_callback`
+sigue con su flujo normal (estado, créditos y webhook).
+
+Cada lote deja en el mismo directorio, además del JSONL:
+
+- `<lote>.meta.jsonl`: por línea, el `custom_id`, el `request_id` y los campos de la
+  pre-extracción local.
+- `<lote>.owner-<pid>.json`: el proceso dueño y, una vez enviado, el id del lote remoto.
+
+Si el dueño ya no existe (reinicio, despliegue, worker reciclado), otro proceso adopta
+el lote renombrando ese archivo: lo envía si no se había enviado y sigue sondeándolo.
+Los resultados que ya no tienen un trabajo esperando se terminan con `recover`
+(ver `service.complete_orphaned_deferred`).
+
+Las llamadas por lotes no consumen el presupuesto de rate limit de las síncronas.
+"""
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from src import metrics
+from src.config import (
+    logger,
+    get_openai_client,
+    DEFERRED_BATCH_DIR,
+    DEFERRED_BATCH_MAX_REQUESTS,
+    DEFERRED_BATCH_MAX_BYTES,
+    DEFERRED_BATCH_MAX_WAIT_SECONDS,
+    DEFERRED_POLL_INTERVAL_SECONDS,
+)
+from src.exceptions import OpenAIError
+from src.log_pipeline import request_id_var
+from src.models import Usage
+from .temp_storage import pid_alive
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Parámetros de streaming: no existen en la Batch API.
+_STREAM_PARAMS = ("stream", "stream_options")
+_OWNER_FILE_RE = re.compile(r"^(batch_[0-9a-f]+)\.owner-(\d+)\.json$")
+# Peticiones huérfanas que se terminan a la vez (cada una escribe en BBDD y envía su webhook).
+_RECOVERY_CONCURRENCY = 8
+
+DEFERRED_BATCHES = metrics.registry.register(metrics.Counter(
+    "cv_deferred_batches_total", "Lotes diferidos por resultado (submitted, completed, failed, expired, cancelled).", ["outcome"]))
+DEFERRED_ADOPTED = metrics.registry.register(metrics.Counter(
+    "cv_deferred_batches_adopted_total", "Lotes diferidos adoptados de un proceso que ya no existe."))
+DEFERRED_RECOVERED = metrics.registry.register(metrics.Counter(
+    "cv_deferred_requests_recovered_total", "Peticiones diferidas terminadas sin su trabajo original."))
+
+Outcome = tuple[str, Usage] | str # (contenido, uso) o mensaje de error
+
+
+@dataclass
+class DeferredJob:
+    """Contexto del trabajo que encola (ContextVar, como `request_id_var`)."""
+
+    local_fields: dict = field(default_factory=dict) # se persisten: la recuperación los fusiona con la respuesta
+    release: Callable[[], Awaitable[None]] | None = None # libera lo que la espera ya no necesita
+    handed_off: bool = False # cancelado esperando su lote: la petición la termina `recover`
+
+
+_job: ContextVar[DeferredJob | None] = ContextVar("deferred_job", default=None)
+# Avisos al empezar a esperar el lote, de quien lanzó el trabajo (p. ej. un lote de subida que le cedió una plaza).
+_wait_listeners: ContextVar[tuple[Callable[[], None], ...]] = ContextVar("deferred_wait_listeners", default=())
+
+
+def bind_job(job: DeferredJob):
+    _job.set(job)
+
+
+def handed_off() -> bool:
+    """El trabajo actual se canceló mientras esperaba su lote (ver `awaiting_batch`)."""
+    job = _job.get()
+    return job is not None and job.handed_off
+
+
+@contextmanager
+def awaiting_batch():
+    """
+    Envuelve la espera del resultado. La línea ya está en disco: si el worker se para y
+    cancela el trabajo aquí, quien sondee el lote (este proceso o el que lo adopte)
+    terminará la petición, así que no hay que cerrarla como fallida.
+    """
+    job = _job.get()
+    try:
+        yield
+    except asyncio.CancelledError:
+        if job is not None:
+            job.handed_off = True
+        raise
+
+
+@contextmanager
+def notify_on_wait(callback: Callable[[], None]):
+    """Dentro del bloque, `callback` se llama cuando el trabajo empieza a esperar su lote diferido."""
+    token = _wait_listeners.set(_wait_listeners.get() + (callback,))
+    try:
+        yield
+    finally:
+        _wait_listeners.reset(token)
+
+
+async def release_job_resources():
+    """Llamado al empezar a esperar el lote: libera (una vez) lo que el trabajo ya no necesita."""
+    for callback in _wait_listeners.get():
+        callback()
+    job = _job.get()
+    if job is None or job.release is None:
+        return
+    release, job.release = job.release, None
+    try:
+        await release()
+    except Exception as e:
+        logger.warning(f"Error al liberar los recursos del trabajo diferido: {e}")
+
+
+@dataclass
+class _Spool:
+    """Lote en construcción o enviado: archivos locales y los futuros de sus líneas en este proceso."""
+
+    name: str
+    directory: Path
+    opened_at: float = field(default_factory=time.monotonic)
+    size: int = 0
+    lines: int = 0
+    futures: dict[str, asyncio.Future] = field(default_factory=dict)
+
+    @property
+    def path(self) -> Path:
+        return self.directory / f"{self.name}.jsonl"
+
+    @property
+    def meta_path(self) -> Path:
+        return self.directory / f"{self.name}.meta.jsonl"
+
+    @property
+    def owner_path(self) -> Path:
+        return self.directory / f"{self.name}.owner-{os.getpid()}.json"
+
+
+class DeferredBatcher:
+    def __init__(self, directory: Path, max_requests: int, max_bytes: int, max_wait_seconds: float, poll_interval: float):
+        self.directory = directory
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.max_wait_seconds = max_wait_seconds
+        self.poll_interval = poll_interval
+        # Termina una petición cuyo trabajo ya no espera: (request_id, resultado, campos locales).
+        self.recover: Callable[[str, Outcome, dict], Awaitable[None]] | None = None
+        self._spool: _Spool | None = None
+        self._submitted: dict[str, _Spool] = {} # id del lote remoto -> lote
+        self._owned: set[str] = set() # nombres de los lotes de este proceso
+        self._lock = asyncio.Lock()
+        self._background: set[asyncio.Task] = set()
+        self._recovery_slots: asyncio.Semaphore | None = None
+        self._task: asyncio.Task | None = None
+
+    def pending(self) -> int:
+        open_lines = len(self._spool.futures) if self._spool else 0
+        return open_lines + sum(len(spool.futures) for spool in self._submitted.values())
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    # --- construcción de lotes ---
+
+    async def enqueue(self, api: str, request: dict) -> asyncio.Future:
+        """
+        Añade la petición al lote en curso y devuelve un futuro que se resuelve con
+        `(contenido, Usage)`. Al volver, la petición y su contexto ya están en disco.
+        """
+        loop = asyncio.get_running_loop()
+        request_id = request_id_var.get()
+        custom_id = f"{request_id or 'job'}:{api}:{uuid.uuid4().hex[:8]}"
+        body = {k: v for k, v in request.items() if k not in _STREAM_PARAMS}
+        line = await loop.run_in_executor(None, _encode_line, custom_id, body)
+        if len(line) > self.max_bytes:
+            raise OpenAIError(f"La petición ({len(line)} bytes) no cabe en un lote diferido.")
+        job = _job.get()
+        meta = _encode_json({"custom_id": custom_id, "request_id": request_id, "local_fields": job.local_fields if job else {}})
+
+        async with self._lock:
+            if self._spool and self._spool.size + len(line) > self.max_bytes:
+                self._rotate()
+            if self._spool is None:
+                spool = _Spool(f"batch_{uuid.uuid4().hex}", self.directory)
+                await loop.run_in_executor(None, _create_spool, spool)
+                self._owned.add(spool.name)
+                self._spool = spool
+            spool = self._spool
+            # El contexto antes que la línea: toda línea enviada tiene con qué recuperarse.
+            await loop.run_in_executor(None, _append, spool.meta_path, meta)
+            await loop.run_in_executor(None, _append, spool.path, line)
+            spool.size += len(line)
+            spool.lines += 1
+            future = loop.create_future()
+            spool.futures[custom_id] = future
+            if spool.lines >= self.max_requests:
+                self._rotate()
+        return future
+
+    def _rotate(self):
+        """Cierra el lote en curso y lo envía en segundo plano."""
+        spool, self._spool = self._spool, None
+        if spool and spool.lines:
+            self._spawn(self._submit(spool))
+
+    async def _submit(self, spool: _Spool):
+        client = get_openai_client()
+        loop = asyncio.get_running_loop()
+        try:
+            with metrics.observe_openai("batch_submit", "batch"):
+                input_file = await client.files.create(file=spool.path, purpose="batch")
+                batch = await client.batches.create(
+                    input_file_id=input_file.id, endpoint=BATCH_ENDPOINT, completion_window="24h"
+                )
+        except Exception as e:
+            logger.exception(f"Error al enviar el lote diferido {spool.name} ({spool.lines} peticiones): {e}")
+            DEFERRED_BATCHES.inc(outcome="failed")
+            await self._settle(spool, {}, f"No se pudo enviar el lote a OpenAI: {e}")
+            return
+        await loop.run_in_executor(None, _write_json, spool.owner_path, {"batch_id": batch.id})
+        await loop.run_in_executor(None, _unlink, spool.path)
+        self._submitted[batch.id] = spool
+        DEFERRED_BATCHES.inc(outcome="submitted")
+        logger.info(f"Lote diferido {batch.id} enviado con {spool.lines} peticiones ({spool.size} bytes).")
+
+    # --- resultados ---
+
+    async def _settle(self, spool: _Spool, results: dict[str, Outcome], default_error: str):
+        """
+        Entrega los resultados de un lote terminado (o fallido) y borra sus archivos. Las
+        líneas sin trabajo esperando (de otro proceso, o cuyo trabajo se canceló) se recuperan.
+        """
+        loop = asyncio.get_running_loop()
+        contexts = await loop.run_in_executor(None, _read_meta, spool.meta_path)
+        for custom_id, future in spool.futures.items():
+            if future.cancelled():
+                continue
+            contexts.pop(custom_id, None)
+            if future.done():
+                continue
+            outcome = results.get(custom_id) or default_error
+            if isinstance(outcome, tuple):
+                future.set_result(outcome)
+            else:
+                future.set_exception(OpenAIError(outcome))
+        for custom_id, context in contexts.items():
+            if context.get("request_id"):
+                self._spawn(self._recover(context["request_id"], results.get(custom_id) or default_error, context.get("local_fields") or {}))
+        await loop.run_in_executor(None, _remove_spool_files, spool)
+        self._owned.discard(spool.name)
+
+    async def _recover(self, request_id: str, outcome: Outcome, local_fields: dict):
+        if self.recover is None:
+            logger.error(f"Resultado diferido de la petición {request_id} sin trabajo que lo espere ni función de recuperación.")
+            return
+        if self._recovery_slots is None:
+            self._recovery_slots = asyncio.Semaphore(_RECOVERY_CONCURRENCY)
+        async with self._recovery_slots:
+            try:
+                await self.recover(request_id, outcome, local_fields)
+                DEFERRED_RECOVERED.inc()
+            except Exception as e:
+                logger.exception(f"Error al terminar la petición diferida huérfana {request_id}: {e}")
+
+    # --- sondeo ---
+
+    async def _poll(self):
+        client = get_openai_client()
+        for batch_id in list(self._submitted):
+            try:
+                with metrics.observe_openai("batch_poll", "batch"):
+                    batch = await client.batches.retrieve(batch_id)
+                    if batch.status not in _FINAL_STATUSES:
+                        continue
+                    results = {}
+                    for file_id in (batch.output_file_id, batch.error_file_id):
+                        if file_id:
+                            content = await client.files.content(file_id)
+                            results.update(_parse_results(content.text))
+            except Exception as e:
+                logger.warning(f"Error al consultar el lote diferido {batch_id}: {e}")
+                continue
+            spool = self._submitted.pop(batch_id)
+            await self._settle(spool, results, f"El lote diferido terminó como '{batch.status}' sin respuesta.")
+            DEFERRED_BATCHES.inc(outcome=batch.status)
+            logger.info(f"Lote diferido {batch_id} terminado ({batch.status}): {len(results)}/{spool.lines} respuestas.")
+
+    # --- adopción ---
+
+    async def _adopt_orphans(self):
+        """Adopta los lotes cuyo proceso dueño ya no existe: envía los no enviados y sondea los enviados."""
+        loop = asyncio.get_running_loop()
+        for name, owner_path, owner_pid in await loop.run_in_executor(None, self._orphaned_spools):
+            spool = _Spool(name, self.directory, opened_at=0.0)
+            try:
+                os.rename(owner_path, spool.owner_path) # atómico: solo un proceso lo adopta
+            except FileNotFoundError:
+                continue
+            self._owned.add(name)
+            state, spool.lines = await loop.run_in_executor(None, _load_adopted, spool)
+            DEFERRED_ADOPTED.inc()
+            batch_id = state.get("batch_id")
+            logger.warning(f"Lote diferido {batch_id or name} adoptado del proceso {owner_pid} ({spool.lines} peticiones).")
+            if batch_id:
+                self._submitted[batch_id] = spool
+            elif spool.lines and await loop.run_in_executor(None, spool.path.exists):
+                self._spawn(self._submit(spool))
+            else:
+                await self._settle(spool, {}, "El lote diferido se perdió antes de enviarse.")
+
+    def _orphaned_spools(self) -> list[tuple[str, Path, int]]:
+        if not self.directory.exists():
+            return []
+        orphans = []
+        for entry in os.scandir(self.directory):
+            match = _OWNER_FILE_RE.match(entry.name)
+            if not match:
+                continue
+            name, pid = match.group(1), int(match.group(2))
+            # Con el mismo pid que un proceso anterior (p. ej. en un contenedor nuevo), solo es nuestro si lo conocemos.
+            if name not in self._owned and (pid == os.getpid() or not pid_alive(pid)):
+                orphans.append((name, Path(entry.path), pid))
+        return orphans
+
+    async def _run(self):
+        tick = min(self.poll_interval, self.max_wait_seconds)
+        last_poll = 0.0
+        while True:
+            try:
+                async with self._lock:
+                    if self._spool and time.monotonic() - self._spool.opened_at >= self.max_wait_seconds:
+                        self._rotate()
+                if time.monotonic() - last_poll >= self.poll_interval:
+                    last_poll = time.monotonic()
+                    await self._adopt_orphans()
+                    if self._submitted:
+                        await self._poll()
+            except Exception as e:
+                logger.error(f"Error en el ciclo de lotes diferidos: {e}")
+            await asyncio.sleep(tick)
+
+    def start(self, recover: Callable[[str, Outcome, dict], Awaitable[None]] | None = None):
+        self.recover = recover
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+        if self._owned:
+            logger.warning(
+                f"Parada con {len(self._owned)} lotes diferidos sin terminar: los adoptará otro proceso o el siguiente arranque."
+            )
+
+
+def _encode_json(value: dict) -> bytes:
+    return (json.dumps(value, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _encode_line(custom_id: str, body: dict) -> bytes:
+    return _encode_json({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body})
+
+
+def _create_spool(spool: _Spool):
+    spool.directory.mkdir(parents=True, exist_ok=True)
+    _write_json(spool.owner_path, {"batch_id": None})
+
+
+def _write_json(path: Path, value: dict):
+    # Escritura atómica: un proceso que adopta el lote nunca lee un archivo a medias.
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(_encode_json(value))
+    os.replace(tmp, path)
+
+
+def _load_adopted(spool: _Spool) -> tuple[dict, int]:
+    state = json.loads(spool.owner_path.read_bytes())
+    return state, len(_read_meta(spool.meta_path))
+
+
+def _read_meta(path: Path) -> dict[str, dict]:
+    contexts = {}
+    try:
+        with path.open("rb") as meta_file:
+            for raw in meta_file:
+                try:
+                    context = json.loads(raw)
+                except ValueError: # última línea a medias si el proceso murió escribiéndola
+                    continue
+                contexts[context["custom_id"]] = context
+    except FileNotFoundError:
+        pass
+    return contexts
+
+
+def _remove_spool_files(spool: _Spool):
+    for path in (spool.path, spool.meta_path, spool.owner_path):
+        _unlink(path)
+
+
+def _append(path: Path, line: bytes):
+    with path.open("ab") as spool_file:
+        spool_file.write(line)
+
+
+def _unlink(path: Path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _parse_results(text: str) -> dict[str, Outcome]:
+    """Líneas de salida de la Batch API -> `(contenido, Usage)` o mensaje de error, por `custom_id`."""
+    results: dict[str, Outcome] = {}
+    for raw in text.splitlines():
+        if not raw.strip():
+            continue
+        line = json.loads(raw)
+        response = line.get("response") or {}
+        body = response.get("body") or {}
+        if response.get("status_code") == 200 and body.get("choices"):
+            content = body["choices"][0]["message"].get("content") or ""
+            results[line["custom_id"]] = (content, Usage.model_validate(body["usage"]))
+        else:
+            error = line.get("error") or body.get("error") or {}
+            results[line["custom_id"]] = f"Error en la petición diferida: {error.get('message', error) or response.get('status_code')}"
+    return results
+
+
+batcher = DeferredBatcher(
+    DEFERRED_BATCH_DIR,
+    DEFERRED_BATCH_MAX_REQUESTS,
+    DEFERRED_BATCH_MAX_BYTES,
+    DEFERRED_BATCH_MAX_WAIT_SECONDS,
+    DEFERRED_POLL_INTERVAL_SECONDS,
+)
+
+metrics.register_callback_gauge(
+    "cv_deferred_requests_pending", "Peticiones diferidas esperando el resultado de su lote.", batcher.pending)
@@ -1,41 +1,88 @@
+import io
 from pathlib import Path
-import fitz
-from docx import Document
-from PIL import Image
-import pytesseract
 from src.config import logger
+from .temp_storage import StoredFile, local_path, read_bytes
 
-def extract_text_from_pdf(pdf_path: Path) -> str:
+# PyMuPDF, python-docx, Pillow y pytesseract se importan en cada extractor (en el hilo
+# del executor) para no pagarlos al importar la app: el arranque en frío queda más rápido.
+# Los extractores aceptan una ruta o un `StoredFile`; si está en memoria, leen del buffer.
+
+def open_pdf(source: StoredFile | Path):
+    import fitz
+
+    data = read_bytes(source)
+    if data is not None:
+        return fitz.open(stream=data, filetype="pdf")
+    return fitz.open(local_path(source))
+
+
+def extract_text_from_pdf(source: StoredFile | Path) -> str:
     text = ""
     try:
-        document = fitz.open(pdf_path)
+        document = open_pdf(source)
         for page in document:
             text += page.get_text()
         document.close()
     except Exception as e:
-        logger.error(f"Error al extraer texto de PDF {pdf_path.name}: {e}")
+        logger.error(f"Error al extraer texto de PDF {source.name}: {e}")
+    return text
+
+
+def extract_text_from_pdf_layout(source: StoredFile | Path) -> str:
+    """Texto ordenado por columnas y con encabezados en markdown (ver `layout`)."""
+    import fitz
+    from . import layout
+
+    text = ""
+    try:
+        document = open_pdf(source)
+        text = layout.document_text([page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT) for page in document])
+        document.close()
+    except Exception as e:
+        logger.error(f"Error al extraer texto maquetado de PDF {source.name}: {e}")
     return text
 
 
-def extract_text_from_docx(docx_path: Path) -> str:
+def render_pages_png(source: StoredFile | Path, indices: list[int]) -> list[bytes]:
+    """PNG de las páginas indicadas, en el mismo orden."""
+    pngs = []
+    document = open_pdf(source)
+    try:
+        for index in indices:
+            pix = document[index].get_pixmap()
+            pngs.append(pix.tobytes("png"))
+            del pix
+    finally:
+        document.close()
+    return pngs
+
+
+def extract_text_from_docx(source: StoredFile | Path) -> str:
+    from docx import Document
+
     text = ""
     try:
-        document = Document(docx_path)
+        data = read_bytes(source)
+        document = Document(io.BytesIO(data) if data is not None else local_path(source))
         for paragraph in document.paragraphs:
             text += paragraph.text + "\n"
     except Exception as e:
-        logger.error(f"Error al extraer texto de DOCX {docx_path.name}: {e}")
+        logger.error(f"Error al extraer texto de DOCX {source.name}: {e}")
     return text
 
 
-def extract_text_from_image(image_path: Path) -> str:
+def extract_text_from_image(source: StoredFile | Path) -> str:
+    import pytesseract
+    from PIL import Image
+
     text = ""
     try:
-        text = pytesseract.image_to_string(Image.open(image_path))
+        data = read_bytes(source)
+        text = pytesseract.image_to_string(Image.open(io.BytesIO(data) if data is not None else local_path(source)))
     except pytesseract.TesseractNotFoundError:
         logger.error(
             "Error: Tesseract OCR no está instalado o no se encuentra en el PATH."
         )
     except Exception as e:
-        logger.error(f"Error al extraer texto de imagen {image_path.name}: {e}")
+        logger.error(f"Error al extraer texto de imagen {source.name}: {e}")
     return text
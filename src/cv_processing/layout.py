@@ -0,0 +1,261 @@
+"""
+Extracción de texto de PDF según la maquetación (salida `dict` de PyMuPDF).
+
+`page.get_text()` sigue el orden del contenido del PDF, que en CVs a dos columnas o con
+barra lateral suele intercalar ambas fila a fila; y MuPDF puede agrupar en un mismo
+bloque líneas de las dos columnas. Aquí se trabaja con las líneas y sus coordenadas:
+
+- Columnas: se busca un canal vertical vacío entre líneas. Las que lo cruzan (nombre,
+  resumen a todo lo ancho) separan franjas horizontales; dentro de cada franja se lee
+  primero la columna izquierda y luego la derecha (recursivo, para tres columnas). Si el
+  lado derecho son textos cortos alineados fila a fila con el izquierdo (títulos y
+  fechas), es una tabla, no una columna, y se lee por filas.
+- Encabezados: líneas cortas con letra mayor que la del cuerpo, en mayúsculas o en
+  negrita se emiten como `#`/`##`/`###`, que la pre-extracción reconoce al segmentar.
+- Texto compacto: viñetas normalizadas a `- `, líneas de continuación de párrafo
+  unidas (y palabras partidas por guion), números de página descartados. Solo se une
+  una línea a la anterior si esta llega casi al borde de su columna (el texto se partió
+  por falta de sitio) y ninguna de las dos parece una entrada de lista, de contacto o
+  con fechas: en una barra lateral cada dato va en su línea.
+"""
+import re
+from dataclasses import dataclass
+
+from .preextraction import DATE_RE, EMAIL_RE, PHONE_RE, URL_RE
+
+# Bit de negrita de `span["flags"]` en PyMuPDF.
+_BOLD_FLAG = 16
+# Ancho mínimo (pt) de un canal entre columnas.
+_MIN_GUTTER = 12.0
+# Fracción máxima de líneas que pueden cruzar el canal entre columnas.
+_MAX_CROSSING_SHARE = 0.15
+# Cada columna debe tener al menos esta fracción de los caracteres de la región.
+_MIN_COLUMN_SHARE = 0.1
+# Tabla: más de esta fracción de líneas alineadas por fila y el lado derecho mucho más corto.
+_MAX_ROW_ALIGNED = 0.5
+_TABLE_LENGTH_RATIO = 0.5
+_MAX_COLUMN_DEPTH = 2
+_ROW_TOLERANCE = 3.0
+# Separación horizontal (en tamaños de letra) que parte una línea de MuPDF en dos.
+_SPAN_GAP_SIZES = 2.0
+# Separación vertical (en tamaños de letra) hasta la que una línea continúa el párrafo anterior.
+# Con interlineado apretado las cajas de MuPDF se solapan: se admite un solape de hasta media letra.
+_PARAGRAPH_GAP_SIZES = 0.8
+_MAX_LINE_OVERLAP_SIZES = 0.5
+# Una línea que ocupa al menos esta fracción del ancho de su columna puede continuar en la siguiente.
+_FULL_LINE_SHARE = 0.75
+_MAX_HEADING_CHARS = 60
+_MAX_HEADING_WORDS = 8
+_BULLETS = "•●▪■◦○·‣∙➢➤►▸-–—*"
+_LIST_ITEM_RE = re.compile(r"^(\d{1,2}|[a-z])[.)]\s")
+_PAGE_NUMBER_RE = re.compile(r"^(p[aá]g(ina)?\.?|page)?\s*\d{1,3}(\s*(/|de|of)\s*\d{1,3})?$", re.IGNORECASE)
+
+
+@dataclass
+class _Line:
+    text: str
+    size: float
+    bold: bool
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+
+
+def _make_line(spans: list[dict]) -> _Line | None:
+    text = " ".join("".join(span["text"] for span in spans).split())
+    if not text:
+        return None
+    # Tamaño y negrita del texto visible (los espacios no cuentan).
+    visible = [span for span in spans if span["text"].strip()]
+    weights = [len(span["text"].strip()) for span in visible]
+    size = sum(span["size"] * w for span, w in zip(visible, weights)) / sum(weights)
+    bold = all(span["flags"] & _BOLD_FLAG or "bold" in span.get("font", "").lower() for span in visible)
+    x0 = min(span["bbox"][0] for span in spans)
+    y0 = min(span["bbox"][1] for span in spans)
+    x1 = max(span["bbox"][2] for span in spans)
+    y1 = max(span["bbox"][3] for span in spans)
+    return _Line(text, round(size, 1), bold, x0, y0, x1, y1)
+
+
+def _page_lines(page_dict: dict) -> list[_Line]:
+    lines = []
+    for block in page_dict.get("blocks", []):
+        if block.get("type") != 0:
+            continue
+        for raw_line in block.get("lines", []):
+            # Una línea de MuPDF puede juntar texto de dos columnas en el mismo renglón.
+            group: list[dict] = []
+            for span in raw_line.get("spans", []):
+                if not span.get("text"):
+                    continue
+                if group and span["bbox"][0] - group[-1]["bbox"][2] > _SPAN_GAP_SIZES * span["size"]:
+                    lines.append(_make_line(group))
+                    group = []
+                group.append(span)
+            if group:
+                lines.append(_make_line(group))
+    return [line for line in lines if line is not None]
+
+
+# --- orden de lectura ---
+
+def _by_rows(lines: list[_Line]) -> list[_Line]:
+    return sorted(lines, key=lambda l: (round(l.y0 / _ROW_TOLERANCE), l.x0))
+
+
+def _is_table(left: list[_Line], right: list[_Line]) -> bool:
+    aligned = sum(1 for r in right if any(abs(r.y0 - l.y0) <= _ROW_TOLERANCE for l in left))
+    if aligned / len(right) <= _MAX_ROW_ALIGNED:
+        return False
+    mean_left = sum(len(l.text) for l in left) / len(left)
+    mean_right = sum(len(r.text) for r in right) / len(right)
+    return mean_right < mean_left * _TABLE_LENGTH_RATIO
+
+
+def _find_gutter(lines: list[_Line]) -> float | None:
+    """Centro del canal vertical más ancho que separa dos columnas con texto, o None."""
+    total_chars = sum(len(l.text) for l in lines)
+    # Pocas líneas pueden cruzar el canal (nombre, resumen): hacen de separadores de franja.
+    max_crossing = max(2, len(lines) * _MAX_CROSSING_SHARE)
+    best, best_width = None, 0.0
+    for edge in sorted({l.x1 for l in lines}):
+        right = [l for l in lines if l.x0 >= edge]
+        if not right:
+            continue
+        gap = min(l.x0 for l in right) - edge
+        if gap < _MIN_GUTTER or gap <= best_width:
+            continue
+        left = [l for l in lines if l.x1 <= edge]
+        if (
+            len(lines) - len(left) - len(right) <= max_crossing
+            and sum(len(l.text) for l in left) >= total_chars * _MIN_COLUMN_SHARE
+            and sum(len(l.text) for l in right) >= total_chars * _MIN_COLUMN_SHARE
+            and not _is_table(left, right)
+        ):
+            best, best_width = edge + gap / 2, gap
+    return best
+
+
+def _reading_order(lines: list[_Line], depth: int = 0) -> list[_Line]:
+    if len(lines) < 2 or depth >= _MAX_COLUMN_DEPTH:
+        return _by_rows(lines)
+    gutter = _find_gutter(lines)
+    if gutter is None:
+        return _by_rows(lines)
+
+    # Las líneas que cruzan el canal separan franjas; cada franja se lee columna a columna.
+    spanning = sorted((l for l in lines if l.x0 < gutter < l.x1), key=lambda l: l.y0)
+    columns = [l for l in lines if not l.x0 < gutter < l.x1]
+    ordered, start = [], float("-inf")
+    for separator in [*spanning, None]:
+        end = separator.y0 if separator else float("inf")
+        band = [l for l in columns if start <= l.y0 < end]
+        ordered += _reading_order([l for l in band if l.x1 <= gutter], depth + 1)
+        ordered += _reading_order([l for l in band if l.x0 >= gutter], depth + 1)
+        if separator:
+            ordered.append(separator)
+            start = separator.y0
+    return ordered
+
+
+# --- texto ---
+
+def _body_size(pages: list[list[_Line]]) -> float:
+    sizes: dict[float, int] = {}
+    for lines in pages:
+        for line in lines:
+            sizes[line.size] = sizes.get(line.size, 0) + len(line.text)
+    return max(sizes, key=sizes.get) if sizes else 0.0
+
+
+def _heading_level(line: _Line, body_size: float, title_size: float) -> int:
+    text = line.text
+    if (
+        len(text) > _MAX_HEADING_CHARS
+        or len(text.split()) > _MAX_HEADING_WORDS
+        or text[0] in _BULLETS
+        or text.endswith((".", ",", ";"))
+        or not any(c.isalpha() for c in text)
+    ):
+        return 0
+    if line.size >= title_size and line.size >= body_size * 1.5:
+        return 1
+    if line.size >= body_size * 1.15:
+        return 2
+    letters = [c for c in text if c.isalpha()]
+    if len(letters) >= 3 and all(c.isupper() for c in letters):
+        return 2
+    if line.bold:
+        return 3
+    return 0
+
+
+def _is_entry(text: str) -> bool:
+    """Línea con entidad propia: elemento numerado, dato de contacto o que empieza o acaba en fecha."""
+    if _LIST_ITEM_RE.match(text) or EMAIL_RE.search(text) or URL_RE.search(text) or PHONE_RE.search(text):
+        return True
+    dates = list(DATE_RE.finditer(text))
+    return bool(dates) and (dates[0].start() == 0 or dates[-1].end() == len(text))
+
+
+def _column_right(line: _Line, lines: list[_Line]) -> float:
+    """Borde derecho de la columna de `line`: el máximo de las líneas alineadas a su izquierda."""
+    return max(l.x1 for l in lines if abs(l.x0 - line.x0) <= _ROW_TOLERANCE)
+
+
+def _continues(previous: _Line | None, line: _Line, previous_text: str, lines: list[_Line]) -> bool:
+    """
+    La línea sigue el párrafo anterior: justo debajo, sin cierre de frase, en minúscula,
+    con la anterior llegando casi al borde de la columna y sin entradas sueltas entre medias.
+    """
+    gap = line.y0 - previous.y1 if previous is not None else None
+    if gap is None or not -_MAX_LINE_OVERLAP_SIZES * line.size <= gap <= _PARAGRAPH_GAP_SIZES * line.size:
+        return False
+    if previous_text[-1] in ".:;!?" or not line.text[:1].islower():
+        return False
+    width = _column_right(previous, lines) - previous.x0
+    if previous.x1 - previous.x0 < _FULL_LINE_SHARE * width:
+        return False
+    return not _is_entry(previous.text) and not _is_entry(line.text)
+
+
+def _page_text(lines: list[_Line], body_size: float, title_size: float) -> list[str]:
+    out: list[str] = []
+    previous: _Line | None = None
+    for line in lines:
+        text = line.text
+        if _PAGE_NUMBER_RE.match(text):
+            continue
+        level = _heading_level(line, body_size, title_size) if body_size else 0
+        if level:
+            if out and out[-1]:
+                out.append("")
+            out.append(f"{'#' * level} {text}")
+            previous = None
+            continue
+        if text[0] in _BULLETS and (len(text) == 1 or text[1] == " "):
+            out.append(f"- {text[1:].strip()}".rstrip())
+        elif out and _continues(previous, line, out[-1], lines):
+            if out[-1].endswith("-") and out[-1][-2:-1].isalpha():
+                out[-1] = out[-1][:-1] + text # palabra partida por guion
+            else:
+                out[-1] = f"{out[-1]} {text}"
+        else:
+            out.append(text)
+        previous = line
+    return out
+
+
+def document_text(page_dicts: list[dict]) -> str:
+    """Texto estructurado de un documento a partir de la salida `dict` de cada página."""
+    pages = [_page_lines(page_dict) for page_dict in page_dicts]
+    body_size = _body_size(pages)
+    title_size = max((line.size for lines in pages for line in lines), default=0.0)
+    out: list[str] = []
+    for lines in pages:
+        out += _page_text(_reading_order(lines), body_size, title_size)
+        out.append("")
+    # Sin líneas en blanco repetidas ni al principio o al final.
+    text = re.sub(r"\n{3,}", "\n\n", "\n".join(out)).strip()
+    return text + "\n" if text else ""
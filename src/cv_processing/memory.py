@@ -0,0 +1,115 @@
+"""
+Presupuesto global de memoria para el trabajo en vuelo.
+
+Cada trabajo estima los bytes que va a retener (imágenes renderizadas, base64,
+cuerpo JSON de la petición a OpenAI) y solo se admite cuando su huella cabe en el
+presupuesto. Así, bajo concurrencia, los trabajos esperan en lugar de llevar el
+proceso a un OOM.
+"""
+import asyncio
+import base64
+import math
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from src import metrics
+from src.config import MEMORY_BUDGET_BYTES
+
+# Copias vivas de cada imagen hasta que termina la llamada: str base64, cuerpo JSON
+# serializado por el cliente de OpenAI y bytes codificados por httpx.
+_BASE64_COPIES_IN_FLIGHT = 3
+# Fracción del pixmap RGB que ocupa el PNG en el peor caso razonable (páginas escaneadas).
+_PNG_COMPRESSION_ESTIMATE = 0.5
+# Tamaño de bloque múltiplo de 3 para codificar base64 por trozos sin relleno intermedio.
+_B64_CHUNK_BYTES = 3 * 64 * 1024
+
+
+class MemoryBudget:
+    """Semáforo por bytes: admite trabajos mientras su huella estimada quepa en el límite."""
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.in_flight_bytes = 0
+        self.peak_bytes = 0
+        self.waiting = 0
+        self._condition: asyncio.Condition | None = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Se crea perezosamente para quedar ligada al event loop que la usa.
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int):
+        """Reserva `nbytes` hasta salir del contexto, esperando si no caben."""
+        # Un trabajo mayor que el presupuesto se admite, pero en solitario.
+        nbytes = max(0, min(nbytes, self.limit_bytes))
+        condition = self._get_condition()
+        async with condition:
+            self.waiting += 1
+            try:
+                await condition.wait_for(lambda: self.in_flight_bytes + nbytes <= self.limit_bytes)
+            finally:
+                self.waiting -= 1
+            self.in_flight_bytes += nbytes
+            self.peak_bytes = max(self.peak_bytes, self.in_flight_bytes)
+        try:
+            yield
+        finally:
+            async with condition:
+                self.in_flight_bytes -= nbytes
+                condition.notify_all()
+
+    def snapshot(self) -> dict:
+        return {
+            "limit_bytes": self.limit_bytes,
+            "in_flight_bytes": self.in_flight_bytes,
+            "peak_bytes": self.peak_bytes,
+            "waiting": self.waiting,
+        }
+
+
+memory_budget = MemoryBudget(MEMORY_BUDGET_BYTES)
+
+metrics.register_callback_gauge(
+    "cv_memory_in_flight_bytes", "Bytes reservados en el presupuesto de memoria.", lambda: memory_budget.in_flight_bytes)
+metrics.register_callback_gauge(
+    "cv_memory_peak_bytes", "Máximo de bytes reservados desde el arranque.", lambda: memory_budget.peak_bytes)
+metrics.register_callback_gauge(
+    "cv_memory_waiting_jobs", "Trabajos esperando hueco en el presupuesto de memoria.", lambda: memory_budget.waiting)
+
+
+def estimate_image_footprint(raw_bytes: int) -> int:
+    """Huella estimada de enviar una imagen de `raw_bytes` a OpenAI como data URL."""
+    return math.ceil(raw_bytes / 3) * 4 * _BASE64_COPIES_IN_FLIGHT
+
+
+def estimate_page_footprint(width: float, height: float) -> int:
+    """Huella estimada de renderizar una página a PNG (72 dpi) y enviarla como data URL."""
+    pixmap_bytes = math.ceil(width) * math.ceil(height) * 3
+    return estimate_image_footprint(int(pixmap_bytes * _PNG_COMPRESSION_ESTIMATE))
+
+
+def file_to_data_url(file_path: Path, mime_type: str) -> str:
+    """
+    Codifica un archivo como data URL base64 por bloques, sin cargar antes los bytes
+    originales completos: solo conviven el buffer base64 y la cadena final.
+    """
+    prefix = f"data:{mime_type};base64,".encode("ascii")
+    size = file_path.stat().st_size
+    encoded = bytearray(len(prefix) + math.ceil(size / 3) * 4)
+    encoded[:len(prefix)] = prefix
+    offset = len(prefix)
+    with open(file_path, "rb") as source:
+        while chunk := source.read(_B64_CHUNK_BYTES):
+            piece = base64.b64encode(chunk)
+            encoded[offset:offset + len(piece)] = piece
+            offset += len(piece)
+    del encoded[offset:]
+    return encoded.decode("ascii")
+
+
+def bytes_to_data_url(data: bytes, mime_type: str) -> str:
+    """Codifica bytes en memoria como data URL base64."""
+    return f"data:{mime_type};base64," + base64.b64encode(data).decode("ascii")
@@ -0,0 +1,144 @@
+"""
+Selección de páginas por relevancia para el análisis con visión.
+
+Puntúa cada página de un PDF con señales baratas (densidad de texto, cobertura de
+imágenes, páginas en blanco y encabezados de secciones de CV) sin rasterizarla, y
+elige las más informativas dentro del presupuesto de páginas y tokens del endpoint.
+"""
+import math
+from dataclasses import dataclass
+
+from .preextraction import EMAIL_RE, PHONE_RE, heading_section, normalize
+
+# Palabras que delatan certificados, diplomas o portadas de portfolio.
+LOW_VALUE_KEYWORDS = ("certificado", "certificate", "diploma", "se otorga", "awarded", "portfolio", "portafolio")
+
+_DENSE_PAGE_CHARS = 1500
+_BLANK_TEXT_CHARS = 20
+_BLANK_IMAGE_COVERAGE = 0.02
+# Por debajo de este total de caracteres el PDF se considera escaneado (todo imágenes).
+_SCANNED_DOCUMENT_CHARS = 100
+_LOW_DETAIL_TOKENS = 85
+_TOKENS_PER_TILE = 170
+
+
+@dataclass
+class PageBudget:
+    """Presupuesto de páginas y tokens de imagen para la ruta de visión."""
+    max_pages: int = 10
+    max_image_tokens: int = 12000
+    low_detail_threshold: float = 0.35
+
+    @classmethod
+    def from_endpoint_info(cls, endpoint_info: dict) -> "PageBudget":
+        """Construye el presupuesto a partir de la configuración (`info`) del endpoint."""
+        budget = cls()
+        return cls(
+            max_pages=int(endpoint_info.get("vision_max_pages", budget.max_pages)),
+            max_image_tokens=int(endpoint_info.get("vision_max_image_tokens", budget.max_image_tokens)),
+            low_detail_threshold=float(endpoint_info.get("vision_low_detail_threshold", budget.low_detail_threshold)),
+        )
+
+
+@dataclass
+class PageScore:
+    index: int
+    score: float
+    text_chars: int
+    image_coverage: float
+    section_hits: int
+    blank: bool
+    width: float
+    height: float
+    high_detail_tokens: int
+    detail: str = "high"
+
+    @property
+    def tokens(self) -> int:
+        return self.high_detail_tokens if self.detail == "high" else _LOW_DETAIL_TOKENS
+
+
+def estimate_image_tokens(width: float, height: float) -> int:
+    """Tokens de una imagen en `detail: high` según el escalado y teselado de OpenAI."""
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return _LOW_DETAIL_TOKENS + _TOKENS_PER_TILE * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def _image_coverage(page) -> float:
+    page_area = abs(page.rect) or 1.0
+    covered = 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        covered += max(0.0, x1 - x0) * max(0.0, y1 - y0)
+    return min(1.0, covered / page_area)
+
+
+def _inspect_page(page) -> tuple[str, float, int]:
+    text = page.get_text()
+    coverage = _image_coverage(page)
+    sections = {heading_section(line) for line in text.splitlines()} - {None}
+    return text, coverage, len(sections)
+
+
+def score_pages(document) -> list[PageScore]:
+    """Puntúa todas las páginas del documento sin rasterizar ninguna."""
+    inspected = [(index, page.rect, *_inspect_page(page)) for index, page in enumerate(document)]
+    scanned = sum(len(text.strip()) for _, _, text, _, _ in inspected) < _SCANNED_DOCUMENT_CHARS
+    scores = []
+
+    for index, rect, text, coverage, hits in inspected:
+        chars = len(text.strip())
+        blank = chars < _BLANK_TEXT_CHARS and coverage < _BLANK_IMAGE_COVERAGE
+        position_bonus = 0.1 if index == 0 else 0.0
+
+        if blank:
+            score = 0.0
+        elif scanned:
+            # Sin capa de texto: la imagen es el contenido y las primeras páginas suelen ser las relevantes.
+            score = coverage * 0.9 + position_bonus
+        else:
+            density = min(1.0, chars / _DENSE_PAGE_CHARS)
+            contact = 1.0 if EMAIL_RE.search(text) or PHONE_RE.search(text) else 0.0
+            score = 0.5 * density + 0.35 * min(1.0, hits / 3) + 0.15 * contact + position_bonus
+            normalized = normalize(text[:_DENSE_PAGE_CHARS]).replace("_", " ")
+            if hits == 0 and any(keyword in normalized for keyword in LOW_VALUE_KEYWORDS):
+                score *= 0.3
+            elif chars < 200 and coverage > 0.5:
+                # Portada o página de portfolio: mucha imagen y casi nada de texto.
+                score *= 0.5
+
+        scores.append(PageScore(
+            index=index,
+            score=round(min(1.0, score), 3),
+            text_chars=chars,
+            image_coverage=round(coverage, 3),
+            section_hits=hits,
+            blank=blank,
+            width=rect.width,
+            height=rect.height,
+            high_detail_tokens=estimate_image_tokens(rect.width, rect.height),
+        ))
+    return scores
+
+
+def select_pages(scores: list[PageScore], budget: PageBudget) -> list[PageScore]:
+    """
+    Elige las páginas más informativas dentro del presupuesto.
+    Las páginas de poco valor se envían en `detail: low`. Se devuelven en el orden del documento.
+    """
+    selected: list[PageScore] = []
+    used_tokens = 0
+    for page in sorted((s for s in scores if not s.blank), key=lambda s: s.score, reverse=True):
+        if len(selected) >= budget.max_pages:
+            break
+        page.detail = "low" if page.score < budget.low_detail_threshold else "high"
+        if used_tokens + page.tokens > budget.max_image_tokens:
+            page.detail = "low"
+            if selected and used_tokens + page.tokens > budget.max_image_tokens:
+                continue
+        selected.append(page)
+        used_tokens += page.tokens
+    return sorted(selected, key=lambda s: s.index)
@@ -0,0 +1,356 @@
+"""
+Pre-extracción determinista sobre el texto extraído de un CV.
+
+Localiza con reglas locales los campos simples (email, teléfono, URLs, fechas) y
+segmenta el documento en secciones (experiencia, educación, habilidades...). El
+resultado permite rellenar parte del esquema del endpoint sin pasar por el modelo
+y enviar al LLM únicamente las secciones que todavía necesita.
+"""
+import copy
+import math
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+# --- Patrones de campos simples ---
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+PHONE_RE = re.compile(r"(?<![\w+])\+?\d[\d\s().-]{7,}\d(?!\w)")
+URL_RE = re.compile(
+    r"(?:https?://|www\.)[^\s<>()\"']+"
+    r"|(?<![\w@/.])(?:[a-z]{2,3}\.)?(?:linkedin\.com|github\.com|gitlab\.com|behance\.net)/[^\s<>()\"']+",
+    re.IGNORECASE,
+)
+_MONTHS = (
+    r"ene(?:ro)?|feb(?:rero)?|mar(?:zo)?|abr(?:il)?|may(?:o)?|jun(?:io)?|jul(?:io)?|ago(?:sto)?"
+    r"|sep(?:tiembre)?|set(?:iembre)?|oct(?:ubre)?|nov(?:iembre)?|dic(?:iembre)?"
+    r"|jan(?:uary)?|february|march|apr(?:il)?|june|july|aug(?:ust)?|sept(?:ember)?|october|november|dec(?:ember)?"
+)
+DATE_RE = re.compile(
+    rf"\b(?:(?:{_MONTHS})\.?\s+(?:de\s+)?(?:19|20)\d{{2}}|\d{{1,2}}/(?:19|20)\d{{2}}|(?:19|20)\d{{2}})\b"
+    r"|\b(?:presente|actualidad|present|current)\b",
+    re.IGNORECASE,
+)
+
+# --- Alias de claves de esquema que se pueden rellenar localmente ---
+FIELD_ALIASES = {
+    "email": {"email", "emails", "e_mail", "mail", "correo", "correos", "correo_electronico"},
+    "phone": {"phone", "phones", "phone_number", "telefono", "telefonos", "tel", "movil", "celular", "mobile"},
+    "linkedin": {"linkedin", "linkedin_url", "perfil_linkedin"},
+    "github": {"github", "github_url", "perfil_github"},
+    "urls": {"urls", "url", "links", "enlaces", "website", "web", "sitio_web", "pagina_web", "portfolio"},
+    "dates": {"dates", "fechas"},
+    "full_text": {"full_text", "texto_completo"},
+}
+
+# --- Encabezados de sección reconocidos (normalizados, sin tildes) ---
+SECTION_HEADINGS = {
+    "contact": ("contacto", "datos de contacto", "informacion de contacto", "contact", "contact information"),
+    "summary": (
+        "resumen", "resumen profesional", "perfil", "perfil profesional", "sobre mi", "acerca de mi",
+        "objetivo", "objetivo profesional", "summary", "professional summary", "profile", "about me", "objective",
+    ),
+    "experience": (
+        "experiencia", "experiencia laboral", "experiencia profesional", "trayectoria", "trayectoria profesional",
+        "historial laboral", "experience", "work experience", "professional experience", "employment",
+        "employment history",
+    ),
+    "education": (
+        "educacion", "formacion", "formacion academica", "estudios", "education", "academic background",
+    ),
+    "skills": (
+        "habilidades", "habilidades tecnicas", "habilidades blandas", "competencias", "conocimientos",
+        "aptitudes", "tecnologias", "skills", "technical skills", "soft skills",
+    ),
+    "languages": ("idiomas", "languages"),
+    "certifications": ("certificaciones", "certificados", "cursos", "certifications", "courses"),
+    "projects": ("proyectos", "projects"),
+}
+
+# --- Palabras de las claves del esquema que indican qué sección necesitan ---
+FIELD_SECTIONS = {
+    "header": {"name", "nombre", "apellidos", "headline", "titular", "cargo", "titulo_profesional", "contact", "contacto"},
+    "summary": {"resumen", "summary", "perfil", "profile", "objetivo", "objective", "about"},
+    "experience": {"experiencia", "experience", "trabajo", "work", "empleo", "employment", "jobs", "puestos"},
+    "education": {"educacion", "education", "formacion", "estudios", "academic"},
+    "skills": {"habilidades", "skills", "competencias", "tecnologias", "aptitudes", "conocimientos", "soft"},
+    "languages": {"idiomas", "languages"},
+    "certifications": {"certificaciones", "certifications", "cursos", "courses"},
+    "projects": {"proyectos", "projects"},
+}
+
+_HEADING_LOOKUP = {heading: section for section, headings in SECTION_HEADINGS.items() for heading in headings}
+_MAX_HEADING_CHARS = 40
+_MIN_SECTIONS_FOR_TRIMMING = 2
+# Estimación barata de tokens para el informe de ahorro.
+_CHARS_PER_TOKEN = 4
+
+
+def normalize(value: str) -> str:
+    """Minúsculas, sin tildes y con separadores unificados a '_'."""
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(c for c in value if not unicodedata.combining(c))
+    return re.sub(r"[^a-z0-9]+", "_", value.lower()).strip("_")
+
+
+@dataclass
+class PreExtraction:
+    """Resultado de la pre-extracción de un documento frente a un esquema."""
+    fields: dict
+    remaining_schema: dict | None
+    text_for_model: str
+    sections: dict
+    fields_total: int
+    fields_filled: int
+    full_text_chars: int
+
+    @property
+    def complete(self) -> bool:
+        """Indica si el esquema queda cubierto sin necesidad del modelo."""
+        return self.remaining_schema is None
+
+    def report(self, text_sent: bool = True) -> dict:
+        """
+        Resumen de cobertura y ahorro de tokens para registrar por petición.
+        `text_sent` indica si el texto recortado llegó al modelo (falso en la ruta de visión).
+        """
+        skipped = self.complete
+        sent_chars = len(self.text_for_model) if text_sent and not skipped else 0
+        saved_chars = self.full_text_chars - sent_chars if text_sent or skipped else 0
+        return {
+            "fields_total": self.fields_total,
+            "fields_filled": self.fields_filled,
+            "coverage": round(self.fields_filled / self.fields_total, 3) if self.fields_total else 0.0,
+            "sections": sorted(self.sections),
+            "model_skipped": skipped,
+            "text_chars_full": self.full_text_chars,
+            "text_chars_sent": sent_chars,
+            "estimated_tokens_saved": math.ceil(saved_chars / _CHARS_PER_TOKEN),
+        }
+
+
+@dataclass
+class _Matches:
+    emails: list = field(default_factory=list)
+    phones: list = field(default_factory=list)
+    urls: list = field(default_factory=list)
+    dates: list = field(default_factory=list)
+
+
+def _unique(values) -> list:
+    return list(dict.fromkeys(values))
+
+
+def find_simple_fields(text: str) -> _Matches:
+    """Busca emails, teléfonos, URLs y fechas en el texto."""
+    matches = _Matches()
+    matches.emails = _unique(EMAIL_RE.findall(text))
+    for candidate in PHONE_RE.findall(text):
+        digits = re.sub(r"\D", "", candidate)
+        # Descarta rangos de años ("2018 - 2022 2023") y números demasiado cortos o largos.
+        if not 9 <= len(digits) <= 15 or re.fullmatch(r"(?:(?:19|20)\d{2}[\s.-]*)+", candidate.strip()):
+            continue
+        matches.phones.append(candidate.strip())
+    matches.phones = _unique(matches.phones)
+    matches.urls = _unique(url.rstrip(".,;:") for url in URL_RE.findall(text))
+    matches.dates = _unique(m.group(0).strip() for m in DATE_RE.finditer(text))
+    return matches
+
+
+def heading_section(line: str) -> str | None:
+    """Devuelve la sección que abre la línea si es un encabezado reconocido."""
+    stripped = line.strip().lstrip("#*•-· ").rstrip(": ")
+    if not stripped or len(stripped) > _MAX_HEADING_CHARS:
+        return None
+    return _HEADING_LOOKUP.get(normalize(stripped).replace("_", " "))
+
+
+def segment_sections(text: str) -> dict:
+    """
+    Divide el texto en secciones según sus encabezados.
+    El texto anterior al primer encabezado se guarda como 'header'.
+    """
+    sections: dict[str, list[str]] = {}
+    current = "header"
+    for line in text.splitlines():
+        section = heading_section(line)
+        if section:
+            current = section
+        sections.setdefault(current, []).append(line)
+    return {name: "\n".join(lines).strip() for name, lines in sections.items() if "\n".join(lines).strip()}
+
+
+def _local_value(kind: str, matches: _Matches, text: str):
+    if kind == "email":
+        return matches.emails
+    if kind == "phone":
+        return matches.phones
+    if kind == "linkedin":
+        return [u for u in matches.urls if "linkedin." in u.lower()]
+    if kind == "github":
+        return [u for u in matches.urls if "github." in u.lower()]
+    if kind == "urls":
+        return matches.urls
+    if kind == "dates":
+        return matches.dates
+    if kind == "full_text":
+        return [text]
+    return []
+
+
+def _field_kind(key: str) -> str | None:
+    """Tipo de campo local por alias exacto o por sufijo de la clave ('contact_email', no 'email_verified')."""
+    normalized = normalize(key)
+    for kind, aliases in FIELD_ALIASES.items():
+        if normalized in aliases:
+            return kind
+    for kind in ("email", "phone", "linkedin", "github"):
+        if any(normalized.endswith(f"_{alias}") for alias in FIELD_ALIASES[kind]):
+            return kind
+    return None
+
+
+# Claves de JSON Schema: un dict que las usa describe un campo, no un objeto anidado.
+_SCHEMA_KEYWORDS = {
+    "type", "description", "title", "enum", "const", "format", "pattern", "items", "properties",
+    "default", "examples", "nullable", "anyOf", "oneOf", "allOf", "$ref",
+}
+
+
+def _is_json_schema(spec) -> bool:
+    return isinstance(spec, dict) and spec.get("type") == "object" and isinstance(spec.get("properties"), dict)
+
+
+def _is_list_spec(spec) -> bool:
+    return isinstance(spec, list) or (isinstance(spec, dict) and _types(spec) == {"array"})
+
+
+def _is_object_spec(spec) -> bool:
+    if _is_json_schema(spec):
+        return True
+    # Esquema simplificado ({"contacto": {"email": "string"}}): todos los valores son a su vez especificaciones.
+    return (
+        isinstance(spec, dict)
+        and bool(spec)
+        and not spec.keys() & _SCHEMA_KEYWORDS
+        and all(isinstance(value, (str, dict, list)) for value in spec.values())
+    )
+
+
+def _types(spec: dict) -> set:
+    declared = spec.get("type")
+    return set(declared) if isinstance(declared, list) else {declared} if declared else set()
+
+
+def _accepts_text(spec) -> bool:
+    """El campo admite el texto encontrado: string (o lista de strings) si el esquema declara tipo."""
+    if isinstance(spec, list):
+        return all(_accepts_text(item) for item in spec)
+    if not isinstance(spec, dict) or "type" not in spec:
+        return True
+    types = _types(spec) - {"null"}
+    if types == {"array"}:
+        return _accepts_text(spec.get("items", {}))
+    return types == {"string"}
+
+
+def _split_schema(schema: dict, matches: _Matches, text: str) -> tuple[dict, dict, int, int]:
+    """
+    Separa el esquema en campos rellenados localmente y campos pendientes.
+    Devuelve (rellenados, pendientes, total_hojas, hojas_rellenadas).
+    """
+    json_schema = _is_json_schema(schema)
+    properties = schema["properties"] if json_schema else schema
+    filled, remaining = {}, {}
+    total = done = 0
+
+    for key, spec in properties.items():
+        if _is_object_spec(spec):
+            sub_filled, sub_remaining, sub_total, sub_done = _split_schema(spec, matches, text)
+            total, done = total + sub_total, done + sub_done
+            if sub_filled:
+                filled[key] = sub_filled
+            if sub_remaining:
+                remaining[key] = sub_remaining
+            continue
+
+        total += 1
+        kind = _field_kind(key) if _accepts_text(spec) else None
+        values = _local_value(kind, matches, text) if kind else []
+        if values:
+            filled[key] = values if _is_list_spec(spec) else values[0]
+            done += 1
+        else:
+            remaining[key] = spec
+
+    if json_schema and remaining:
+        remaining_schema = {k: v for k, v in schema.items() if k not in ("properties", "required")}
+        remaining_schema["properties"] = remaining
+        if "required" in schema:
+            remaining_schema["required"] = [k for k in schema["required"] if k in remaining]
+        remaining = remaining_schema
+    return filled, remaining, total, done
+
+
+def _leaf_keys(schema: dict, parents: tuple = ()) -> list[tuple]:
+    properties = schema["properties"] if _is_json_schema(schema) else schema
+    keys = []
+    for key, spec in properties.items():
+        if _is_object_spec(spec):
+            keys.extend(_leaf_keys(spec, parents + (key,)))
+        else:
+            keys.append(parents + (key,))
+    return keys
+
+
+def _sections_for_key_path(path: tuple) -> set | None:
+    for key in reversed(path):
+        tokens = set(normalize(key).split("_"))
+        wanted = {section for section, words in FIELD_SECTIONS.items() if tokens & words or normalize(key) in words}
+        if wanted:
+            return wanted
+    return None
+
+
+def _text_for_schema(text: str, sections: dict, remaining_schema: dict) -> str:
+    """Construye el texto mínimo que necesita el modelo para los campos pendientes."""
+    if len([name for name in sections if name != "header"]) < _MIN_SECTIONS_FOR_TRIMMING:
+        return text
+    wanted = {"header", "contact"}
+    for path in _leaf_keys(remaining_schema):
+        key_sections = _sections_for_key_path(path)
+        if key_sections is None:
+            # Campo sin sección reconocible: se envía el documento completo.
+            return text
+        wanted |= key_sections
+    return "\n\n".join(content for name, content in sections.items() if name in wanted)
+
+
+def preextract(text: str, schema: dict) -> PreExtraction:
+    """Ejecuta la pre-extracción local del texto frente al esquema del endpoint."""
+    matches = find_simple_fields(text)
+    sections = segment_sections(text)
+    filled, remaining, total, done = _split_schema(schema, matches, text)
+    remaining_schema = remaining or None
+    if _is_json_schema(schema) and remaining_schema and not remaining_schema.get("properties"):
+        remaining_schema = None
+    text_for_model = _text_for_schema(text, sections, remaining_schema) if remaining_schema else ""
+    return PreExtraction(
+        fields=filled,
+        remaining_schema=remaining_schema,
+        text_for_model=text_for_model,
+        sections=sections,
+        fields_total=total,
+        fields_filled=done,
+        full_text_chars=len(text),
+    )
+
+
+def merge_fields(model_output: dict, local_fields: dict) -> dict:
+    """Combina la salida del modelo con los campos rellenados localmente."""
+    merged = copy.deepcopy(model_output) if isinstance(model_output, dict) else {}
+    for key, value in local_fields.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_fields(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, BackgroundTasks, File, UploadFile, Depends
-from uuid import UUID, uuid4
-from pathlib import Path
-import shutil
+from fastapi import APIRouter, BackgroundTasks, File, Form, Header, Response, UploadFile, Depends
+import asyncio
+import json
+from uuid import UUID
 
-from src.config import logger, get_supabase_client
+from src import idempotency, metrics, profiling, timeline
+from src.config import logger, get_supabase_client, ENDPOINT_CACHE_TTL_SECONDS
+from src.shared_cache import cache as shared_cache
+from src.log_pipeline import request_id_var
 from src.auth import verify_api_key
 from src.models import AuthActor
-from src.cv_processing.service import process_cv_and_callback, TEMP_CV_DIR
-from src.exceptions import EndpointNotFoundError, ForbiddenAccessError, DatabaseError
+from src.cv_processing.batch import Batch
+from src.cv_processing.service import process_cv_and_callback
+from src.cv_processing.temp_storage import storage
+from src.exceptions import APIException, EndpointNotFoundError, ForbiddenAccessError, DatabaseError, InvalidBatchError
 
 router = APIRouter(
     tags=["File Processing"],
@@ -18,23 +23,33 @@ async def verify_endpoint_access(endpoint_id: UUID, actor: AuthActor = Depends(v
     Dependency that verifies if an endpoint exists and if the user has permission to use it.
     Returns the endpoint data if successful.
     """
-    try:
-        response = await (
-            get_supabase_client().from_("endpoints")
-            .select("id_user, info, secret_webhook")
-            .eq("id", str(endpoint_id))
-            .single()
-            .execute()
-        )
-    except Exception as e:
-        # Catches potential Postgrest errors (e.g., no rows found)
-        logger.warning(f"Error al buscar endpoint '{endpoint_id}': {e}")
-        raise EndpointNotFoundError(str(endpoint_id))
+    # Compartido entre workers durante `ENDPOINT_CACHE_TTL_SECONDS` si la caché compartida está activa.
+    cached = await shared_cache.aget("endpoints", str(endpoint_id))
+    if cached is not None:
+        endpoint_data = json.loads(cached)
+    else:
+        try:
+            with metrics.observe_supabase("endpoints", "select"):
+                response = await (
+                    get_supabase_client().from_("endpoints")
+                    .select("id_user, info, secret_webhook")
+                    .eq("id", str(endpoint_id))
+                    .single()
+                    .execute()
+                )
+        except Exception as e:
+            # Catches potential Postgrest errors (e.g., no rows found)
+            logger.warning(f"Error al buscar endpoint '{endpoint_id}': {e}")
+            raise EndpointNotFoundError(str(endpoint_id))
 
-    if not response.data:
-        raise EndpointNotFoundError(str(endpoint_id))
+        if not response.data:
+            raise EndpointNotFoundError(str(endpoint_id))
 
-    endpoint_data = response.data
+        endpoint_data = response.data
+        if ENDPOINT_CACHE_TTL_SECONDS > 0:
+            await shared_cache.aput(
+                "endpoints", str(endpoint_id), json.dumps(endpoint_data).encode("utf-8"), ENDPOINT_CACHE_TTL_SECONDS
+            )
     if endpoint_data.get("id_user") != actor.user_id:
         raise ForbiddenAccessError("No tienes permiso para usar este endpoint.")
     
@@ -44,14 +59,67 @@ async def verify_endpoint_access(endpoint_id: UUID, actor: AuthActor = Depends(v
 async def upload_cv(
     endpoint_id: UUID,
     background_tasks: BackgroundTasks,
+    response: Response,
     file: UploadFile = File(...),
     endpoint_data: dict = Depends(verify_endpoint_access),
     actor: AuthActor = Depends(verify_api_key), # We still need the actor here for logging and request creation
+    idempotency_key: str | None = Header(
+        None, alias=idempotency.IDEMPOTENCY_HEADER,
+        description="Clave única por subida: un reintento con la misma clave devuelve la petición original.",
+    ),
+    x_profile: str | None = Header(None, alias=profiling.PROFILE_HEADER, include_in_schema=False),
 ):
     """
     Acepta un archivo de CV para procesamiento asíncrono.
+    Con `Idempotency-Key`, los reintentos devuelven el `request_id` y el estado originales
+    (con la cabecera `Idempotent-Replayed: true`) sin volver a procesar el archivo.
     """
+    with metrics.observe_duration(metrics.UPLOAD_LATENCY):
+        if not idempotency_key:
+            return await _accept_upload(endpoint_id, background_tasks, file, actor, profiling.wants_profile(x_profile))
+
+        scope = idempotency.store.scope_key(actor.user_id, str(endpoint_id), idempotency_key)
+        fingerprint = idempotency.upload_fingerprint(file.filename, file.size)
+        original_request_id = await idempotency.store.begin(scope, fingerprint)
+        if original_request_id is not None:
+            response.headers["Idempotent-Replayed"] = "true"
+            return await _replayed_upload(original_request_id)
+        try:
+            result = await _accept_upload(endpoint_id, background_tasks, file, actor, profiling.wants_profile(x_profile))
+        except BaseException:
+            await idempotency.store.abort(scope, fingerprint)
+            raise
+        await idempotency.store.complete(scope, fingerprint, result["request_id"])
+        return result
+
+async def _replayed_upload(id_request: UUID) -> dict:
+    """Respuesta a un reintento: la petición original y su estado actual."""
+    status = "processing" if timeline.get_active(id_request) else None
+    if status is None:
+        try:
+            with metrics.observe_supabase("requests", "select"):
+                response = await (
+                    get_supabase_client().from_("requests")
+                    .select("status")
+                    .eq("id_request", str(id_request))
+                    .limit(1)
+                    .execute()
+                )
+            status = response.data[0]["status"] if response.data else None
+        except Exception as e:
+            logger.warning(f"No se pudo obtener el estado de la petición {id_request} para el reintento: {e}")
+    logger.info(f"Subida repetida con la misma Idempotency-Key: se devuelve la petición {id_request} ({status}).")
+    return {"message": "Archivo ya recibido anteriormente con esta Idempotency-Key.", "request_id": str(id_request), "status": status}
+
+async def _accept_upload(
+    endpoint_id: UUID, background_tasks: BackgroundTasks, file: UploadFile, actor: AuthActor, profile: bool = False
+) -> dict:
+    """Registra la petición, guarda el archivo y encola su procesamiento."""
+    id_request = None
     try:
+        # Sin espacio para el archivo no se registra la petición (se comprueba con el tamaño declarado).
+        storage.ensure_capacity(file.size)
+
         # 1. Crear un registro de la petición en la base de datos
         request_payload = {
             "id_user": actor.user_id,
@@ -59,23 +127,69 @@ async def upload_cv(
             "endpoint_id": str(endpoint_id),
             "status": "processing",
         }
-        request_response = await get_supabase_client().from_("requests").insert(request_payload).execute()
+        with metrics.observe_supabase("requests", "insert"):
+            request_response = await get_supabase_client().from_("requests").insert(request_payload).execute()
         id_request = request_response.data[0]["id_request"]
+        request_id_var.set(str(id_request))
+        job_timeline = timeline.start(id_request)
+        job_timeline.mark("queued")
 
-        # 2. Guardar el archivo en disco de forma segura
-        filename = Path(file.filename).name.strip()
-        unique_filename = f"{uuid4()}_{filename}"
-        file_path = TEMP_CV_DIR / unique_filename
-
-        with file_path.open("wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # 2. Guardar el archivo (en memoria o en disco) fuera del event loop
+        stored_file = await asyncio.get_running_loop().run_in_executor(
+            None, storage.store, str(id_request), file.filename or "", file.file, file.size
+        )
+        job_timeline.mark("saved", bytes=stored_file.size, backend=stored_file.backend)
 
         # 3. Añadir la tarea de procesamiento al segundo plano
-        background_tasks.add_task(process_cv_and_callback, id_request, file_path)
+        job = profiling.profiled(process_cv_and_callback, f"request_{id_request}") if profile else process_cv_and_callback
+        background_tasks.add_task(job, id_request, stored_file)
+        metrics.JOBS_QUEUED.inc()
 
         return {"message": "Archivo recibido. El procesamiento ha comenzado.", "request_id": id_request}
 
     except Exception as e:
+        if id_request is not None:
+            timeline.finish(id_request)
         logger.exception(f"Error en la subida de archivo para el usuario {actor.user_id}: {e}")
+        if isinstance(e, APIException):
+            raise
         raise DatabaseError("Error al registrar la petición o guardar el archivo.")
 
+
+
+@router.post("/{endpoint_id}/batch", status_code=202, summary="Subir un lote de archivos para procesar")
+async def upload_batch(
+    endpoint_id: UUID,
+    background_tasks: BackgroundTasks,
+    files: list[UploadFile] = File(..., description="CVs sueltos y/o archivos ZIP con CVs."),
+    batch_callback_url: str | None = Form(None, description="URL a la que enviar un resumen cuando termine todo el lote."),
+    endpoint_data: dict = Depends(verify_endpoint_access),
+    actor: AuthActor = Depends(verify_api_key),
+):
+    """
+    Acepta muchos CVs en una sola petición: archivos sueltos o ZIP (sus entradas se
+    descomprimen de una en una al procesarlas). Devuelve el `batch_id` y el `request_id`
+    de cada archivo. Cada petición se procesa y notifica igual que una subida individual.
+    """
+    if batch_callback_url and not batch_callback_url.startswith(("http://", "https://")):
+        raise InvalidBatchError("batch_callback_url debe empezar con 'http://' o 'https://'.")
+    with metrics.observe_duration(metrics.UPLOAD_LATENCY):
+        loop = asyncio.get_running_loop()
+        batch = Batch(endpoint_id, actor, endpoint_data, batch_callback_url)
+        try:
+            storage.ensure_capacity(sum(file.size or 0 for file in files))
+            await loop.run_in_executor(None, batch.collect, files)
+            if not batch.items:
+                raise InvalidBatchError("El lote no contiene ningún archivo soportado.")
+            await batch.register()
+            await loop.run_in_executor(None, batch.store_uploads)
+        except Exception as e:
+            logger.exception(f"Error al aceptar el lote {batch.id} del usuario {actor.user_id}: {e}")
+            await batch.abort(f"El lote no se pudo aceptar: {e}")
+            if isinstance(e, APIException):
+                raise
+            raise DatabaseError("Error al registrar el lote o guardar sus archivos.")
+
+        background_tasks.add_task(batch.run)
+        logger.info(f"Lote {batch.id} aceptado: {len(batch.items)} archivos, {len(batch.skipped)} omitidos.")
+        return {"message": "Lote recibido. El procesamiento ha comenzado.", **batch.summary()}
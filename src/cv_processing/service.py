@@ -1,35 +1,38 @@
 import asyncio
-import os
+import functools
 import mimetypes
 import json
 import httpx
-from pathlib import Path
 from uuid import UUID, uuid4
 from typing import Tuple
 from datetime import datetime
 import hmac
 import hashlib
 
-from src.config import logger, get_supabase_client
+from src import metrics, results, timeline
+from src.config import logger, get_supabase_client, PDF_TEXT_LAYOUT
+from src.log_pipeline import request_id_var
 from src.users.service import deduct_credits_atomic
 from src.exceptions import DatabaseError, FileProcessingError, OpenAIError, InsufficientCreditsError
 from src.models import Usage
-from . import analysis, extraction
-
-# Directorio temporal para los CVs.
-TEMP_CV_DIR = Path("temp")
-TEMP_CV_DIR.mkdir(exist_ok=True)
+from . import analysis, extraction, preextraction
+from .cpu_pool import pool as cpu_pool
+from .deferred import DeferredJob, Outcome, bind_job as bind_deferred_job, handed_off as deferred_handed_off
+from .page_selection import PageBudget
+from .streaming import broker
+from .temp_storage import StoredFile, storage
 
 async def _get_request_details(id_request: UUID) -> dict:
     """Helper to fetch request and endpoint data."""
     try:
-        response = await (
-            get_supabase_client().from_("requests")
-            .select("*, endpoints(info, secret_webhook)")
-            .eq("id_request", str(id_request))
-            .single()
-            .execute()
-        )
+        with metrics.observe_supabase("requests", "select"):
+            response = await (
+                get_supabase_client().from_("requests")
+                .select("*, endpoints(info, secret_webhook)")
+                .eq("id_request", str(id_request))
+                .single()
+                .execute()
+            )
         if not response.data:
             raise DatabaseError(f"No se encontró la petición con id {id_request}")
         return response.data
@@ -37,24 +40,84 @@ async def _get_request_details(id_request: UUID) -> dict:
         logger.error(f"Error fetching request details for {id_request}: {e}")
         raise DatabaseError("Error al obtener los detalles de la petición.")
 
-def _get_text_extractor(mime_type: str | None):
+# Trabajos en curso y cierres de los cancelados al parar el worker. Los cierres van en su
+# propia tarea (la cancelación de las pendientes al cerrar el event loop los cortaría) y el
+# lifespan espera a ambos.
+_running_jobs: set[asyncio.Task] = set()
+_closing_cancelled: set[asyncio.Task] = set()
+
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+VISION_MODES = ("vision_first", "vision_only")
+# Formatos con texto nativo: extraerlo es barato, así que la pre-extracción se hace incluso en modo visión.
+NATIVE_TEXT_MIME_TYPES = ("application/pdf", DOCX_MIME_TYPE)
+
+def _get_text_extractor(mime_type: str | None, text_layout: bool = True):
     """Returns the appropriate text extraction function based on MIME type."""
     if mime_type == "application/pdf":
-        return extraction.extract_text_from_pdf
-    if mime_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
+        return extraction.extract_text_from_pdf_layout if text_layout else extraction.extract_text_from_pdf
+    if mime_type == DOCX_MIME_TYPE:
         return extraction.extract_text_from_docx
     if mime_type and mime_type.startswith("image/"):
         return extraction.extract_text_from_image
     return None
 
-async def _run_analysis(mode: str, file_path: Path, output_schema: dict) -> Tuple[dict, Usage]:
-    """Orchestrates the analysis process and aggregates token usage."""
+def _mode_label(mode: str) -> str:
+    """Etiqueta de métricas del modo: acotada a los valores conocidos."""
+    if mode in VISION_MODES or mode == "unknown":
+        return mode
+    return "text"
+
+async def _extract_text(extractor, file_path: StoredFile, mime_type: str | None) -> str:
+    """Ejecuta el extractor (síncrono, CPU) desde el executor por defecto, en un worker de CPU si los hay."""
+    loop = asyncio.get_running_loop()
+    with metrics.observe_stage("extract_text", mime_type), timeline.span("extract") as span:
+        text = await loop.run_in_executor(None, cpu_pool.call, extractor, file_path.detached())
+        span["chars"] = len(text)
+        return text
+
+async def _run_analysis(
+    mode: str,
+    file_path: StoredFile,
+    output_schema: dict,
+    use_preextraction: bool = True,
+    page_budget: PageBudget | None = None,
+    deferred: bool = False,
+    text_layout: bool = True,
+) -> Tuple[dict, Usage, dict | None]:
+    """
+    Orchestrates the analysis process and aggregates token usage.
+    Devuelve también el informe de la pre-extracción local (o None si no se aplicó).
+    """
     cv_info: dict | None = None
     total_usage: Usage | None = None
+    mime_type, _ = mimetypes.guess_type(file_path.name)
+    extractor = _get_text_extractor(mime_type, text_layout)
+    extracted_text: str | None = None
+    pre: preextraction.PreExtraction | None = None
+    schema = output_schema
+
+    if use_preextraction and extractor and (mode not in VISION_MODES or mime_type in NATIVE_TEXT_MIME_TYPES):
+        extracted_text = await _extract_text(extractor, file_path, mime_type)
+        if extracted_text:
+            pre = preextraction.preextract(extracted_text, output_schema)
+            for name, value in pre.fields.items():
+                broker.publish(request_id_var.get(), "field", {"name": name, "value": value, "source": "local"})
+            if pre.complete:
+                logger.info(f"Pre-extracción local cubre todo el esquema para {file_path.name}. Se omite el modelo.")
+                return pre.fields, Usage(prompt_tokens=0, completion_tokens=0, total_tokens=0), pre.report()
+            schema = pre.remaining_schema
 
-    if mode in ["vision_first", "vision_only"]:
+    if deferred:
+        if mode == "vision_first" and extractor and extracted_text is None:
+            # El fallback a texto no debe necesitar el archivo, que se libera al quedar en espera del lote.
+            extracted_text = await _extract_text(extractor, file_path, mime_type)
+        bind_deferred_job(DeferredJob(
+            local_fields=pre.fields if pre else {}, release=functools.partial(_release_while_waiting, file_path),
+        ))
+
+    if mode in VISION_MODES:
         try:
-            cv_info, vision_usage = await analysis.extract_info_with_openai_vision(file_path, output_schema)
+            cv_info, vision_usage = await analysis.extract_info_with_openai_vision(file_path, schema, page_budget, deferred)
             total_usage = vision_usage
             logger.info(f"Análisis 'openai_vision' exitoso para {file_path.name}.")
         except OpenAIError as e:
@@ -62,19 +125,20 @@ async def _run_analysis(mode: str, file_path: Path, output_schema: dict) -> Tupl
                 raise
             logger.warning(f"Análisis 'openai_vision' falló, intentando fallback a texto: {e}")
 
+    text_sent = False
     if cv_info is None:
-        mime_type, _ = mimetypes.guess_type(file_path.name)
-        extractor = _get_text_extractor(mime_type)
         if not extractor:
             raise FileProcessingError(f"Tipo de archivo no soportado para análisis manual: {mime_type}")
 
-        loop = asyncio.get_running_loop()
-        extracted_text = await loop.run_in_executor(None, extractor, file_path)
+        if extracted_text is None:
+            extracted_text = await _extract_text(extractor, file_path, mime_type)
         
         if not extracted_text:
             raise FileProcessingError("No se pudo extraer texto del archivo para el análisis manual.")
         
-        cv_info, text_usage = await analysis.extract_info_from_text_with_openai(extracted_text, output_schema)
+        model_text = pre.text_for_model if pre else extracted_text
+        cv_info, text_usage = await analysis.extract_info_from_text_with_openai(model_text, schema, deferred)
+        text_sent = True
         if total_usage:
             total_usage += text_usage
         else:
@@ -82,18 +146,89 @@ async def _run_analysis(mode: str, file_path: Path, output_schema: dict) -> Tupl
 
     if not cv_info or not total_usage:
         raise OpenAIError("Todos los métodos de análisis fallaron para extraer información o uso de tokens del CV.")
+
+    report = None
+    if pre:
+        cv_info = preextraction.merge_fields(cv_info, pre.fields)
+        report = pre.report(text_sent=text_sent)
+        logger.info(f"Pre-extracción para {file_path.name}: {report}")
     
-    return cv_info, total_usage
+    return cv_info, total_usage, report
+
+async def _release_while_waiting(file_path: StoredFile):
+    """El trabajo espera su lote diferido (hasta 24 h): libera el archivo y su estado en vivo."""
+    request_id = request_id_var.get()
+    await asyncio.get_running_loop().run_in_executor(None, storage.release, file_path)
+    timeline.finish(request_id)
+    broker.close(request_id)
+
+def _parse_endpoint_info(endpoint_data: dict, id_request) -> dict:
+    """El `info` del endpoint, que puede llegar como JSON en texto."""
+    endpoint_info_json = endpoint_data.get("info", {})
+    if isinstance(endpoint_info_json, str):
+        try:
+            return json.loads(endpoint_info_json)
+        except json.JSONDecodeError:
+            logger.error(f"Error decodificando info JSON para petición {id_request}: {endpoint_info_json}")
+            # Decide how to handle invalid JSON strings, for now, treat as empty dict
+            return {}
+    if isinstance(endpoint_info_json, dict):
+        return endpoint_info_json
+    return {}
 
-async def process_cv_and_callback(id_request: UUID, file_path: Path):
+async def _deduct_credits(user_id, usage_data: Usage, id_request):
+    """Deduce los tokens consumidos (operación atómica)."""
+    if not user_id:
+        return
+    cost = usage_data.total_tokens
+    success = await deduct_credits_atomic(user_id, cost)
+    if not success:
+        # This can happen if the user runs out of credits between the initial check and now.
+        logger.warning(f"No se pudieron deducir {cost} créditos al usuario {user_id} para la petición {id_request} (créditos insuficientes).")
+        raise InsufficientCreditsError(required=cost)
+
+def close_after_cancel(coro):
+    """Ejecuta el cierre de un trabajo cancelado (estado, log, webhook) en una tarea que el lifespan espera."""
+    task = asyncio.get_running_loop().create_task(coro)
+    _closing_cancelled.add(task)
+    task.add_done_callback(_closing_cancelled.discard)
+
+async def wait_for_cancelled_jobs(timeout: float):
+    """Espera (hasta `timeout`) a que terminen los cierres de los trabajos cancelados."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    # Primero los trabajos (uvicorn los acaba de cancelar y programan su cierre al deshacerse), después los cierres.
+    for tasks in (_running_jobs, _closing_cancelled):
+        remaining = deadline - loop.time()
+        if tasks and remaining > 0:
+            if tasks is _closing_cancelled:
+                logger.info(f"Cerrando {len(tasks)} trabajos cancelados por la parada del worker.")
+            await asyncio.wait(set(tasks), timeout=remaining)
+
+async def process_cv_and_callback(id_request: UUID, file_path: StoredFile, source: str = "upload") -> str:
     """
     Tarea en segundo plano que orquesta el procesamiento de un CV.
+    Devuelve el estado final de la petición ('completed' o 'failed').
+
+    `source` ('upload' o 'batch') etiqueta `cv_jobs_total`; los trabajos de endpoints
+    diferidos cuentan como 'deferred'. El reciclado de workers solo cuenta las subidas.
     """
+    request_id_var.set(str(id_request))
+    task = asyncio.current_task()
+    _running_jobs.add(task)
+    job_timeline = timeline.resume(id_request)
+    job_timeline.mark("started")
+    metrics.JOBS_QUEUED.dec()
+    metrics.JOBS_IN_FLIGHT.inc()
     status = "failed"
+    mode = "unknown"
     error_message = None
     user_id = None
+    endpoint_id = None
+    secret_webhook = None
     endpoint_info = {}
     usage_data: Usage | None = None
+    cancelled = False
 
     try:
         request_data = await _get_request_details(id_request)
@@ -101,96 +236,204 @@ async def process_cv_and_callback(id_request: UUID, file_path: Path):
         endpoint_id = request_data.get("endpoint_id") 
         
         endpoint_data_from_db = request_data.get("endpoints", {})
-        endpoint_info_json = endpoint_data_from_db.get("info", {})
         secret_webhook = endpoint_data_from_db.get("secret_webhook") # Renamed for clarity
+        endpoint_info = _parse_endpoint_info(endpoint_data_from_db, id_request)
 
-        endpoint_info = {}
-        if isinstance(endpoint_info_json, str):
-            try:
-                endpoint_info = json.loads(endpoint_info_json)
-            except json.JSONDecodeError:
-                logger.error(f"Error decodificando info JSON para petición {id_request}: {endpoint_info_json}")
-                # Decide how to handle invalid JSON strings, for now, treat as empty dict
-                endpoint_info = {}
-        elif isinstance(endpoint_info_json, dict):
-            endpoint_info = endpoint_info_json
-        
-        
         # 1. Procesar el CV
         output_schema = endpoint_info.get("schema")
         if not output_schema:
             raise ValueError("El esquema de salida (output_schema) es obligatorio.")
         
         mode = endpoint_info.get("analysis_mode", "vision_first")
-        cv_info, usage_data = await _run_analysis(mode, file_path, output_schema)
+        use_preextraction = endpoint_info.get("preextraction", True) is not False
+        deferred = endpoint_info.get("priority") == "deferred"
+        if deferred:
+            source = "deferred"
+        with metrics.observe_stage("analysis", mimetypes.guess_type(file_path.name)[0]):
+            cv_info, usage_data, preextraction_report = await _run_analysis(
+                mode, file_path, output_schema, use_preextraction, PageBudget.from_endpoint_info(endpoint_info),
+                deferred=deferred,
+                text_layout=endpoint_info.get("text_layout", PDF_TEXT_LAYOUT) is not False,
+            )
         
         # 2. Deducir créditos (operación atómica)
-        if user_id:
-            cost = usage_data.total_tokens
-            success = await deduct_credits_atomic(user_id, cost)
-            if not success:
-                # This can happen if the user runs out of credits between the initial check and now.
-                logger.warning(f"No se pudieron deducir {cost} créditos al usuario {user_id} para la petición {id_request} (créditos insuficientes).")
-                raise InsufficientCreditsError(required=cost)
+        await _deduct_credits(user_id, usage_data, id_request)
 
         status = "completed"
-        payload_out = {"status": status, "data": cv_info, "usage": usage_data.model_dump()}
+        payload_out = {"request_id": str(id_request), "status": status, "data": cv_info, "usage": usage_data.model_dump()}
+        if preextraction_report:
+            payload_out["preextraction"] = preextraction_report
         if secret_webhook:
             payload_out["secret_webhook"] = secret_webhook # Add secret_webhook to payload_out
         logger.info(f"Procesamiento para la petición {id_request} completado con éxito.")
 
     except (DatabaseError, FileProcessingError, OpenAIError, ValueError, InsufficientCreditsError) as e:
         error_message = str(e)
-        payload_out = {"status": status, "error": error_message, "data": None}
+        payload_out = {"request_id": str(id_request), "status": status, "error": error_message, "data": None}
         if secret_webhook:
             payload_out["secret_webhook"] = secret_webhook # Add secret_webhook to payload_out even on error
         logger.exception(f"Fallo en el procesamiento para la petición {id_request}: {e}")
+    except asyncio.CancelledError:
+        # El worker se para (drenaje agotado): la petición no puede quedarse en 'processing'.
+        cancelled = True
+        error_message = "El procesamiento se interrumpió porque el worker se detuvo."
+        payload_out = {"request_id": str(id_request), "status": status, "error": error_message, "data": None}
+        if secret_webhook:
+            payload_out["secret_webhook"] = secret_webhook
+        logger.error(f"Trabajo de la petición {id_request} cancelado por la parada del worker.")
+        raise
     except Exception as e:
         error_message = str(e)
-        payload_out = {"status": status, "error": error_message, "data": None}
+        payload_out = {"request_id": str(id_request), "status": status, "error": error_message, "data": None}
         if secret_webhook:
             payload_out["secret_webhook"] = secret_webhook # Add secret_webhook to payload_out even on unexpected error
         logger.critical(f"Error inesperado y no controlado en la petición {id_request}: {e}", exc_info=True)
 
     finally:
-        # 4. Actualizar estado y registrar log
+        finish = _finish_job(
+            id_request, file_path, job_timeline, status, payload_out, error_message, usage_data,
+            endpoint_info, endpoint_id, secret_webhook, hand_off=cancelled and deferred_handed_off(),
+        )
+        if cancelled:
+            close_after_cancel(finish)
+        else:
+            await finish
+        _running_jobs.discard(task)
+        metrics.JOBS_IN_FLIGHT.dec()
+        metrics.JOBS_TOTAL.inc(mode=_mode_label(mode), outcome="cancelled" if cancelled else status, source=source)
+
+    return status
+
+async def _finish_job(
+    id_request, file_path: StoredFile, job_timeline: timeline.JobTimeline, status: str, payload_out: dict,
+    error_message: str | None, usage_data: Usage | None, endpoint_info: dict, endpoint_id, secret_webhook: str | None,
+    hand_off: bool = False,
+):
+    """
+    Cierra la petición y libera el estado del trabajo. Con `hand_off` la cierra quien
+    termine su lote diferido; su línea de tiempo y su stream SSE ya se liberaron al
+    quedar en espera (`_release_while_waiting`).
+    """
+    if hand_off:
+        logger.info(f"La petición {id_request} queda a la espera de su lote diferido, que la terminará al completarse.")
+        await asyncio.get_running_loop().run_in_executor(None, storage.release, file_path)
+        return
+
+    job_timeline.mark(status)
+    # El resultado final (validado y fusionado) para los suscriptores SSE, sin el secreto del webhook.
+    broker.publish(str(id_request), "result", {k: v for k, v in payload_out.items() if k != "secret_webhook"})
+    await _close_request(id_request, status, payload_out, error_message, usage_data, endpoint_info, endpoint_id, secret_webhook)
+
+    # 6. Liberar el archivo temporal
+    await asyncio.get_running_loop().run_in_executor(None, storage.release, file_path)
+
+    # 7. Guardar la línea de tiempo completa (incluidos los intentos de webhook)
+    await _persist_timeline(id_request, job_timeline)
+    timeline.finish(id_request)
+    broker.close(str(id_request))
+
+async def _close_request(
+    id_request, status: str, payload_out: dict, error_message: str | None, usage_data: Usage | None,
+    endpoint_info: dict, endpoint_id, secret_webhook: str | None,
+):
+    """Pasos finales de una petición: resultado, log, estado y callback."""
+    # 4. Registrar log y actualizar estado (antes el log: un 'completed' sin log se serviría con result null)
+    try:
+        credit_use = usage_data.total_tokens if usage_data and status == "completed" else 0
+        # Primero el resultado comprimido: cuando el log exista, sus blobs ya estarán guardados.
+        stored_payload = payload_out
         try:
-            credit_use = usage_data.total_tokens if usage_data and status == "completed" else 0
-            supabase = get_supabase_client()
-            await supabase.from_("requests").update({"status": status}).eq("id_request", str(id_request)).execute()
+            stored_payload = await results.store(payload_out)
+        except Exception as e:
+            logger.error(f"Error al guardar el resultado comprimido de la petición {id_request}; se guarda sin comprimir: {e}")
+        supabase = get_supabase_client()
 
-            # Log usage info for debugging instead of saving to DB
-            if usage_data:
-                logger.info(f"Token usage for request {id_request}: {usage_data.model_dump_json()}")
+        # Log usage info for debugging instead of saving to DB
+        if usage_data:
+            logger.info(f"Token usage for request {id_request}: {usage_data.model_dump_json()}")
 
-            log_entry = {
-                "id_request": str(id_request),
-                "payload_out": payload_out,
-                "error": error_message,
-                "credit_use": credit_use,
-            }
+        log_entry = {
+            "id_request": str(id_request),
+            "payload_out": stored_payload,
+            "error": error_message,
+            "credit_use": credit_use,
+        }
+        with metrics.observe_supabase("request_logs", "insert"):
             await supabase.from_("request_logs").insert(log_entry).execute()
-        except Exception as e:
-            logger.exception(f"Error crítico al actualizar el estado o registrar el log para la petición {id_request}: {e}")
-
-        # 5. Enviar notificación al callback
-        callback_destination_url = endpoint_info.get("callbackURL")
-        if callback_destination_url:
-            if isinstance(callback_destination_url, str) and (callback_destination_url.startswith("http://") or callback_destination_url.startswith("https://")):
-                await _send_callback(callback_destination_url, payload_out, id_request, endpoint_id, secret_webhook)
-            else:
-                logger.error(
-                    f"La URL del callback '{callback_destination_url}' para la petición {id_request} es inválida. "
-                    "Debe ser una cadena de texto que empiece con 'http://' o 'https://'. No se enviará el callback."
-                )
+
+        with metrics.observe_supabase("requests", "update"):
+            await supabase.from_("requests").update({"status": status}).eq("id_request", str(id_request)).execute()
+    except Exception as e:
+        logger.exception(f"Error crítico al actualizar el estado o registrar el log para la petición {id_request}: {e}")
+
+    # 5. Enviar notificación al callback
+    callback_destination_url = endpoint_info.get("callbackURL")
+    if callback_destination_url:
+        if isinstance(callback_destination_url, str) and (callback_destination_url.startswith("http://") or callback_destination_url.startswith("https://")):
+            with metrics.observe_duration(metrics.CALLBACK_LATENCY):
+                await send_callback(callback_destination_url, payload_out, id_request, endpoint_id, secret_webhook)
         else:
-            logger.info(f"No hay URL de callback configurada para la petición {id_request}. No se enviará nada.")
-        
-        # 6. Limpiar archivo temporal
-        if file_path.exists():
-            os.remove(file_path)
+            logger.error(
+                f"La URL del callback '{callback_destination_url}' para la petición {id_request} es inválida. "
+                "Debe ser una cadena de texto que empiece con 'http://' o 'https://'. No se enviará el callback."
+            )
+    else:
+        logger.info(f"No hay URL de callback configurada para la petición {id_request}. No se enviará nada.")
+
+async def complete_orphaned_deferred(request_id: str, outcome: Outcome, local_fields: dict):
+    """
+    Termina con el resultado de su lote una petición diferida cuyo trabajo ya no existe
+    (reinicio, despliegue o worker reciclado). Sin el trabajo no hay fallback a texto.
+    """
+    request_id_var.set(request_id)
+    request_data = await _get_request_details(UUID(request_id))
+    if request_data.get("status") != "processing":
+        logger.info(f"La petición diferida {request_id} ya estaba cerrada ({request_data.get('status')}).")
+        return
+    job_timeline = timeline.start(request_id)
+    job_timeline.mark("recovered")
+    status = "failed"
+    error_message = None
+    usage_data: Usage | None = None
+    endpoint_data = request_data.get("endpoints") or {}
+    secret_webhook = endpoint_data.get("secret_webhook")
+    endpoint_info = _parse_endpoint_info(endpoint_data, request_id)
+    try:
+        if isinstance(outcome, str):
+            raise OpenAIError(outcome)
+        cv_info, usage_data = analysis.parse_response("OpenAI (lote diferido)", *outcome)
+        cv_info = preextraction.merge_fields(cv_info, local_fields)
+        await _deduct_credits(request_data.get("id_user"), usage_data, request_id)
+        status = "completed"
+        payload_out = {"request_id": request_id, "status": status, "data": cv_info, "usage": usage_data.model_dump()}
+        logger.info(f"Petición diferida {request_id} completada sin su trabajo original.")
+    except Exception as e:
+        error_message = str(e)
+        payload_out = {"request_id": request_id, "status": status, "error": error_message, "data": None}
+        logger.exception(f"Fallo al terminar la petición diferida {request_id}: {e}")
+    if secret_webhook:
+        payload_out["secret_webhook"] = secret_webhook
+    job_timeline.mark(status)
+    await _close_request(
+        request_id, status, payload_out, error_message, usage_data, endpoint_info, request_data.get("endpoint_id"), secret_webhook,
+    )
+    await _persist_timeline(request_id, job_timeline)
+    timeline.finish(request_id)
 
-async def _send_callback(url: str, payload: dict, request_id: UUID, endpoint_id: UUID, secret_webhook: str | None = None):
+async def _persist_timeline(id_request: UUID, job_timeline: timeline.JobTimeline):
+    """Guarda la línea de tiempo en la petición. Es best-effort: un fallo no afecta al resultado."""
+    try:
+        with metrics.observe_supabase("requests", "update"):
+            await (
+                get_supabase_client().from_("requests")
+                .update({"timeline": job_timeline.to_dict()})
+                .eq("id_request", str(id_request))
+                .execute()
+            )
+    except Exception as e:
+        logger.error(f"Error al guardar la línea de tiempo de la petición {id_request}: {e}")
+
+async def send_callback(url: str, payload: dict, request_id: UUID, endpoint_id: UUID, secret_webhook: str | None = None):
     """Envia el resultado a la URL de callback con reintentos y registra los intentos."""
     headers = {"Content-Type": "application/json"}
     if secret_webhook:
@@ -204,15 +447,19 @@ async def _send_callback(url: str, payload: dict, request_id: UUID, endpoint_id:
     for i in range(3):
         webhook_log_id = uuid4() # Generate UUID for each webhook log attempt
 
+        if i > 0:
+            metrics.WEBHOOK_RETRIES.inc()
+
         # Log initial attempt
         try:
-            await supabase.from_("webhooks").insert({
-                "id_webhook": str(webhook_log_id),
-                "endpoint_id": str(endpoint_id),
-                "status": "attempted",
-                "retry_count": i,
-                "received_at": datetime.now().isoformat(), # Use current time
-            }).execute()
+            with metrics.observe_supabase("webhooks", "insert"):
+                await supabase.from_("webhooks").insert({
+                    "id_webhook": str(webhook_log_id),
+                    "endpoint_id": str(endpoint_id),
+                    "status": "attempted",
+                    "retry_count": i,
+                    "received_at": datetime.now().isoformat(), # Use current time
+                }).execute()
         except Exception as e:
             logger.error(f"Error al registrar intento de webhook inicial para {request_id}: {e}")
 
@@ -236,13 +483,16 @@ async def _send_callback(url: str, payload: dict, request_id: UUID, endpoint_id:
                 await asyncio.sleep(2.0 * (i + 1)) # Backoff lineal
         finally:
             # Update webhook log record
+            metrics.WEBHOOK_ATTEMPTS.inc(outcome=status)
+            timeline.mark("webhook", attempt=i + 1, outcome=status, http_status=http_status)
             try:
-                await supabase.from_("webhooks").update({
-                    "status": status,
-                    "http_status": http_status,
-                    "error": error_msg,
-                    "processed_at": datetime.now().isoformat(),
-                }).eq("id_webhook", str(webhook_log_id)).execute()
+                with metrics.observe_supabase("webhooks", "update"):
+                    await supabase.from_("webhooks").update({
+                        "status": status,
+                        "http_status": http_status,
+                        "error": error_msg,
+                        "processed_at": datetime.now().isoformat(),
+                    }).eq("id_webhook", str(webhook_log_id)).execute()
             except Exception as e:
                 logger.error(f"Error al actualizar log de webhook para {request_id}: {e}")
 
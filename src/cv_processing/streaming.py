@@ -0,0 +1,123 @@
+"""
+Resultados parciales en streaming.
+
+`TopLevelFieldParser` consume la salida del modelo trozo a trozo y devuelve cada campo
+de primer nivel del objeto JSON en cuanto está completo. `PartialResultBroker` reparte
+esos campos (y el resultado final validado) a los suscriptores SSE de cada petición.
+"""
+import asyncio
+import json
+
+# Segundos que se conserva el historial de una petición terminada para suscriptores tardíos.
+HISTORY_TTL_SECONDS = 60
+
+
+class TopLevelFieldParser:
+    """Parser incremental que detecta los miembros completos del objeto JSON raíz."""
+
+    def __init__(self):
+        self._member: list[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.done = False
+
+    def feed(self, chunk: str) -> list[tuple[str, object]]:
+        """Añade un trozo de texto y devuelve los campos `(clave, valor)` completados."""
+        completed = []
+        for char in chunk:
+            if self.done:
+                break
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._member.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.done = True
+                    completed.extend(self._flush_member())
+                    continue
+            elif char == "," and self._depth == 1:
+                completed.extend(self._flush_member())
+                continue
+            self._member.append(char)
+        return completed
+
+    def _flush_member(self) -> list[tuple[str, object]]:
+        text = "".join(self._member).strip()
+        self._member = []
+        if not text:
+            return []
+        try:
+            member = json.loads("{" + text + "}")
+        except json.JSONDecodeError:
+            return []
+        return list(member.items())
+
+
+class PartialResultBroker:
+    """Pub/sub en proceso de eventos de resultado por id de petición."""
+
+    def __init__(self):
+        self._history: dict[str, list[tuple[str, object]]] = {}
+        self._subscribers: dict[str, list[asyncio.Queue]] = {}
+
+    def publish(self, request_id: str | None, event: str, data: object):
+        if request_id is None:
+            return
+        self._history.setdefault(request_id, []).append((event, data))
+        for subscriber in self._subscribers.get(request_id, []):
+            subscriber.put_nowait((event, data))
+
+    def close(self, request_id: str | None):
+        """Emite el evento final y programa el borrado del historial."""
+        if request_id is None:
+            return
+        self.publish(request_id, "end", None)
+        asyncio.get_running_loop().call_later(HISTORY_TTL_SECONDS, self._history.pop, request_id, None)
+
+    def has_events(self, request_id: str) -> bool:
+        return request_id in self._history
+
+    async def subscribe(self, request_id: str, keepalive: float | None = None):
+        """
+        Itera los eventos ya emitidos y los nuevos hasta el evento `end`. Con `keepalive`,
+        emite `("keepalive", None)` tras ese número de segundos sin eventos.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in self._history.get(request_id, []):
+            queue.put_nowait(item)
+        self._subscribers.setdefault(request_id, []).append(queue)
+        try:
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield "keepalive", None
+                    continue
+                yield event, data
+                if event == "end":
+                    return
+        finally:
+            self._subscribers[request_id].remove(queue)
+            if not self._subscribers[request_id]:
+                del self._subscribers[request_id]
+
+
+broker = PartialResultBroker()
@@ -0,0 +1,267 @@
+"""
+Almacenamiento temporal de los archivos subidos.
+
+Cada subida se guarda bajo el id de su petición en uno de dos backends:
+
+- memoria: los archivos pequeños (hasta `TEMP_MEMORY_MAX_FILE_BYTES`) se quedan en RAM
+  como bytes, con un tope global. Los extractores los leen directamente del buffer: no hay
+  escritura a disco ni relectura posterior.
+- disco: el resto, en `TEMP_DIR/<id_request>/`, con una cuota de bytes. Apuntar
+  `TEMP_DIR` a un tmpfs (p. ej. `/dev/shm/cv-temp`) lo mantiene también en RAM.
+
+Un proceso que muere deja directorios huérfanos en disco: el barrido los borra al
+arrancar y periódicamente. Cada directorio lleva un archivo `.owner` con el pid del
+proceso que lo creó: mientras ese proceso exista (otro worker que comparte `TEMP_DIR`),
+el directorio no se toca, por antiguo que sea; si ya no existe, se borra enseguida. Los
+directorios sin dueño (de versiones anteriores) se borran al superar
+`TEMP_ORPHAN_MAX_AGE_SECONDS`.
+"""
+import asyncio
+import os
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO
+
+from src import metrics
+from src.config import (
+    logger,
+    TEMP_DIR,
+    TEMP_MEMORY_MAX_FILE_BYTES,
+    TEMP_MEMORY_MAX_BYTES,
+    TEMP_DISK_QUOTA_BYTES,
+    TEMP_SWEEP_INTERVAL_SECONDS,
+    TEMP_ORPHAN_MAX_AGE_SECONDS,
+)
+from src.exceptions import TempStorageFullError
+
+_COPY_CHUNK_BYTES = 1024 * 1024
+_OWNER_FILE_NAME = ".owner"
+
+ORPHANS_SWEPT = metrics.registry.register(metrics.Counter(
+    "cv_temp_orphans_swept_total", "Directorios temporales huérfanos eliminados por el barrido."))
+
+
+@dataclass
+class StoredFile:
+    """Un archivo subido, en memoria (`data`) o en disco (`path`)."""
+
+    request_id: str
+    name: str
+    size: int
+    data: bytes | None = None
+    path: Path | None = None
+
+    @property
+    def backend(self) -> str:
+        return "memory" if self.data is not None else "disk"
+
+    def detached(self) -> "StoredFile":
+        """Copia sin almacén, serializable para enviarla a un worker de CPU (`cpu_pool`)."""
+        return StoredFile(self.request_id, self.name, self.size, data=self.data, path=self.path)
+
+
+class TempStorage:
+    def __init__(self, root: Path, memory_max_file_bytes: int, memory_max_bytes: int, disk_quota_bytes: int):
+        self.root = root
+        self.memory_max_file_bytes = memory_max_file_bytes
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_quota_bytes = disk_quota_bytes
+        self._lock = threading.Lock() # se escribe desde hilos del executor
+        self._memory_bytes = 0
+        self._disk_bytes = 0 # archivos de este proceso
+        self._foreign_disk_bytes = 0 # huérfanos y otros procesos, según el último barrido
+        self._owned: dict[str, int] = {} # id de petición -> bytes contabilizados
+        self._sweeper: asyncio.Task | None = None
+
+    # --- contabilidad ---
+
+    def memory_bytes(self) -> int:
+        return self._memory_bytes
+
+    def disk_bytes(self) -> int:
+        return self._disk_bytes + self._foreign_disk_bytes
+
+    def usage(self) -> int:
+        return self._memory_bytes + self.disk_bytes()
+
+    def _fits_in_memory(self, size: int) -> bool:
+        return size <= self.memory_max_file_bytes and self._memory_bytes + size <= self.memory_max_bytes
+
+    def _fits_on_disk(self, size: int) -> bool:
+        return not self.disk_quota_bytes or self.disk_bytes() + size <= self.disk_quota_bytes
+
+    def ensure_capacity(self, size: int | None):
+        """Comprobación previa (sin reservar) para rechazar la subida antes de registrar la petición."""
+        if size is not None and not self._fits_in_memory(size) and not self._fits_on_disk(size):
+            raise TempStorageFullError()
+
+    # --- ciclo de vida de un archivo ---
+
+    def store(self, request_id: str, filename: str, source: BinaryIO, size: int | None = None) -> StoredFile:
+        """
+        Guarda el contenido de `source` (síncrono: se llama desde el executor). Si no se
+        conoce el tamaño de antemano, se copia a disco y se contabiliza al terminar.
+        """
+        name = Path(filename).name.strip() or "upload"
+        with self._lock:
+            in_memory = size is not None and self._fits_in_memory(size)
+            if in_memory:
+                self._memory_bytes += size
+                self._owned[request_id] = size
+        if in_memory:
+            try:
+                data = source.read()
+            except Exception:
+                self._forget(request_id, in_memory=True)
+                raise
+            return StoredFile(request_id, name, len(data), data=data)
+
+        if size is not None and not self._fits_on_disk(size):
+            raise TempStorageFullError()
+        with self._lock:
+            self._owned[request_id] = 0 # desde ya: el barrido no toca un directorio que se está escribiendo
+        request_dir = self.root / request_id
+        path = request_dir / name
+        try:
+            request_dir.mkdir(parents=True, exist_ok=True)
+            (request_dir / _OWNER_FILE_NAME).write_text(str(os.getpid()))
+            with path.open("wb") as target:
+                shutil.copyfileobj(source, target, _COPY_CHUNK_BYTES)
+        except Exception:
+            shutil.rmtree(request_dir, ignore_errors=True)
+            self._forget(request_id, in_memory=False)
+            raise
+        written = path.stat().st_size
+        with self._lock:
+            self._disk_bytes += written
+            self._owned[request_id] = written
+        return StoredFile(request_id, name, written, path=path)
+
+    def release(self, stored: StoredFile):
+        """Libera el archivo. Idempotente."""
+        if stored.data is None and stored.path is not None:
+            shutil.rmtree(stored.path.parent, ignore_errors=True)
+        self._forget(stored.request_id, in_memory=stored.data is not None)
+        stored.data = None
+        stored.path = None
+
+    def _forget(self, request_id: str, in_memory: bool):
+        with self._lock:
+            nbytes = self._owned.pop(request_id, 0)
+            if in_memory:
+                self._memory_bytes -= nbytes
+            else:
+                self._disk_bytes -= nbytes
+
+    # --- barrido de huérfanos ---
+
+    def sweep(self) -> int:
+        """Borra los directorios huérfanos y recalcula los bytes en disco ajenos. Síncrono."""
+        if not self.root.exists():
+            return 0
+        now = time.time()
+        removed = 0
+        foreign_bytes = 0
+        for entry in os.scandir(self.root):
+            with self._lock: # en vivo: una subida puede haber creado su directorio después de empezar el barrido
+                if entry.name in self._owned:
+                    continue
+            try:
+                owner = _owner_pid(entry)
+                # Con nuestro pid pero sin conocerlo, es de un proceso anterior con el mismo pid (p. ej. otro contenedor).
+                if owner is not None and owner != os.getpid() and pid_alive(owner):
+                    foreign_bytes += _tree_bytes(entry)
+                    continue
+                if owner is None and now - entry.stat().st_mtime < TEMP_ORPHAN_MAX_AGE_SECONDS:
+                    foreign_bytes += _tree_bytes(entry)
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path) # archivos sueltos del formato anterior (`temp/<uuid>_<nombre>`)
+                removed += 1
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning(f"No se pudo barrer el temporal huérfano {entry.path}: {e}")
+        with self._lock:
+            self._foreign_disk_bytes = foreign_bytes
+        if removed:
+            ORPHANS_SWEPT.inc(removed)
+            logger.info(f"Barrido de temporales: {removed} huérfanos eliminados en {self.root}.")
+        return removed
+
+    async def _sweep_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(TEMP_SWEEP_INTERVAL_SECONDS)
+            try:
+                await loop.run_in_executor(None, self.sweep)
+            except Exception as e:
+                logger.error(f"Error en el barrido de temporales: {e}")
+
+    async def start(self):
+        """Crea el directorio, hace el barrido de arranque y programa el periódico."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, lambda: self.root.mkdir(parents=True, exist_ok=True))
+        await loop.run_in_executor(None, self.sweep)
+        if TEMP_SWEEP_INTERVAL_SECONDS > 0:
+            self._sweeper = loop.create_task(self._sweep_periodically())
+
+    def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+
+
+def pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # existe, pero es de otro usuario
+        return True
+    return True
+
+
+def _owner_pid(entry: os.DirEntry) -> int | None:
+    """Pid del proceso que creó el directorio, o None si no lo indica (formato anterior o a medio crear)."""
+    if not entry.is_dir(follow_symlinks=False):
+        return None
+    try:
+        return int(Path(entry.path, _OWNER_FILE_NAME).read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _tree_bytes(entry: os.DirEntry) -> int:
+    if not entry.is_dir(follow_symlinks=False):
+        return entry.stat().st_size
+    total = 0
+    for dirpath, _, filenames in os.walk(entry.path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def local_path(source: "StoredFile | Path") -> Path | None:
+    """Ruta en disco del archivo, o None si está en memoria."""
+    return source.path if isinstance(source, StoredFile) else source
+
+
+def read_bytes(source: "StoredFile | Path") -> bytes | None:
+    """Bytes del archivo si ya están en memoria (sin leer de disco), o None."""
+    return source.data if isinstance(source, StoredFile) else None
+
+
+storage = TempStorage(TEMP_DIR, TEMP_MEMORY_MAX_FILE_BYTES, TEMP_MEMORY_MAX_BYTES, TEMP_DISK_QUOTA_BYTES)
+
+metrics.register_callback_gauge(
+    "cv_temp_dir_bytes", "Bytes ocupados en el directorio temporal de CVs.", storage.disk_bytes)
+metrics.register_callback_gauge(
+    "cv_temp_memory_bytes", "Bytes de CVs subidos retenidos en memoria.", storage.memory_bytes)
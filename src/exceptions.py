@@ -20,6 +20,12 @@ class EndpointNotFoundError(APIException):
         detail = f"Endpoint con id '{endpoint_id}' no encontrado."
         super().__init__(status_code=404, detail=detail)
 
+class RequestNotFoundError(APIException):
+    """Excepción para cuando una petición de procesamiento no se encuentra."""
+    def __init__(self, request_id: str):
+        detail = f"Petición con id '{request_id}' no encontrada."
+        super().__init__(status_code=404, detail=detail)
+
 class ForbiddenAccessError(APIException):
     """Excepción para intentos de acceso no autorizados a recursos."""
     def __init__(self, detail: str = "No tienes permiso para acceder a este recurso."):
@@ -45,3 +51,29 @@ class OpenAIError(APIException):
     """Excepción para errores relacionados con la API de OpenAI."""
     def __init__(self, detail: str = "Error en el servicio de análisis de IA."):
         super().__init__(status_code=503, detail=detail) # 503 Service Unavailable
+
+class TempStorageFullError(APIException):
+    """Excepción para cuando el almacenamiento temporal de subidas no tiene espacio."""
+    def __init__(self, detail: str = "No hay espacio para almacenar el archivo. Inténtalo más tarde."):
+        super().__init__(status_code=507, detail=detail) # 507 Insufficient Storage
+
+class InvalidIdempotencyKeyError(APIException):
+    """Excepción para una cabecera Idempotency-Key vacía, demasiado larga o con caracteres no imprimibles."""
+    def __init__(self, detail: str = "Idempotency-Key inválida: debe tener entre 1 y 255 caracteres imprimibles."):
+        super().__init__(status_code=400, detail=detail)
+
+class IdempotencyKeyConflictError(APIException):
+    """Excepción para una Idempotency-Key reutilizada con un archivo distinto."""
+    def __init__(self, detail: str = "La Idempotency-Key ya se usó con un archivo distinto."):
+        super().__init__(status_code=422, detail=detail)
+
+class InvalidBatchError(APIException):
+    """Excepción para un lote vacío, demasiado grande o con un archivo ZIP corrupto."""
+    def __init__(self, detail: str = "Lote inválido."):
+        super().__init__(status_code=400, detail=detail)
+
+class ResultNotAvailableError(APIException):
+    """Excepción para cuando una petición aún no tiene resultado (o terminó sin él)."""
+    def __init__(self, request_id: str, status: str | None):
+        detail = f"La petición '{request_id}' no tiene resultado disponible (estado: {status})."
+        super().__init__(status_code=404, detail=detail)
@@ -0,0 +1,144 @@
+"""
+Salud del proceso: liveness, readiness por saturación y rechazo temprano de subidas.
+
+- Liveness (`/health/live`): el proceso responde. No mira dependencias ni carga, para
+  que el orquestador no reinicie un proceso que solo está ocupado.
+- Readiness (`/health/ready`): calentamiento terminado y pipeline sin saturar (cola, incluidos
+  los elementos de lotes pendientes, trabajos en vuelo, retraso del event loop, bytes
+  temporales y caídas seguidas y recientes de Supabase/OpenAI). Cualquier umbral superado
+  devuelve 503 con los motivos, y el balanceador deja de enviar tráfico a esta réplica.
+- `LoadSheddingMiddleware`: con el pipeline saturado, las subidas se rechazan con 503 y
+  `Retry-After` antes de leer el cuerpo multipart, en vez de aceptarlas y encolarlas.
+"""
+import json
+import time
+
+from src import metrics, profiling, warmup
+from src.config import (
+    logger,
+    READY_MAX_QUEUED_JOBS,
+    READY_MAX_IN_FLIGHT_JOBS,
+    READY_MAX_LOOP_LAG_MS,
+    READY_MAX_TEMP_BYTES,
+    READY_MAX_DEPENDENCY_FAILURES,
+    READY_DEPENDENCY_FAILURE_WINDOW_SECONDS,
+    SHED_RETRY_AFTER_SECONDS,
+)
+from src.cv_processing.batch import BATCH_ITEMS_PENDING
+from src.cv_processing.temp_storage import storage
+
+# La saturación se recalcula como mucho cada medio segundo: recorrer el directorio temporal
+# en cada subida costaría más que la propia comprobación.
+_SATURATION_CACHE_SECONDS = 0.5
+
+UPLOADS_SHED = metrics.registry.register(metrics.Counter(
+    "cv_uploads_shed_total", "Subidas rechazadas con 503 por saturación del pipeline."))
+
+_cached_reasons: list[str] = []
+_cached_at = 0.0
+
+
+def _queued_jobs() -> float:
+    # Los elementos de lotes que esperan turno también son trabajo aceptado sin empezar.
+    return metrics.JOBS_QUEUED.value() + BATCH_ITEMS_PENDING.value()
+
+
+def _compute_saturation() -> list[str]:
+    reasons = []
+    queued = _queued_jobs()
+    if queued >= READY_MAX_QUEUED_JOBS:
+        reasons.append(f"cola de trabajos llena ({queued:.0f} >= {READY_MAX_QUEUED_JOBS})")
+    in_flight = metrics.JOBS_IN_FLIGHT.value()
+    if in_flight >= READY_MAX_IN_FLIGHT_JOBS:
+        reasons.append(f"demasiados trabajos en vuelo ({in_flight:.0f} >= {READY_MAX_IN_FLIGHT_JOBS})")
+    lag_ms = profiling.loop_lag_ms()
+    if lag_ms >= READY_MAX_LOOP_LAG_MS:
+        reasons.append(f"event loop retrasado ({lag_ms:.0f} ms >= {READY_MAX_LOOP_LAG_MS} ms)")
+    temp_bytes = storage.usage()
+    if temp_bytes >= READY_MAX_TEMP_BYTES:
+        reasons.append(f"almacenamiento temporal lleno ({temp_bytes} >= {READY_MAX_TEMP_BYTES} bytes)")
+    for name in ("supabase", "openai"):
+        failures = metrics.dependencies.recent_failures(name, READY_DEPENDENCY_FAILURE_WINDOW_SECONDS)
+        if failures >= READY_MAX_DEPENDENCY_FAILURES:
+            reasons.append(
+                f"{name} no responde ({failures} fallos seguidos en los últimos {READY_DEPENDENCY_FAILURE_WINDOW_SECONDS:.0f} s)")
+    return reasons
+
+
+def check_saturation() -> list[str]:
+    """Motivos por los que el pipeline está saturado (lista vacía si no lo está)."""
+    global _cached_reasons, _cached_at
+    now = time.monotonic()
+    if now - _cached_at >= _SATURATION_CACHE_SECONDS:
+        reasons = _compute_saturation()
+        if reasons and not _cached_reasons:
+            logger.warning(f"Pipeline saturado, se deja de aceptar trabajo: {'; '.join(reasons)}")
+        elif _cached_reasons and not reasons:
+            logger.info("Pipeline recuperado, se vuelve a aceptar trabajo.")
+        _cached_reasons, _cached_at = reasons, now
+    return _cached_reasons
+
+
+def readiness() -> tuple[bool, dict]:
+    """Estado de readiness: calentamiento terminado y pipeline sin saturar."""
+    reasons = check_saturation()
+    if not warmup.state.ready:
+        reasons = ["calentamiento no terminado"] + reasons
+    return not reasons, {
+        "status": "not_ready" if reasons else "ready",
+        "reasons": reasons,
+        "load": {
+            "queued_jobs": _queued_jobs(),
+            "pending_batch_items": BATCH_ITEMS_PENDING.value(),
+            "in_flight_jobs": metrics.JOBS_IN_FLIGHT.value(),
+            "loop_lag_ms": round(profiling.loop_lag_ms(), 1),
+        },
+        "dependencies": metrics.dependencies.snapshot(),
+        "warmup": warmup.state.snapshot(),
+    }
+
+
+class LoadSheddingMiddleware:
+    """
+    Middleware ASGI que rechaza las subidas multipart mientras el pipeline está saturado.
+    Actúa antes de parsear el cuerpo: se descarta a medida que llega (sin bufferizarlo ni
+    escribirlo a disco) solo para que el cliente reciba el 503 en vez de un corte de conexión.
+    El calentamiento no se comprueba aquí: de eso se encarga el balanceador vía readiness.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and _is_multipart(scope):
+            reasons = check_saturation()
+            if reasons:
+                UPLOADS_SHED.inc()
+                await _discard_body(receive)
+                body = json.dumps({"detail": "Servicio saturado, reintente más tarde.", "reasons": reasons}).encode("utf-8")
+                await send({
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode("ascii")),
+                        (b"retry-after", str(SHED_RETRY_AFTER_SECONDS).encode("ascii")),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+        await self.app(scope, receive, send)
+
+
+def _is_multipart(scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == b"content-type":
+            return value.lower().startswith(b"multipart/form-data")
+    return False
+
+
+async def _discard_body(receive):
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect" or not message.get("more_body", False):
+            return
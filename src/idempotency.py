@@ -0,0 +1,158 @@
+"""
+Claves de idempotencia (`Idempotency-Key`) para las subidas.
+
+Un cliente que reintenta una subida con la misma clave recibe el `request_id` original
+en lugar de crear otra petición: ni inserción en Supabase, ni archivo, ni trabajo nuevo.
+
+Las claves se guardan de forma compacta: la entrada es un resumen de 16 bytes de
+(usuario, endpoint, clave) y su valor, el id de la petición (16 bytes), una huella de
+8 bytes de la subida (nombre y tamaño) y el vencimiento.
+
+Con varios workers (`src/launcher.py`) la fuente de verdad es la caché compartida
+(`src/shared_cache.py`): la primera subida reserva la clave con una inserción atómica
+(`SharedCache.add`) que caduca a los `_RESERVATION_SECONDS` si el worker muere, y al
+registrarse la petición la sustituye por el id definitivo. Un reintento que llega a otro
+worker mientras la primera subida se registra sondea la caché hasta que termina. En cada
+proceso se guardan además las claves ya resueltas (`OrderedDict`: con un TTL común, el
+orden de inserción es también el de vencimiento, así que el desalojo solo mira el
+principio) y un futuro por clave en registro, para que los reintentos que llegan al mismo
+worker esperen sin sondear. Sin caché compartida las claves son solo de cada proceso.
+"""
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from uuid import UUID
+
+from src import metrics
+from src.config import IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_KEYS
+from src.exceptions import IdempotencyKeyConflictError, InvalidIdempotencyKeyError
+from src.shared_cache import cache as shared_cache
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+_NAMESPACE = "idempotency"
+# Vida de una reserva sin resolver: cubre de sobra el registro de una subida (inserción y guardado del archivo).
+_RESERVATION_SECONDS = 60.0
+_POLL_SECONDS = 0.1
+# Valores en la caché compartida: reserva (b"R" + huella) o petición registrada (b"C" + id + huella).
+_RESERVED = b"R"
+_COMPLETED = b"C"
+
+IDEMPOTENT_REPLAYS = metrics.registry.register(metrics.Counter(
+    "cv_idempotent_replays_total", "Subidas repetidas con la misma Idempotency-Key respondidas sin reprocesar."))
+
+
+def _digest(*parts: str, size: int) -> bytes:
+    return hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=size).digest()
+
+
+def upload_fingerprint(filename: str | None, size: int | None) -> bytes:
+    """Huella de la subida: una misma clave con otro archivo es un error del cliente, no un reintento."""
+    return _digest(filename or "", str(size), size=8)
+
+
+class IdempotencyStore:
+    def __init__(self, ttl_seconds: float, max_keys: int):
+        self.ttl = ttl_seconds
+        self.max_keys = max_keys
+        self._entries: OrderedDict[bytes, tuple[float, bytes, bytes]] = OrderedDict()
+        self._pending: dict[bytes, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def scope_key(user_id: str, endpoint_id: str, key: str) -> bytes:
+        if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+            raise InvalidIdempotencyKeyError()
+        return _digest(str(user_id), str(endpoint_id), key, size=16)
+
+    def _evict(self, now: float):
+        while self._entries:
+            scope, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_keys:
+                break
+            del self._entries[scope]
+
+    def _lookup(self, scope: bytes, fingerprint: bytes) -> UUID | None:
+        self._evict(time.monotonic())
+        entry = self._entries.get(scope)
+        if entry is None:
+            return None
+        _, request_id, stored_fingerprint = entry
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyKeyConflictError()
+        return UUID(bytes=request_id)
+
+    def _remember(self, scope: bytes, request_id: bytes, fingerprint: bytes):
+        self._entries[scope] = (time.monotonic() + self.ttl, request_id, fingerprint)
+        self._entries.move_to_end(scope)
+        self._evict(time.monotonic())
+
+    async def _reserve(self, scope: bytes, fingerprint: bytes) -> UUID | bool:
+        """
+        Reserva la clave en la caché compartida. Devuelve True si queda reservada, el id de
+        la petición si otro worker ya la registró, o False si otro worker la está registrando.
+        """
+        existing = await shared_cache.aadd(_NAMESPACE, scope.hex(), _RESERVED + fingerprint, _RESERVATION_SECONDS)
+        if existing is None:
+            return True
+        if existing[-len(fingerprint):] != fingerprint:
+            raise IdempotencyKeyConflictError()
+        if existing[:1] != _COMPLETED:
+            return False
+        request_id = existing[1:17]
+        self._remember(scope, request_id, fingerprint)
+        return UUID(bytes=request_id)
+
+    async def begin(self, scope: bytes, fingerprint: bytes) -> UUID | None:
+        """
+        Devuelve el id de la petición original si la clave ya se usó. Si no, la clave queda
+        reservada para el llamante, que debe cerrar con `complete` o `abort`.
+        """
+        while True:
+            request_id = self._lookup(scope, fingerprint)
+            if request_id is None and scope not in self._pending:
+                reserved = await self._reserve(scope, fingerprint)
+                if reserved is True and scope not in self._pending:
+                    self._pending[scope] = asyncio.get_running_loop().create_future()
+                    return None
+                if reserved is False:
+                    # Otro worker la está registrando: se sondea hasta que la resuelva o venza su reserva.
+                    await asyncio.sleep(_POLL_SECONDS)
+                    continue
+                request_id = reserved if isinstance(reserved, UUID) else None
+            if request_id is not None:
+                IDEMPOTENT_REPLAYS.inc()
+                return request_id
+            # Otra subida con la misma clave se está registrando en este worker: se espera a su resultado.
+            await asyncio.shield(self._pending[scope])
+
+    async def complete(self, scope: bytes, fingerprint: bytes, request_id: UUID | str):
+        request_id = request_id if isinstance(request_id, UUID) else UUID(str(request_id))
+        self._remember(scope, request_id.bytes, fingerprint)
+        try:
+            await shared_cache.aput(_NAMESPACE, scope.hex(), _COMPLETED + request_id.bytes + fingerprint, self.ttl)
+        finally:
+            self._release(scope)
+
+    async def abort(self, scope: bytes, fingerprint: bytes):
+        """La subida falló: la clave queda libre para un reintento."""
+        try:
+            await shared_cache.adelete(_NAMESPACE, scope.hex(), _RESERVED + fingerprint)
+        finally:
+            self._release(scope)
+
+    def _release(self, scope: bytes):
+        pending = self._pending.pop(scope, None)
+        if pending is not None and not pending.done():
+            pending.set_result(None)
+
+
+store = IdempotencyStore(IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_MAX_KEYS)
+# Los blobs de resultados no deben desalojar claves: solo vencen con su TTL.
+shared_cache.pin(_NAMESPACE)
+
+metrics.register_callback_gauge("cv_idempotency_keys", "Claves de idempotencia resueltas guardadas en este proceso.", lambda: len(store))
@@ -0,0 +1,321 @@
+"""
+Lanzador multiproceso de la API: `python -m src.launcher [--workers N] [--cpu-workers M]`.
+
+El proceso maestro importa la app y las librerías pesadas (PyMuPDF, python-docx, Pillow,
+SDK de OpenAI) una sola vez, abre el socket de escucha y después hace fork:
+
+- `WEB_WORKERS` workers de la API: cada uno sirve `src.main:app` con uvicorn sobre el
+  socket compartido (el kernel reparte las conexiones) y ejecuta su propio lifespan, de
+  modo que los clientes de Supabase y OpenAI y el event loop se crean después del fork.
+- `CPU_WORKERS` workers de CPU para el render de páginas, la extracción de texto y el OCR
+  (ver `src/cv_processing/cpu_pool.py`), compartidos por todos los workers de la API.
+
+Las cachés de datos que casi no cambian (claves de API, endpoints, blobs de resultados)
+se comparten en un SQLite local (`src/shared_cache.py`); el lanzador la activa por
+defecto en `SHARED_CACHE_PATH=shared_cache.sqlite3`.
+
+Reciclado: un worker de la API que completa `WORKER_MAX_JOBS` subidas (los elementos de
+lotes y los trabajos diferidos no cuentan) avisa al maestro, que arranca su sustituto, y
+deja de aceptar conexiones. Antes de salir espera a que terminen sus lotes en curso (los
+elementos que solo esperan un lote diferido no cuentan) y después a los trabajos
+restantes (hasta `WORKER_DRAIN_TIMEOUT_SECONDS`). Los trabajos que esperan un lote
+diferido no se esperan: al salir, otro worker adopta el lote y
+termina sus peticiones. Un trabajo cancelado al agotarse el drenaje se cierra como
+fallido, con su webhook. Un worker de CPU sale tras
+`CPU_WORKER_MAX_JOBS` tareas y el maestro lo sustituye. Un worker que muere se reemplaza.
+Con SIGTERM o SIGINT el maestro para primero los workers de la API (con el mismo drenaje)
+y después los de CPU.
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import uvicorn
+
+DEFAULT_SHARED_CACHE_PATH = "shared_cache.sqlite3"
+# Un worker que muere antes de este tiempo se considera un fallo de arranque: se espera antes de reponerlo.
+_MIN_UPTIME_SECONDS = 5.0
+_RESPAWN_BACKOFF_SECONDS = 1.0
+_POLL_SECONDS = 0.5
+_CPU_STOP_TIMEOUT_SECONDS = 10.0
+
+logger = logging.getLogger(__name__)
+
+
+def _exit_on_signal(signum, frame):
+    raise SystemExit(0)
+
+
+def _watch_parent(parent_pid: int):
+    """Si el maestro muere sin parar a sus workers (SIGKILL), cada worker se para solo."""
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    logger.warning(f"Worker {os.getpid()}: el lanzador {parent_pid} ya no existe; se detiene.")
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+@dataclass
+class _Child:
+    kind: str # 'api' o 'cpu'
+    slot: int | None
+    started_at: float
+    retiring: bool = False
+
+
+class _RecyclingServer(uvicorn.Server):
+    """Servidor uvicorn que sale de forma ordenada tras `max_jobs` trabajos completados."""
+
+    def __init__(
+        self, config: uvicorn.Config, max_jobs: int, jobs_done: Callable[[], float],
+        busy: Callable[[], float], on_recycle: Callable[[], None],
+    ):
+        super().__init__(config)
+        self.max_jobs = max_jobs
+        self.jobs_done = jobs_done
+        self.busy = busy # lotes con elementos por empezar o en proceso: el reciclado los espera sin límite de tiempo
+        self.on_recycle = on_recycle
+        self._watcher: asyncio.Task | None = None
+
+    async def serve(self, sockets: list[socket.socket] | None = None):
+        if self.max_jobs:
+            self._watcher = asyncio.get_running_loop().create_task(self._recycle_after_max_jobs())
+        await super().serve(sockets)
+
+    async def _recycle_after_max_jobs(self):
+        while self.jobs_done() < self.max_jobs:
+            await asyncio.sleep(1)
+        logger.info(f"Worker {os.getpid()}: {self.jobs_done():.0f} trabajos completados; se recicla.")
+        self.on_recycle()
+        # Deja de aceptar conexiones (el sustituto ya arranca) y espera a los lotes en curso:
+        # el drenaje de uvicorn tiene un plazo y cancelaría lo que quede a medias.
+        for server in self.servers:
+            server.close()
+        if self.busy():
+            logger.info(f"Worker {os.getpid()}: esperando a {self.busy():.0f} lotes en curso antes de salir.")
+        while self.busy() and not self.should_exit:
+            await asyncio.sleep(1)
+        self.should_exit = True
+
+
+class Supervisor:
+    def __init__(
+        self, uvicorn_config: uvicorn.Config, sock: socket.socket, app_workers: int, cpu_workers: int,
+        max_jobs: int, cpu_max_jobs: int, drain_timeout: float,
+    ):
+        from src import metrics
+        from src.cv_processing import batch
+        from src.cv_processing.cpu_pool import pool
+
+        self.uvicorn_config = uvicorn_config
+        self.sock = sock
+        self.app_workers = app_workers
+        self.cpu_workers = cpu_workers
+        self.max_jobs = max_jobs
+        self.cpu_max_jobs = cpu_max_jobs
+        self.drain_timeout = drain_timeout
+        self.metrics = metrics
+        self.batch = batch
+        self.pool = pool
+        # Un hueco de sobra por worker: el sustituto arranca mientras el reciclado drena.
+        self.slots = 2 * app_workers
+        self.children: dict[int, _Child] = {}
+        self.stopping = False
+        self._control_r, self._control_w = os.pipe()
+        self._control_buffer = b""
+        self._next_spawn = 0.0
+
+    # --- hijos ---
+
+    def _fork(self, kind: str, slot: int | None, target: Callable[[], None]):
+        parent_pid = os.getpid()
+        pid = os.fork()
+        if pid:
+            self.children[pid] = _Child(kind, slot, time.monotonic())
+            return
+        code = 0
+        try:
+            # uvicorn vuelve a lanzar al salir la señal que lo paró: aquí termina el worker limpiamente.
+            signal.signal(signal.SIGTERM, _exit_on_signal)
+            signal.signal(signal.SIGINT, _exit_on_signal)
+            os.close(self._control_r)
+            threading.Thread(target=_watch_parent, args=(parent_pid,), name="parent-watch", daemon=True).start()
+            target()
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException as e:
+            logger.exception(f"Worker {kind} {os.getpid()} terminó con error: {e}")
+            code = 1
+        finally:
+            from src.log_pipeline import stop_logging
+
+            stop_logging()
+            os._exit(code)
+
+    def _run_api_worker(self, slot: int):
+        if self.cpu_workers:
+            self.pool.attach(slot)
+        server = _RecyclingServer(
+            self.uvicorn_config, self.max_jobs, functools.partial(self.metrics.JOBS_TOTAL.total, source="upload"),
+            self.batch.BATCHES_RUNNING.value, self._notify_recycle,
+        )
+        server.run(sockets=[self.sock])
+
+    def _notify_recycle(self):
+        os.write(self._control_w, f"recycle {os.getpid()}\n".encode("ascii"))
+
+    def _run_cpu_worker(self):
+        # Ctrl+C llega a todo el grupo: las tareas en curso terminan y el maestro para este worker al final.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.sock.close()
+        self.pool.serve(self.cpu_max_jobs)
+
+    def _active(self, kind: str) -> int:
+        return sum(1 for child in self.children.values() if child.kind == kind and not child.retiring)
+
+    def _top_up(self):
+        """Arranca los workers que faltan (al inicio, tras un reciclado o tras una caída)."""
+        if self.stopping or time.monotonic() < self._next_spawn:
+            return
+        while self._active("cpu") < self.cpu_workers:
+            self._fork("cpu", None, self._run_cpu_worker)
+        used = {child.slot for child in self.children.values() if child.kind == "api"}
+        free = [slot for slot in range(self.slots) if slot not in used]
+        while self._active("api") < self.app_workers and free:
+            slot = free.pop(0)
+            self._fork("api", slot, functools.partial(self._run_api_worker, slot))
+
+    def _read_control(self):
+        self._control_buffer += os.read(self._control_r, 4096)
+        *lines, self._control_buffer = self._control_buffer.split(b"\n")
+        for line in lines:
+            command, _, pid = line.decode("ascii").partition(" ")
+            child = self.children.get(int(pid)) if command == "recycle" else None
+            if child is not None:
+                child.retiring = True
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            child = self.children.pop(pid, None)
+            if child is None:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            uptime = time.monotonic() - child.started_at
+            if child.kind == "cpu":
+                if self.cpu_workers:
+                    self.pool.notify_worker_exit(pid, [c.slot for c in self.children.values() if c.kind == "api"])
+            elif self.cpu_workers:
+                self.pool.discard_results(child.slot)
+            if code == 0 and (child.retiring or child.kind == "cpu" or self.stopping):
+                logger.info(f"Worker {child.kind} {pid} terminado tras {uptime:.0f} s.")
+                continue
+            logger.error(f"Worker {child.kind} {pid} terminó inesperadamente (código {code}) tras {uptime:.0f} s.")
+            if uptime < _MIN_UPTIME_SECONDS:
+                self._next_spawn = time.monotonic() + _RESPAWN_BACKOFF_SECONDS
+
+    # --- ciclo principal ---
+
+    def _request_stop(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        if self.cpu_workers:
+            self.pool.create(self.slots)
+        logger.info(
+            f"Lanzador {os.getpid()}: {self.app_workers} workers de la API, {self.cpu_workers} de CPU "
+            f"(reciclado cada {self.max_jobs or '∞'} trabajos / {self.cpu_max_jobs or '∞'} tareas)."
+        )
+        while not self.stopping:
+            self._top_up()
+            readable, _, _ = select.select([self._control_r], [], [], _POLL_SECONDS)
+            if readable:
+                self._read_control()
+            self._reap()
+        self._shutdown()
+
+    def _signal_all(self, kind: str, signum: int):
+        for pid, child in list(self.children.items()):
+            if child.kind == kind:
+                try:
+                    os.kill(pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def _wait_for(self, kind: str, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while any(child.kind == kind for child in self.children.values()):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+            self._reap()
+        return True
+
+    def _shutdown(self):
+        logger.info(f"Lanzador {os.getpid()}: parando {len(self.children)} workers.")
+        # Primero la API (drenando sus trabajos, que pueden estar usando los workers de CPU).
+        self._signal_all("api", signal.SIGTERM)
+        if not self._wait_for("api", self.drain_timeout + _CPU_STOP_TIMEOUT_SECONDS):
+            self._signal_all("api", signal.SIGKILL)
+            self._wait_for("api", _CPU_STOP_TIMEOUT_SECONDS)
+        self._signal_all("cpu", signal.SIGTERM)
+        if not self._wait_for("cpu", _CPU_STOP_TIMEOUT_SECONDS):
+            self._signal_all("cpu", signal.SIGKILL)
+            self._wait_for("cpu", _CPU_STOP_TIMEOUT_SECONDS)
+        logger.info(f"Lanzador {os.getpid()}: parado.")
+
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Lanza la API con varios workers pre-cargados.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, help="Workers de la API (por defecto WEB_WORKERS).")
+    parser.add_argument("--cpu-workers", type=int, help="Workers de CPU (por defecto CPU_WORKERS).")
+    parser.add_argument("--max-jobs", type=int, help="Trabajos por worker antes de reciclarlo (por defecto WORKER_MAX_JOBS).")
+    parser.add_argument("--log-level", default="info", help="Nivel de log de uvicorn.")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
+    from dotenv import load_dotenv
+
+    args = _parse_args(argv)
+    # La configuración se lee al importar `src.config`: los argumentos entran como variables de entorno.
+    load_dotenv()
+    for name, value in (("WEB_WORKERS", args.workers), ("CPU_WORKERS", args.cpu_workers), ("WORKER_MAX_JOBS", args.max_jobs)):
+        if value is not None:
+            os.environ[name] = str(value)
+    os.environ.setdefault("SHARED_CACHE_PATH", DEFAULT_SHARED_CACHE_PATH)
+
+    from src import config, warmup
+    from src.main import app
+
+    uvicorn_config = uvicorn.Config(
+        app, host=args.host, port=args.port, log_level=args.log_level,
+        timeout_graceful_shutdown=config.WORKER_DRAIN_TIMEOUT_SECONDS,
+    )
+    sock = uvicorn_config.bind_socket()
+    warmup.preload_modules()
+    Supervisor(
+        uvicorn_config, sock, max(1, config.WEB_WORKERS), max(0, config.CPU_WORKERS),
+        config.WORKER_MAX_JOBS, config.CPU_WORKER_MAX_JOBS, config.WORKER_DRAIN_TIMEOUT_SECONDS,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
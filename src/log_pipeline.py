@@ -0,0 +1,244 @@
+"""
+Pipeline de logging asíncrono y estructurado.
+
+Los registros se encolan en una cola acotada desde el hilo que loguea (el event loop)
+y un hilo de fondo (`QueueListener`) los formatea como JSON y los escribe en un archivo
+con rotación. El coste en el event loop queda limitado a copiar el registro en la cola:
+si la cola se llena, el registro se descarta y se contabiliza en lugar de bloquear.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable
+
+# Id de la petición en curso, para correlacionar todos los registros de un mismo trabajo.
+request_id_var: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+_MAX_TRACKED_REQUESTS = 4096
+
+
+class LoggingStats:
+    """Contadores del coste del logging, globales y por petición."""
+
+    def __init__(self, max_bytes_per_request: int):
+        self.max_bytes_per_request = max_bytes_per_request
+        self.records = 0
+        self.bytes = 0
+        self.dropped_queue_full = 0
+        self.dropped_request_budget = 0
+        self.dropped_sampling = 0
+        self.enqueue_seconds = 0.0
+        self._per_request: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def admit(self, request_id: str | None, nbytes: int, enforce_budget: bool = True) -> bool:
+        """
+        Registra el tamaño del mensaje y decide si cabe en el tope de la petición.
+        Los avisos y errores (`enforce_budget=False`) se cuentan pero nunca se descartan.
+        """
+        with self._lock:
+            if request_id is not None:
+                used = self._per_request.pop(request_id, 0)
+                if enforce_budget and used + nbytes > self.max_bytes_per_request:
+                    self._per_request[request_id] = used
+                    self.dropped_request_budget += 1
+                    return False
+                self._per_request[request_id] = used + nbytes
+                if len(self._per_request) > _MAX_TRACKED_REQUESTS:
+                    self._per_request.popitem(last=False)
+            self.records += 1
+            self.bytes += nbytes
+            return True
+
+    def record_enqueue(self, seconds: float, dropped_queue_full: bool = False):
+        """Suma el coste de un encolado y, si la cola estaba llena, el descarte."""
+        with self._lock:
+            self.enqueue_seconds += seconds
+            if dropped_queue_full:
+                self.dropped_queue_full += 1
+
+    def record_sampled_out(self):
+        with self._lock:
+            self.dropped_sampling += 1
+
+    def request_bytes(self, request_id: str) -> int:
+        with self._lock:
+            return self._per_request.get(request_id, 0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "records": self.records,
+                "bytes": self.bytes,
+                "dropped_queue_full": self.dropped_queue_full,
+                "dropped_request_budget": self.dropped_request_budget,
+                "dropped_sampling": self.dropped_sampling,
+                "enqueue_seconds": round(self.enqueue_seconds, 6),
+            }
+
+
+class JSONFormatter(logging.Formatter):
+    """Formatea cada registro como una línea JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "pid": record.process, # varios workers escriben en el mismo archivo (ver src/launcher.py)
+            "msg": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que nunca bloquea: añade el id de petición del contexto actual,
+    aplica el tope de bytes por petición y descarta (contabilizando) si la cola está llena.
+    """
+
+    def __init__(self, log_queue: queue.Queue, stats: LoggingStats):
+        super().__init__(log_queue)
+        self.stats = stats
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Se resuelve aquí el mensaje (los args pueden no ser serializables entre hilos)
+        # pero se deja el formateo JSON al hilo de escritura.
+        message = record.getMessage()
+        exc_text = record.exc_text
+        if record.exc_info and not exc_text:
+            exc_text = self._exc_formatter.formatException(record.exc_info)
+        prepared = logging.makeLogRecord(record.__dict__)
+        prepared.msg, prepared.args, prepared.exc_info, prepared.exc_text = message, None, None, exc_text
+        prepared.request_id = request_id_var.get()
+        return prepared
+
+    def emit(self, record: logging.LogRecord):
+        start = time.perf_counter()
+        queue_full = False
+        try:
+            prepared = self.prepare(record)
+            nbytes = len(prepared.msg) + len(prepared.exc_text or "")
+            if not self.stats.admit(prepared.request_id, nbytes, record.levelno < logging.WARNING):
+                return
+            try:
+                self.queue.put_nowait(prepared)
+            except queue.Full:
+                queue_full = True
+        except Exception:
+            self.handleError(record)
+        finally:
+            self.stats.record_enqueue(time.perf_counter() - start, queue_full)
+
+
+class _PipelineState:
+    def __init__(self):
+        self.listener: logging.handlers.QueueListener | None = None
+        self.handler: NonBlockingQueueHandler | None = None
+        self.stats: LoggingStats | None = None
+        self.payload_sample_rate = 0.0
+
+
+_state = _PipelineState()
+
+
+def setup_logging(
+    log_file: Path,
+    level: str = "INFO",
+    rotation: str = "size",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    rotation_when: str = "midnight",
+    queue_size: int = 10000,
+    max_bytes_per_request: int = 64 * 1024,
+    payload_sample_rate: float = 0.0,
+):
+    """Instala la cola de logging en el logger raíz y arranca el hilo de escritura."""
+    if _state.listener is not None:
+        return
+
+    if rotation == "time":
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=rotation_when, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    file_handler.setFormatter(JSONFormatter())
+
+    stats = LoggingStats(max_bytes_per_request)
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue, stats)
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    _state.listener, _state.handler, _state.stats, _state.payload_sample_rate = listener, queue_handler, stats, payload_sample_rate
+    atexit.register(stop_logging)
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _restart_after_fork():
+    """
+    En un proceso hijo (`src/launcher.py`) el hilo de escritura no existe y la cola puede
+    haber quedado con un lock tomado: se crean una cola y un `QueueListener` nuevos con los
+    mismos handlers de archivo.
+    """
+    parent = _state.listener
+    if parent is None:
+        return
+    log_queue: queue.Queue = queue.Queue(maxsize=_state.handler.queue.maxsize)
+    listener = logging.handlers.QueueListener(
+        log_queue, *parent.handlers, respect_handler_level=parent.respect_handler_level)
+    _state.handler.queue = log_queue
+    _state.stats._lock = threading.Lock()
+    listener.start()
+    _state.listener = listener
+
+
+def stop_logging():
+    """Vacía la cola y detiene el hilo de escritura."""
+    if _state.listener is not None:
+        _state.listener.stop()
+        _state.listener = None
+
+
+def get_logging_stats() -> dict:
+    return _state.stats.snapshot() if _state.stats else {}
+
+
+def log_payload_dump(logger: logging.Logger, label: str, payload: Callable[[], str]):
+    """
+    Registra en DEBUG un volcado voluminoso (prompts, respuestas completas) solo si el
+    nivel DEBUG está activo y la petición cae en la muestra. `payload` se evalúa de forma
+    perezosa: si el volcado se descarta no se llega a serializar.
+    """
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= _state.payload_sample_rate:
+        if _state.stats:
+            _state.stats.record_sampled_out()
+        return
+    logger.debug(f"{label}: {payload()}")
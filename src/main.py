@@ -1,27 +1,32 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 import os # Import os for environment variables
 # from uuid import UUID, uuid4 # Not used in main.py, remove if not needed
-from postgrest.exceptions import APIError
 
-from src.config import logger, set_supabase_client # Import set_supabase_client
-from supabase import create_async_client # Import create_async_client
+from src.config import logger, set_supabase_client, GZIP_MIN_SIZE_BYTES
 from src.cv_processing.router import router as cv_processing_router
+from src.cv_processing.deferred import batcher as deferred_batcher
+from src.cv_processing.service import complete_orphaned_deferred, wait_for_cancelled_jobs
+from src.cv_processing.temp_storage import storage as temp_storage
 from src.users.router import router as users_router
+from src.request_status.router import router as request_status_router
 from src.exceptions import APIException
+from src import health, metrics, profiling, warmup
+from src.log_pipeline import get_logging_stats
 
-# Inicialización de la aplicación FastAPI.
-app = FastAPI(
-    title="API de Procesamiento de CVs",
-    description="Una API para extraer información de currículums de forma asíncrona usando IA.",
-    version="2.0.0",
-)
+# Plazo para cerrar (estado, log, webhook) los trabajos que uvicorn canceló al agotar el drenaje.
+# Cabe en el margen que da el lanzador antes de matar al worker.
+_CANCELLED_JOBS_CLOSE_SECONDS = 5.0
 
-# Startup Event
-@app.on_event("startup")
-async def startup_event():
+async def _init_supabase_client():
     try:
+        from supabase import create_async_client
+
         SUPABASE_URL = os.getenv("SUPABASE_URL")
         SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
@@ -39,6 +44,46 @@ async def startup_event():
         logger.error(f"Error al inicializar el cliente de Supabase: {e}")
         raise Exception(f"Error al inicializar el cliente de Supabase: {e}")
 
+# Ciclo de vida: el cliente de Supabase se crea antes de aceptar peticiones; el resto del
+# calentamiento corre en segundo plano y `/health/ready` responde 503 hasta que termina.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await _init_supabase_client()
+    await temp_storage.start()
+    profiling.start_loop_watchdog()
+    deferred_batcher.start(recover=complete_orphaned_deferred)
+    warmup_task = asyncio.create_task(warmup.run())
+    try:
+        yield
+    finally:
+        warmup_task.cancel()
+        try:
+            await wait_for_cancelled_jobs(_CANCELLED_JOBS_CLOSE_SECONDS)
+        except Exception as e:
+            logger.exception(f"Error al cerrar los trabajos cancelados: {e}")
+        # Cada paso por separado: un fallo al parar uno no deja los demás en marcha.
+        for stop in (deferred_batcher.stop, temp_storage.stop, profiling.stop_loop_watchdog):
+            try:
+                stop()
+            except Exception as e:
+                logger.exception(f"Error al detener {stop.__qualname__}: {e}")
+
+# Inicialización de la aplicación FastAPI.
+app = FastAPI(
+    title="API de Procesamiento de CVs",
+    description="Una API para extraer información de currículums de forma asíncrona usando IA.",
+    version="2.0.0",
+    lifespan=lifespan,
+)
+
+# Métricas del pipeline de logging, calculadas en el momento del scrape.
+metrics.register_callback_gauge(
+    "cv_log_records_dropped_queue_full", "Registros de log descartados por cola llena.",
+    lambda: get_logging_stats().get("dropped_queue_full", 0))
+metrics.register_callback_gauge(
+    "cv_log_records_dropped_request_budget", "Registros de log descartados por superar el tope por petición.",
+    lambda: get_logging_stats().get("dropped_request_budget", 0))
+
 # Exception Handler
 @app.exception_handler(APIException)
 async def api_exception_handler(request: Request, exc: APIException):
@@ -55,10 +100,14 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# SSE, respuestas parciales (206) y las que ya traen Content-Encoding (`/result`) pasan sin comprimir.
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE_BYTES, compresslevel=6)
+app.add_middleware(health.LoadSheddingMiddleware) # el último añadido es el más externo: rechaza antes de leer el cuerpo
 
 # Incluir routers
 app.include_router(cv_processing_router)
 app.include_router(users_router, prefix="/users")
+app.include_router(request_status_router, prefix="/requests")
 
 @app.get("/", summary="Endpoint de Bienvenida")
 async def read_root():
@@ -66,3 +115,21 @@ async def read_root():
     logger.info("Solicitud recibida en el endpoint de bienvenida.")
     return {"message": "Bienvenido a la API de Procesamiento de CVs"}
 
+
+@app.get("/metrics", summary="Métricas en formato Prometheus", include_in_schema=False)
+async def read_metrics():
+    """Expone las métricas del proceso en el formato de texto de Prometheus."""
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/health/live", summary="Liveness", include_in_schema=False)
+async def read_liveness():
+    """200 mientras el proceso responda; no depende de la carga ni de las dependencias."""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready", summary="Readiness", include_in_schema=False)
+async def read_readiness():
+    """200 con el calentamiento terminado y el pipeline sin saturar; 503 con los motivos en otro caso."""
+    ready, body = health.readiness()
+    return JSONResponse(body, status_code=200 if ready else 503)
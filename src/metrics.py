@@ -0,0 +1,325 @@
+"""
+Métricas en formato de exposición de Prometheus.
+
+Implementación mínima y sin dependencias: contadores, gauges e histogramas con
+etiquetas de baja cardinalidad (modo de análisis, tipo MIME, modelo, tabla...).
+Registrar una observación es una operación O(buckets) bajo un lock, por lo que se
+puede instrumentar el camino caliente y hacer scrape bajo carga.
+"""
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+from src import timeline
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+# Tipos MIME conocidos; cualquier otro se agrupa como 'other' para no disparar la cardinalidad.
+_KNOWN_MIME_TYPES = {
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "image/png",
+    "image/jpeg",
+}
+
+
+# Fallos recordados por dependencia: bastan para cualquier umbral razonable de readiness.
+_MAX_TRACKED_FAILURES = 1000
+
+
+def mime_label(mime_type: str | None) -> str:
+    return mime_type if mime_type in _KNOWN_MIME_TYPES else "other"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def total(self, **labels) -> float:
+        """Suma de las series con las etiquetas dadas (de todas, sin etiquetas)."""
+        positions = [(self.labelnames.index(name), str(value)) for name, value in labels.items()]
+        with self._lock:
+            return sum(v for k, v in self._values.items() if all(k[i] == value for i, value in positions))
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, *args, callback: Callable[[], float] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        if self._callback:
+            return float(self._callback())
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        if self._callback:
+            return self.header() + [f"{self.name} {float(self._callback())}"]
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # Por serie: [conteos por bucket (no acumulados)..., +Inf, suma]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = self.header()
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                bucket_label = 'le="' + le + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, bucket_label)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# --- Latencias por etapa ---
+UPLOAD_LATENCY = registry.register(Histogram(
+    "cv_upload_duration_seconds", "Duración del endpoint de subida.", ["outcome"]))
+STAGE_LATENCY = registry.register(Histogram(
+    "cv_stage_duration_seconds", "Duración de cada etapa del pipeline.", ["stage", "mime_type", "outcome"]))
+OPENAI_LATENCY = registry.register(Histogram(
+    "cv_openai_request_duration_seconds", "Duración de las llamadas a OpenAI.", ["api", "model", "outcome"]))
+SUPABASE_LATENCY = registry.register(Histogram(
+    "cv_supabase_request_duration_seconds", "Duración de las llamadas a Supabase.", ["table", "op", "outcome"]))
+CALLBACK_LATENCY = registry.register(Histogram(
+    "cv_callback_duration_seconds", "Duración total del envío del webhook (con reintentos).", ["outcome"]))
+
+# --- Contadores ---
+JOBS_TOTAL = registry.register(Counter(
+    "cv_jobs_total", "Trabajos terminados por modo de análisis, resultado y origen.", ["mode", "outcome", "source"]))
+OPENAI_TOKENS = registry.register(Counter(
+    "cv_openai_tokens_total", "Tokens consumidos en OpenAI.", ["model", "kind"]))
+WEBHOOK_ATTEMPTS = registry.register(Counter(
+    "cv_webhook_attempts_total", "Intentos de envío de webhook por resultado.", ["outcome"]))
+WEBHOOK_RETRIES = registry.register(Counter(
+    "cv_webhook_retries_total", "Reintentos de webhook (intentos posteriores al primero)."))
+
+# --- Estado actual ---
+JOBS_QUEUED = registry.register(Gauge(
+    "cv_jobs_queued", "Trabajos aceptados que aún no han empezado a procesarse."))
+JOBS_IN_FLIGHT = registry.register(Gauge(
+    "cv_jobs_in_flight", "Trabajos en procesamiento."))
+
+
+def register_callback_gauge(name: str, documentation: str, callback: Callable[[], float]):
+    """Registra un gauge cuyo valor se calcula en el momento del scrape."""
+    registry.register(Gauge(name, documentation, callback=callback))
+
+
+@contextmanager
+def observe_duration(histogram: Histogram, **labels):
+    """Observa la duración del bloque con la etiqueta `outcome` (success/error)."""
+    start = time.perf_counter()
+    outcome = "success"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        histogram.observe(time.perf_counter() - start, outcome=outcome, **labels)
+
+
+class DependencyHealth:
+    """
+    Estado de las dependencias externas según el resultado de las llamadas reales.
+    Solo cuentan como fallo las caídas (errores de transporte, timeouts, 5xx): una
+    respuesta de error de negocio (p. ej. "fila no encontrada") demuestra que la dependencia
+    responde, y un 429 solo que hay que ir más despacio.
+
+    Los fallos caducan (`recent_failures`): sin tráfico no llegan éxitos que pongan el
+    contador a cero, así que tras la ventana la dependencia vuelve a darse por disponible
+    y las primeras llamadas comprueban si lo está de verdad.
+    """
+
+    def __init__(self):
+        self._state: dict[str, dict] = {}
+        self._failures: dict[str, deque] = {} # instantes (monotonic) de los fallos desde el último éxito
+        self._lock = threading.Lock()
+
+    def record(self, name: str, ok: bool, error: BaseException | None = None):
+        with self._lock:
+            state = self._state.setdefault(name, {"consecutive_failures": 0, "last_success": None, "last_failure": None})
+            failures = self._failures.setdefault(name, deque(maxlen=_MAX_TRACKED_FAILURES))
+            if ok:
+                state["consecutive_failures"] = 0
+                state["last_success"] = time.time()
+                failures.clear()
+            else:
+                state["consecutive_failures"] += 1
+                state["last_failure"] = time.time()
+                state["last_error"] = type(error).__name__ if error else None
+                failures.append(time.monotonic())
+
+    def consecutive_failures(self, name: str) -> int:
+        with self._lock:
+            return self._state.get(name, {}).get("consecutive_failures", 0)
+
+    def recent_failures(self, name: str, window_seconds: float) -> int:
+        """Fallos seguidos (sin éxito entre medias) ocurridos en los últimos `window_seconds`."""
+        since = time.monotonic() - window_seconds
+        with self._lock:
+            return sum(1 for at in self._failures.get(name, ()) if at >= since)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {name: dict(state) for name, state in self._state.items()}
+
+
+dependencies = DependencyHealth()
+
+# Errores del SDK de OpenAI que indican caída (por nombre: el SDK se importa de forma perezosa).
+_OUTAGE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "ConnectTimeout"}
+
+
+def _is_throttled(exc: BaseException) -> bool:
+    return getattr(exc, "status_code", None) == 429
+
+
+def _is_outage(exc: BaseException) -> bool:
+    if type(exc).__name__ in _OUTAGE_ERROR_NAMES or isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(exc, "status_code", None)
+    if isinstance(status_code, int) and status_code >= 500:
+        return True
+    # Errores de transporte de httpx (usado por Supabase y OpenAI).
+    return any(cls.__name__ == "TransportError" for cls in type(exc).__mro__)
+
+
+@contextmanager
+def _observe_dependency(name: str):
+    try:
+        yield
+    except Exception as e:  # una cancelación no dice nada de la dependencia
+        if not _is_throttled(e): # un 429 no demuestra ni caída ni recuperación
+            dependencies.record(name, not _is_outage(e), e)
+        raise
+    else:
+        dependencies.record(name, True)
+
+
+def observe_stage(stage: str, mime_type: str | None = None):
+    return observe_duration(STAGE_LATENCY, stage=stage, mime_type=mime_label(mime_type))
+
+
+@contextmanager
+def observe_supabase(table: str, op: str):
+    """Latencia de una llamada a Supabase; las escrituras quedan además en la línea de tiempo."""
+    with observe_duration(SUPABASE_LATENCY, table=table, op=op), _observe_dependency("supabase"):
+        if op == "select":
+            yield
+        else:
+            with timeline.span("db", table=table, op=op):
+                yield
+
+
+@contextmanager
+def observe_openai(api: str, model: str):
+    """Latencia de una llamada a OpenAI, contabilizada también en el estado de la dependencia."""
+    with observe_duration(OPENAI_LATENCY, api=api, model=model), _observe_dependency("openai"):
+        yield
+
+
+def record_token_usage(model: str, prompt_tokens: int, completion_tokens: int):
+    OPENAI_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    OPENAI_TOKENS.inc(completion_tokens, model=model, kind="completion")
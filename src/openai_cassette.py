@@ -0,0 +1,193 @@
+"""
+Grabación y reproducción ("cassettes") de las llamadas a OpenAI.
+
+Envuelve el cliente de `config.py` y solo intercepta `chat.completions.create`, que es
+lo que usa el pipeline. Cada petición se identifica por una huella (SHA-256 de sus
+parámetros canónicos, sin los de streaming) y se guarda en `<dir>/<huella>.json` con el
+contenido devuelto, el uso de tokens, la latencia total y la cronología de los trozos.
+
+- `record`: llama a la API real y guarda cada respuesta.
+- `replay`: sirve las respuestas guardadas sin red ni API Key; una petición sin cassette
+  falla. Con `latency_scale` > 0 se reproduce la latencia grabada (multiplicada).
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ("off", "record", "replay")
+# Parámetros que no cambian el contenido de la respuesta: no forman parte de la huella.
+_TRANSPORT_PARAMS = {"stream", "stream_options", "timeout", "extra_headers"}
+
+
+class CassetteMissError(Exception):
+    """No hay cassette grabado para la petición en modo replay."""
+
+
+def request_fingerprint(params: dict) -> str:
+    canonical = {k: v for k, v in params.items() if k not in _TRANSPORT_PARAMS}
+    encoded = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _request_summary(params: dict) -> dict:
+    """Resumen legible de la petición (sin imágenes) para inspeccionar los cassettes."""
+    messages = []
+    for message in params.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, list):
+            parts = [part.get("type") for part in content]
+            messages.append({"role": message.get("role"), "parts": parts})
+        else:
+            messages.append({"role": message.get("role"), "chars": len(content or "")})
+    return {"model": params.get("model"), "messages": messages}
+
+
+class _CassetteCompletions:
+    def __init__(self, cassette: "Cassette"):
+        self._cassette = cassette
+
+    async def create(self, **params):
+        return await self._cassette.create(**params)
+
+
+class _CassetteChat:
+    def __init__(self, cassette: "Cassette"):
+        self.completions = _CassetteCompletions(cassette)
+
+
+class Cassette:
+    """Cliente con la misma forma que `AsyncOpenAI` para `chat.completions.create`."""
+
+    def __init__(self, client, mode: str, directory: Path, latency_scale: float = 0.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Modo de cassette no soportado: {mode}")
+        if mode == "record" and client is None:
+            raise ValueError("El modo record necesita un cliente de OpenAI real.")
+        self._client = client
+        self.mode = mode
+        self.directory = directory
+        self.latency_scale = latency_scale
+        self.chat = _CassetteChat(self)
+        directory.mkdir(parents=True, exist_ok=True)
+
+    def __getattr__(self, name):
+        # Cualquier otra API se delega en el cliente real (si existe).
+        if self._client is None:
+            raise AttributeError(f"'{name}' no está disponible en modo replay de cassettes.")
+        return getattr(self._client, name)
+
+    def _path(self, fingerprint: str) -> Path:
+        return self.directory / f"{fingerprint}.json"
+
+    async def create(self, **params):
+        fingerprint = request_fingerprint(params)
+        if self.mode == "replay":
+            return await self._replay(fingerprint, params)
+        return await self._record(fingerprint, params)
+
+    # --- replay ---
+
+    async def _replay(self, fingerprint: str, params: dict):
+        path = self._path(fingerprint)
+        loop = asyncio.get_running_loop()
+        try:
+            entry = json.loads(await loop.run_in_executor(None, path.read_text, "utf-8"))
+        except FileNotFoundError:
+            raise CassetteMissError(f"No hay cassette para la petición {fingerprint} ({_request_summary(params)}).")
+        logger.info(f"Cassette {fingerprint[:12]} reproducido (latencia x{self.latency_scale}).")
+        if params.get("stream"):
+            return self._replay_stream(entry, params)
+        if self.latency_scale:
+            await asyncio.sleep(entry["latency_s"] * self.latency_scale)
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate({
+            "id": entry["id"],
+            "object": "chat.completion",
+            "created": entry["created"],
+            "model": entry["model"],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(text for _, text in entry["chunks"])},
+                "finish_reason": entry["finish_reason"],
+            }],
+            "usage": entry["usage"],
+        })
+
+    async def _replay_stream(self, entry: dict, params: dict):
+        from openai.types.chat import ChatCompletionChunk
+
+        def chunk(choices: list, usage: dict | None = None) -> ChatCompletionChunk:
+            return ChatCompletionChunk.model_validate({
+                "id": entry["id"], "object": "chat.completion.chunk", "created": entry["created"],
+                "model": entry["model"], "choices": choices, "usage": usage,
+            })
+
+        start = time.perf_counter()
+        for offset, text in entry["chunks"]:
+            if self.latency_scale:
+                await asyncio.sleep(max(0.0, offset * self.latency_scale - (time.perf_counter() - start)))
+            yield chunk([{"index": 0, "delta": {"content": text}, "finish_reason": None}])
+        yield chunk([{"index": 0, "delta": {}, "finish_reason": entry["finish_reason"]}])
+        if (params.get("stream_options") or {}).get("include_usage"):
+            yield chunk([], entry["usage"])
+
+    # --- record ---
+
+    async def _save(self, fingerprint: str, params: dict, entry: dict):
+        entry = {
+            "fingerprint": fingerprint,
+            "recorded_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "request": _request_summary(params),
+            **entry,
+        }
+        text = json.dumps(entry, indent=2, ensure_ascii=False)
+        await asyncio.get_running_loop().run_in_executor(None, self._path(fingerprint).write_text, text, "utf-8")
+        logger.info(f"Cassette {fingerprint[:12]} grabado ({entry['latency_s']} s).")
+
+    async def _record(self, fingerprint: str, params: dict):
+        start = time.perf_counter()
+        response = await self._client.chat.completions.create(**params)
+        if not params.get("stream"):
+            choice = response.choices[0]
+            await self._save(fingerprint, params, {
+                "id": response.id, "created": response.created, "model": response.model,
+                "latency_s": round(time.perf_counter() - start, 4),
+                "chunks": [[0.0, choice.message.content or ""]],
+                "finish_reason": choice.finish_reason,
+                "usage": response.usage.model_dump() if response.usage else None,
+            })
+            return response
+        return self._record_stream(fingerprint, params, response, start)
+
+    async def _record_stream(self, fingerprint: str, params: dict, stream, start: float):
+        chunks, usage, finish_reason, meta = [], None, None, {}
+        async for chunk in stream:
+            meta = {"id": chunk.id, "created": chunk.created, "model": chunk.model}
+            if chunk.usage:
+                usage = chunk.usage.model_dump()
+            for choice in chunk.choices:
+                if choice.delta.content:
+                    chunks.append([round(time.perf_counter() - start, 4), choice.delta.content])
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+            yield chunk
+        await self._save(fingerprint, params, {
+            **meta,
+            "latency_s": round(time.perf_counter() - start, 4),
+            "chunks": chunks,
+            "finish_reason": finish_reason,
+            "usage": usage,
+        })
+
+
+def wrap_client(client, mode: str, directory: Path, latency_scale: float = 0.0):
+    """Devuelve el cliente tal cual (`off`) o envuelto en un `Cassette`."""
+    if mode == "off":
+        return client
+    return Cassette(client, mode, directory, latency_scale)
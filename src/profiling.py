@@ -0,0 +1,170 @@
+"""
+Herramientas de diagnóstico de rendimiento, desactivadas por defecto.
+
+- `LoopWatchdog`: un latido mide el retraso del event loop (métrica y readiness) y, con
+  `LOOP_STALL_THRESHOLD_MS` > 0, un hilo vigila ese latido y, si el loop deja de latir durante
+  más del umbral, registra la pila del hilo del loop en ese momento (quién lo bloquea).
+- `profiled`: envuelve un trabajo en cProfile y vuelca el perfil a `PROFILE_DIR`. Se activa
+  por petición (cabecera `X-Profile`) o por muestreo.
+
+Sin configurar, solo queda el latido: no hay hilo vigilante ni envoltorio.
+"""
+import asyncio
+import cProfile
+import functools
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from src import metrics
+from src.config import logger, LOOP_STALL_THRESHOLD_MS, PROFILE_DIR, PROFILE_SAMPLE_RATE, PROFILE_ALLOW_HEADER
+
+PROFILE_HEADER = "X-Profile"
+
+LOOP_LAG = metrics.registry.register(metrics.Histogram(
+    "cv_event_loop_lag_seconds", "Retraso del latido del event loop respecto a lo programado.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)))
+LOOP_STALLS = metrics.registry.register(metrics.Counter(
+    "cv_event_loop_stalls_total", "Bloqueos del event loop por encima del umbral."))
+PROFILES_WRITTEN = metrics.registry.register(metrics.Counter(
+    "cv_profiles_written_total", "Perfiles de trabajos escritos en disco."))
+
+# Sin umbral de bloqueo, el latido solo alimenta la métrica y readiness.
+_DEFAULT_BEAT_SECONDS = 0.1
+# Readiness mira el peor retraso de los últimos segundos, no solo el del último latido.
+_LAG_WINDOW_SECONDS = 2.0
+
+
+class LoopWatchdog:
+    """Mide el retraso del event loop y, con umbral, registra la pila que lo está bloqueando."""
+
+    def __init__(self, threshold_seconds: float = 0.0):
+        self.threshold = threshold_seconds
+        # El latido va al doble de frecuencia que el umbral para no confundir espera con bloqueo.
+        self.interval = threshold_seconds / 2 if threshold_seconds > 0 else _DEFAULT_BEAT_SECONDS
+        self._window = max(_LAG_WINDOW_SECONDS, 2 * self.interval)
+        self._recent: deque[tuple[float, float]] = deque() # (instante, retraso)
+        self._last_beat = time.monotonic()
+        self._reported_beat = 0.0
+        self._loop_thread_id: int | None = None
+        self._heartbeat_task: asyncio.Task | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """Arranca el latido en el loop actual y, si hay umbral, el hilo vigilante."""
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+        if self.threshold <= 0:
+            return
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Detector de bloqueos del event loop activo (umbral {self.threshold * 1000:.0f} ms).")
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            scheduled = time.monotonic()
+            self._last_beat = scheduled
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - scheduled - self.interval)
+            LOOP_LAG.observe(lag)
+            self._recent.append((now, lag))
+            while self._recent[0][0] < now - self._window:
+                self._recent.popleft()
+
+    def lag_seconds(self) -> float:
+        """Peor retraso de la ventana reciente, en segundos."""
+        return max((lag for _, lag in self._recent), default=0.0)
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            last_beat = self._last_beat
+            stalled_for = time.monotonic() - last_beat - self.interval
+            # Un solo informe por bloqueo: mientras no haya latido nuevo, no se repite.
+            if stalled_for > self.threshold and last_beat != self._reported_beat:
+                self._reported_beat = last_beat
+                self._report(stalled_for)
+
+    def _report(self, stalled_for: float):
+        LOOP_STALLS.inc()
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else "(pila no disponible)"
+        logger.warning(f"Event loop bloqueado durante más de {stalled_for * 1000:.0f} ms. Pila del loop:\n{stack}")
+
+
+_watchdog: LoopWatchdog | None = None
+
+
+def start_loop_watchdog():
+    """Instala el latido (y el detector si `LOOP_STALL_THRESHOLD_MS` > 0). Debe llamarse desde el event loop."""
+    global _watchdog
+    if _watchdog is not None:
+        return
+    _watchdog = LoopWatchdog(max(LOOP_STALL_THRESHOLD_MS, 0) / 1000)
+    _watchdog.start()
+
+
+def stop_loop_watchdog():
+    global _watchdog
+    if _watchdog is not None:
+        _watchdog.stop()
+        _watchdog = None
+
+
+def loop_lag_ms() -> float:
+    """Peor retraso reciente del event loop en milisegundos (0 si el latido no está activo)."""
+    return _watchdog.lag_seconds() * 1000 if _watchdog is not None else 0.0
+
+
+def wants_profile(header_value: str | None) -> bool:
+    """Decide si perfilar un trabajo: por cabecera (si está permitido) o por muestreo."""
+    if PROFILE_ALLOW_HEADER and header_value and header_value.strip().lower() in ("1", "true", "yes"):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+# cProfile solo admite un perfilador activo por hilo: los trabajos perfilados no se solapan.
+_profile_active = False
+
+
+def profiled(job, label: str):
+    """
+    Devuelve `job` envuelto en cProfile; el perfil se escribe en `PROFILE_DIR/<label>_<ts>.prof`.
+    El perfil cubre el hilo del event loop mientras el trabajo está en curso (incluye lo que
+    otras tareas ejecuten entre sus `await`); el trabajo hecho en executors no aparece.
+    """
+    @functools.wraps(job)
+    async def wrapper(*args, **kwargs):
+        global _profile_active
+        if _profile_active:
+            logger.info(f"Perfilado de {label} omitido: ya hay otro trabajo perfilándose.")
+            return await job(*args, **kwargs)
+
+        profiler = cProfile.Profile()
+        _profile_active = True
+        profiler.enable()
+        try:
+            return await job(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _profile_active = False
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            path = PROFILE_DIR / f"{label}_{int(time.time())}.prof"
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, profiler.dump_stats, path)
+                PROFILES_WRITTEN.inc()
+                logger.info(f"Perfil de {label} escrito en {path}.")
+            except OSError as e:
+                logger.error(f"No se pudo escribir el perfil de {label} en {path}: {e}")
+
+    return wrapper
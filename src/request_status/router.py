@@ -0,0 +1,107 @@
+import asyncio
+import json
+import time
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from src import results, timeline
+from src.auth import verify_api_key
+from src.cv_processing.streaming import broker
+from src.models import AuthActor
+from src.request_status.service import compute_etag, get_request_status, get_result_blob
+
+router = APIRouter(tags=["Requests"])
+
+# Máximo de segundos que una petición puede quedar en long-poll.
+MAX_WAIT_SECONDS = 60
+# Cada cuánto se vuelve a consultar la BBDD si el trabajo no está activo en este proceso.
+POLL_INTERVAL_SECONDS = 1.0
+# Comentario SSE periódico para que proxies y balanceadores no cierren la conexión.
+SSE_KEEPALIVE_SECONDS = 15.0
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.get("/{request_id}", summary="Consultar el estado de una petición")
+async def get_request(
+    request_id: UUID,
+    request: Request,
+    wait: float = Query(0, ge=0, le=MAX_WAIT_SECONDS, description="Segundos de long-poll si no hay cambios."),
+    actor: AuthActor = Depends(verify_api_key),
+):
+    """
+    Devuelve estado, resultado y línea de tiempo de la petición, con ETag.
+    Con `If-None-Match` responde `304` si nada ha cambiado; si además se indica `wait`,
+    mantiene la conexión abierta hasta que haya cambios o venza el plazo.
+    """
+    body = await get_request_status(request_id, actor)
+    etag = compute_etag(body)
+    if_none_match = request.headers.get("if-none-match")
+
+    deadline = time.monotonic() + wait
+    while if_none_match == etag and (remaining := deadline - time.monotonic()) > 0:
+        live_timeline = timeline.get_active(request_id)
+        if live_timeline is not None:
+            await live_timeline.wait_for_change(remaining)
+        else:
+            await asyncio.sleep(min(remaining, POLL_INTERVAL_SECONDS))
+        body = await get_request_status(request_id, actor)
+        etag = compute_etag(body)
+
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if if_none_match == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(body, headers=headers)
+
+
+@router.get("/{request_id}/result", summary="Resultado de una petición (comprimido)")
+async def get_request_result(request_id: UUID, request: Request, actor: AuthActor = Depends(verify_api_key)):
+    """
+    Devuelve el JSON del resultado tal como está guardado: comprimido (`Content-Encoding`)
+    si el cliente acepta la codificación, sin volver a serializarlo. ETag por contenido,
+    `If-None-Match` y rangos de bytes (`Range`/`If-Range`). Los campos de texto grandes
+    se sirven aparte, en `/result/{field}`.
+    """
+    blob = await get_result_blob(request_id, actor)
+    return await results.blob_response(request, blob, results.JSON_MEDIA_TYPE)
+
+
+@router.get("/{request_id}/result/{field}", summary="Campo de texto separado del resultado")
+async def get_request_result_field(request_id: UUID, field: str, request: Request, actor: AuthActor = Depends(verify_api_key)):
+    """Texto de un campo grande del resultado (p. ej. `full_text`), con las mismas garantías que `/result`."""
+    blob = await get_result_blob(request_id, actor, field)
+    return await results.blob_response(request, blob, results.TEXT_MEDIA_TYPE)
+
+
+@router.get("/{request_id}/events", summary="Resultados parciales de una petición (SSE)")
+async def stream_request_events(request_id: UUID, actor: AuthActor = Depends(verify_api_key)):
+    """
+    Stream `text/event-stream` con los campos del resultado a medida que se completan:
+    `field` (`{name, value, source}`), `result` con el objeto final validado y `end`.
+    Si la petición ya terminó, se emite directamente su resultado; si se está procesando
+    en otro proceso, se emite un evento `status` y el cliente debe consultar `GET /requests/{id}`.
+    """
+    body = await get_request_status(request_id, actor)
+    key = str(request_id)
+
+    async def live_events():
+        async for event, data in broker.subscribe(key, keepalive=SSE_KEEPALIVE_SECONDS):
+            yield ": keepalive\n\n" if event == "keepalive" else _sse(event, data)
+
+    async def stored_events():
+        if body["status"] == "processing":
+            yield _sse("status", {"status": body["status"]})
+        else:
+            yield _sse("result", {"status": body["status"], "data": body["result"], "usage": body["usage"], "error": body["error"]})
+        yield _sse("end", None)
+
+    live = broker.has_events(key) or timeline.get_active(request_id) is not None
+    return StreamingResponse(
+        live_events() if live else stored_events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
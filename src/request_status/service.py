@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import json
+from uuid import UUID
+
+from src import metrics, results, timeline
+from src.config import logger, get_supabase_client
+from src.exceptions import DatabaseError, ForbiddenAccessError, RequestNotFoundError, ResultNotAvailableError
+from src.models import AuthActor
+
+
+async def _get_owned_request(id_request: UUID, actor: AuthActor) -> dict:
+    supabase = get_supabase_client()
+    try:
+        with metrics.observe_supabase("requests", "select"):
+            response = await (
+                supabase.from_("requests")
+                .select("id_request, id_user, status, timeline")
+                .eq("id_request", str(id_request))
+                .limit(1)
+                .execute()
+            )
+    except Exception as e:
+        logger.error(f"Error fetching status for request {id_request}: {e}")
+        raise DatabaseError("Error al obtener el estado de la petición.")
+
+    if not response.data:
+        raise RequestNotFoundError(str(id_request))
+    request_data = response.data[0]
+    if request_data.get("id_user") != actor.user_id:
+        raise ForbiddenAccessError("No tienes permiso para consultar esta petición.")
+    return request_data
+
+
+async def _get_log(id_request: UUID) -> tuple[dict, str | None]:
+    """`payload_out` y error registrados al terminar la petición."""
+    supabase = get_supabase_client()
+    try:
+        with metrics.observe_supabase("request_logs", "select"):
+            logs_response = await (
+                supabase.from_("request_logs")
+                .select("payload_out, error")
+                .eq("id_request", str(id_request))
+                .limit(1)
+                .execute()
+            )
+    except Exception as e:
+        logger.error(f"Error fetching result for request {id_request}: {e}")
+        raise DatabaseError("Error al obtener el resultado de la petición.")
+    if not logs_response.data:
+        return {}, None
+    return logs_response.data[0].get("payload_out") or {}, logs_response.data[0].get("error")
+
+
+async def get_request_status(id_request: UUID, actor: AuthActor) -> dict:
+    """
+    Devuelve el estado, el resultado y la línea de tiempo de una petición del usuario.
+    Si el trabajo sigue activo en este proceso, la línea de tiempo se sirve en vivo.
+    """
+    request_data = await _get_owned_request(id_request, actor)
+    status = request_data.get("status")
+    payload_out, error = {}, None
+    if status != "processing":
+        payload_out, error = await _get_log(id_request)
+
+    data = payload_out.get("data")
+    if data is None and payload_out.get("result"):
+        data = await results.load_data(payload_out["result"])
+
+    live_timeline = timeline.get_active(id_request)
+    return {
+        "request_id": str(id_request),
+        "status": status,
+        "result": data,
+        "usage": payload_out.get("usage"),
+        "error": error,
+        "timeline": live_timeline.to_dict() if live_timeline else request_data.get("timeline"),
+    }
+
+
+async def get_result_blob(id_request: UUID, actor: AuthActor, field: str | None = None) -> results.Blob:
+    """
+    Blob comprimido del resultado de una petición del usuario (o de uno de sus campos
+    separados). Los logs anteriores al almacenamiento comprimido se codifican al vuelo.
+    """
+    request_data = await _get_owned_request(id_request, actor)
+    status = request_data.get("status")
+    payload_out = (await _get_log(id_request))[0] if status != "processing" else {}
+
+    manifest, encoded = payload_out.get("result"), {}
+    if manifest is None and payload_out.get("data") is not None:
+        manifest, blobs = await asyncio.get_running_loop().run_in_executor(None, results.encode, payload_out["data"])
+        encoded = {blob.sha256: blob for blob in blobs}
+    if manifest is None:
+        raise ResultNotAvailableError(str(id_request), status)
+    if field is not None:
+        manifest = (manifest.get("fields") or {}).get(field)
+        if manifest is None:
+            raise ResultNotAvailableError(f"{id_request}/{field}", status)
+    return encoded.get(manifest["sha256"]) or await results.load_blob(manifest)
+
+
+def compute_etag(body: dict) -> str:
+    """ETag fuerte derivado del contenido de la respuesta."""
+    digest = hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
@@ -0,0 +1,325 @@
+"""
+Almacenamiento comprimido y direccionado por contenido de los resultados.
+
+El resultado de un trabajo (`payload_out["data"]`) se serializa una sola vez a JSON
+compacto, se comprime (gzip, o zstd si `RESULT_COMPRESSION=zstd` y `zstandard` está
+instalado) y se guarda en la tabla `result_blobs` bajo el SHA-256 del JSON sin comprimir:
+dos resultados idénticos ocupan una sola fila. Los campos de texto de primer nivel que
+superan `RESULT_SPLIT_FIELD_BYTES` (típicamente `full_text`) se guardan como blobs
+aparte, de modo que el documento principal sigue siendo pequeño.
+
+`request_logs.payload_out` guarda, en lugar de `data`, un manifiesto `result` con las
+huellas, la codificación y los tamaños. `GET /requests/{id}/result` sirve los bytes
+comprimidos tal cual están guardados (`Content-Encoding`, ETag y rangos), sin volver a
+serializar. Como los blobs son inmutables, se cachean en memoria por huella y, con varios
+workers, también en la caché compartida (`src/shared_cache.py`).
+"""
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import Request, Response
+
+from src import metrics
+from src.config import (
+    logger,
+    get_supabase_client,
+    RESULT_COMPRESSION,
+    RESULT_COMPRESSION_LEVEL,
+    RESULT_SPLIT_FIELD_BYTES,
+    RESULT_CACHE_MAX_BYTES,
+)
+from src.exceptions import DatabaseError
+from src.shared_cache import cache as shared_cache
+
+BLOBS_TABLE = "result_blobs"
+JSON_MEDIA_TYPE = "application/json"
+TEXT_MEDIA_TYPE = "text/plain; charset=utf-8"
+# Por encima de este tamaño, comprimir o descomprimir se hace en el executor.
+_OFFLOAD_BYTES = 64 * 1024
+# Los blobs no cambian nunca: el cliente puede cachearlos sin revalidar.
+_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+RESULT_BYTES = metrics.registry.register(metrics.Counter(
+    "cv_result_bytes_total", "Bytes de resultados guardados, sin comprimir (identity) y comprimidos (stored).", ["representation"]))
+
+
+@dataclass
+class Blob:
+    sha256: str
+    encoding: str
+    size: int # bytes sin comprimir
+    content: bytes # bytes comprimidos
+
+    def ref(self) -> dict:
+        return {"sha256": self.sha256, "encoding": self.encoding, "size": self.size, "stored_size": len(self.content)}
+
+    def pack(self) -> bytes:
+        """Representación para la caché compartida: `encoding`, tamaño y contenido."""
+        return f"{self.encoding}\0{self.size}\0".encode("ascii") + self.content
+
+    @classmethod
+    def unpack(cls, sha256: str, packed: bytes) -> "Blob":
+        encoding, size, content = packed.split(b"\0", 2)
+        return cls(sha256, encoding.decode("ascii"), int(size), content)
+
+
+# --- codificación ---
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _encoding() -> str:
+    if RESULT_COMPRESSION == "zstd" and _zstd() is not None:
+        return "zstd"
+    return "gzip"
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return _zstd().ZstdCompressor(level=RESULT_COMPRESSION_LEVEL or 3).compress(data)
+    # mtime=0: la misma entrada produce siempre los mismos bytes.
+    return gzip.compress(data, compresslevel=RESULT_COMPRESSION_LEVEL or 6, mtime=0)
+
+
+def decompress(blob: Blob) -> bytes:
+    if blob.encoding == "zstd":
+        zstd = _zstd()
+        if zstd is None:
+            raise DatabaseError("El resultado está comprimido con zstd y 'zstandard' no está instalado.")
+        return zstd.ZstdDecompressor().decompress(blob.content, max_output_size=blob.size)
+    return gzip.decompress(blob.content)
+
+
+def _make_blob(data: bytes, encoding: str) -> Blob:
+    return Blob(hashlib.sha256(data).hexdigest(), encoding, len(data), compress(data, encoding))
+
+
+def encode(data) -> tuple[dict, list[Blob]]:
+    """
+    Serializa y comprime un resultado (síncrono: CPU). Devuelve el manifiesto y los blobs
+    a guardar: el documento principal y los campos de texto grandes separados.
+    """
+    encoding = _encoding()
+    blobs, fields = [], {}
+    document = data
+    if isinstance(data, dict):
+        document = {}
+        for name, value in data.items():
+            # len * 4 acota los bytes UTF-8: los textos cortos no se codifican.
+            if isinstance(value, str) and len(value) * 4 >= RESULT_SPLIT_FIELD_BYTES:
+                raw = value.encode("utf-8")
+                if len(raw) >= RESULT_SPLIT_FIELD_BYTES:
+                    blob = _make_blob(raw, encoding)
+                    blobs.append(blob)
+                    fields[name] = blob.ref()
+                    continue
+            document[name] = value
+    main = _make_blob(json.dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), encoding)
+    blobs.insert(0, main)
+    manifest = main.ref()
+    if fields:
+        manifest["fields"] = fields
+    return manifest, blobs
+
+
+# --- caché de blobs (inmutables, por huella) ---
+
+class BlobCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, Blob] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def get(self, sha256: str) -> Blob | None:
+        with self._lock:
+            blob = self._entries.get(sha256)
+            if blob is not None:
+                self._entries.move_to_end(sha256)
+            return blob
+
+    def put(self, blob: Blob):
+        if len(blob.content) > self.max_bytes:
+            return
+        with self._lock:
+            if blob.sha256 in self._entries:
+                return
+            self._entries[blob.sha256] = blob
+            self._bytes += len(blob.content)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.content)
+
+
+cache = BlobCache(RESULT_CACHE_MAX_BYTES)
+
+metrics.register_callback_gauge("cv_result_cache_bytes", "Bytes de resultados comprimidos cacheados en memoria.", cache.nbytes)
+
+
+# --- persistencia ---
+
+async def _offload(fn, *args, size: int):
+    if size < _OFFLOAD_BYTES:
+        return fn(*args)
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def store(payload_out: dict) -> dict:
+    """
+    Guarda `payload_out["data"]` comprimido y devuelve el payload para `request_logs`:
+    sin `data` y con el manifiesto en `result`.
+    """
+    data = payload_out.get("data")
+    if data is None:
+        return payload_out
+    manifest, blobs = await asyncio.get_running_loop().run_in_executor(None, encode, data)
+    rows = [
+        {"sha256": blob.sha256, "encoding": blob.encoding, "size": blob.size, "content": base64.b64encode(blob.content).decode("ascii")}
+        for blob in blobs
+    ]
+    with metrics.observe_supabase(BLOBS_TABLE, "upsert"):
+        await (
+            get_supabase_client().from_(BLOBS_TABLE)
+            .upsert(rows, on_conflict="sha256", ignore_duplicates=True, returning="minimal")
+            .execute()
+        )
+    for blob in blobs:
+        cache.put(blob)
+        await shared_cache.aput(BLOBS_TABLE, blob.sha256, blob.pack())
+        RESULT_BYTES.inc(blob.size, representation="identity")
+        RESULT_BYTES.inc(len(blob.content), representation="stored")
+    stored = {k: v for k, v in payload_out.items() if k != "data"}
+    stored["result"] = manifest
+    return stored
+
+
+async def load_blob(ref: dict) -> Blob:
+    blob = cache.get(ref["sha256"])
+    if blob is not None:
+        return blob
+    packed = await shared_cache.aget(BLOBS_TABLE, ref["sha256"])
+    if packed is not None:
+        blob = Blob.unpack(ref["sha256"], packed)
+        cache.put(blob)
+        return blob
+    try:
+        with metrics.observe_supabase(BLOBS_TABLE, "select"):
+            response = await (
+                get_supabase_client().from_(BLOBS_TABLE)
+                .select("sha256, encoding, size, content")
+                .eq("sha256", ref["sha256"])
+                .limit(1)
+                .execute()
+            )
+    except Exception as e:
+        logger.error(f"Error al leer el blob de resultado {ref['sha256']}: {e}")
+        raise DatabaseError("Error al obtener el resultado de la petición.")
+    if not response.data:
+        logger.error(f"Blob de resultado {ref['sha256']} no encontrado.")
+        raise DatabaseError("El resultado de la petición no está disponible.")
+    row = response.data[0]
+    blob = Blob(row["sha256"], row["encoding"], row["size"], base64.b64decode(row["content"]))
+    cache.put(blob)
+    await shared_cache.aput(BLOBS_TABLE, blob.sha256, blob.pack())
+    return blob
+
+
+async def load_data(manifest: dict):
+    """Reconstruye el resultado completo (documento y campos separados) a partir del manifiesto."""
+    blob = await load_blob(manifest)
+    data = json.loads(await _offload(decompress, blob, size=blob.size))
+    for name, ref in (manifest.get("fields") or {}).items():
+        field_blob = await load_blob(ref)
+        data[name] = (await _offload(decompress, field_blob, size=field_blob.size)).decode("utf-8")
+    return data
+
+
+# --- respuesta HTTP ---
+
+def _accepts(request: Request, encoding: str) -> bool:
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() in (encoding, "*"):
+            q = params.strip().removeprefix("q=")
+            return not params or _qvalue(q) > 0
+    return False
+
+
+def _qvalue(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return 1.0
+
+
+def _etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+
+def _parse_range(header: str, length: int) -> tuple[int, int] | None:
+    """Rango único `bytes=a-b`, `bytes=a-` o `bytes=-n`. None si no se puede satisfacer."""
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError("rango no soportado")
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        suffix = int(last)
+        if suffix <= 0:
+            return None
+        return max(0, length - suffix), length - 1
+    start = int(first)
+    end = min(int(last), length - 1) if last else length - 1
+    if start >= length or end < start:
+        return None
+    return start, end
+
+
+async def blob_response(request: Request, blob: Blob, media_type: str) -> Response:
+    """
+    Sirve un blob: comprimido tal cual si el cliente acepta su codificación, si no,
+    descomprimido. Soporta `If-None-Match`, `Range` (un solo rango) e `If-Range`.
+    """
+    if _accepts(request, blob.encoding):
+        body = blob.content
+        etag = f'"{blob.sha256[:32]}-{blob.encoding}"'
+        headers = {"Content-Encoding": blob.encoding}
+    else:
+        body = await _offload(decompress, blob, size=blob.size)
+        etag = f'"{blob.sha256[:32]}"'
+        headers = {}
+    headers.update({"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": _CACHE_CONTROL, "Accept-Ranges": "bytes"})
+
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={k: v for k, v in headers.items() if k != "Content-Encoding"})
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, len(body))
+        except ValueError:
+            byte_range = (0, len(body) - 1) # rango que no entendemos: se ignora y se sirve completo
+        else:
+            if byte_range is None:
+                return Response(status_code=416, headers={"Content-Range": f"bytes */{len(body)}", **headers})
+        start, end = byte_range
+        if (start, end) != (0, len(body) - 1):
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            return Response(body[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
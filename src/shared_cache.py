@@ -0,0 +1,208 @@
+"""
+Caché compartida entre los procesos de una misma máquina, sobre un archivo SQLite local.
+
+Con varios workers (`src/launcher.py`), cada uno tendría que calentar por su cuenta las
+cachés de datos que casi no cambian: la búsqueda de claves de API por prefijo, los
+endpoints y los blobs de resultados. Aquí se comparten en un único archivo
+(`SHARED_CACHE_PATH`) en modo WAL: las lecturas no se bloquean entre sí y una escritura
+no bloquea las lecturas. Las entradas se agrupan por espacio de nombres y pueden tener
+vencimiento. Al superar `SHARED_CACHE_MAX_BYTES` se borran las más antiguas.
+
+Es solo una caché: cualquier error de SQLite se registra y se trata como un fallo de
+caché, y quien llama va a Supabase como sin ella. Sin `SHARED_CACHE_PATH` está desactivada.
+
+`add` inserta solo si la clave no existe, de forma atómica entre procesos: sirve para
+reservar algo una sola vez entre todos los workers (claves de idempotencia). Los espacios
+de nombres marcados con `pin` no se desalojan por tamaño, solo vencen: perder una de esas
+entradas no es un fallo de caché sino un error (una subida repetida se procesaría dos veces).
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from src import metrics
+from src.config import logger, SHARED_CACHE_PATH, SHARED_CACHE_MAX_BYTES
+
+# Cada cuántas escrituras se comprueba el tamaño total y se purgan los vencidos.
+_MAINTENANCE_EVERY = 100
+_BUSY_TIMEOUT_MS = 2000
+
+SHARED_CACHE_REQUESTS = metrics.registry.register(metrics.Counter(
+    "cv_shared_cache_requests_total", "Consultas a la caché compartida por espacio de nombres y resultado (hit, miss).",
+    ["namespace", "result"]))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_created_at ON entries (created_at);
+"""
+
+
+class SharedCache:
+    def __init__(self, path: Path | None, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection: sqlite3.Connection | None = None
+        self._pid: int | None = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._pinned: set[str] = set()
+
+    def pin(self, namespace: str):
+        """Excluye el espacio de nombres del desalojo por tamaño: sus entradas solo vencen por TTL."""
+        self._pinned.add(namespace)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        # Una conexión por proceso: una conexión SQLite heredada por fork no se puede usar.
+        if self._connection is None or self._pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Guarda hashes de claves y secretos de webhook: solo legible por el usuario del servicio.
+            os.close(os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600))
+            connection = sqlite3.connect(self.path, timeout=_BUSY_TIMEOUT_MS / 1000, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._connection, self._pid, self._writes = connection, os.getpid(), 0
+        return self._connection
+
+    # --- operaciones síncronas (en el executor desde el event loop) ---
+
+    def get(self, namespace: str, key: str) -> bytes | None:
+        if not self.enabled:
+            return None
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT value FROM entries WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (namespace, key, time.time()),
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Caché compartida: error al leer {namespace}/{key}: {e}")
+            row = None
+        SHARED_CACHE_REQUESTS.inc(namespace=namespace, result="hit" if row else "miss")
+        return row[0] if row else None
+
+    def put(self, namespace: str, key: str, value: bytes, ttl_seconds: float | None = None):
+        if not self.enabled or len(value) > self.max_bytes:
+            return
+        now = time.time()
+        try:
+            with self._lock:
+                connection = self._connect()
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, value, size, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                    (namespace, key, value, len(value), now, now + ttl_seconds if ttl_seconds else None),
+                )
+                self._writes += 1
+                if self._writes % _MAINTENANCE_EVERY == 0:
+                    self._evict(connection, now)
+        except sqlite3.Error as e:
+            logger.warning(f"Caché compartida: error al escribir {namespace}/{key}: {e}")
+
+    def add(self, namespace: str, key: str, value: bytes, ttl_seconds: float | None = None) -> bytes | None:
+        """
+        Inserta la entrada solo si no existe (o ya venció), de forma atómica entre procesos.
+        Devuelve None si la insertó y, si no, el valor de la existente. Desactivada o ante un
+        error de SQLite también devuelve None: quien llama sigue como si la hubiera insertado.
+        """
+        if not self.enabled or len(value) > self.max_bytes:
+            return None
+        now = time.time()
+        try:
+            with self._lock:
+                connection = self._connect()
+                # IMMEDIATE toma el bloqueo de escritura al empezar: nadie inserta entre la comprobación y la inserción.
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    connection.execute(
+                        "DELETE FROM entries WHERE namespace = ? AND key = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                        (namespace, key, now),
+                    )
+                    inserted = connection.execute(
+                        "INSERT OR IGNORE INTO entries (namespace, key, value, size, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (namespace, key, value, len(value), now, now + ttl_seconds if ttl_seconds else None),
+                    ).rowcount
+                    row = None if inserted else connection.execute(
+                        "SELECT value FROM entries WHERE namespace = ? AND key = ?", (namespace, key),
+                    ).fetchone()
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+                self._writes += 1
+        except sqlite3.Error as e:
+            logger.warning(f"Caché compartida: error al reservar {namespace}/{key}: {e}")
+            return None
+        return row[0] if row else None
+
+    def delete(self, namespace: str, key: str, value: bytes | None = None):
+        """Borra la entrada; con `value`, solo si sigue teniendo ese valor."""
+        if not self.enabled:
+            return
+        try:
+            with self._lock:
+                if value is None:
+                    self._connect().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                else:
+                    self._connect().execute(
+                        "DELETE FROM entries WHERE namespace = ? AND key = ? AND value = ?", (namespace, key, value),
+                    )
+        except sqlite3.Error as e:
+            logger.warning(f"Caché compartida: error al borrar {namespace}/{key}: {e}")
+
+    def _evict(self, connection: sqlite3.Connection, now: float):
+        connection.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Las más antiguas primero, hasta bajar del 90 % del tope.
+        excess = total - int(self.max_bytes * 0.9)
+        freed = 0
+        pinned = sorted(self._pinned)
+        placeholders = ",".join("?" * len(pinned))
+        candidates = connection.execute(
+            f"SELECT namespace, key, size FROM entries WHERE namespace NOT IN ({placeholders}) ORDER BY created_at", pinned,
+        ).fetchall()
+        for namespace, key, size in candidates:
+            if freed >= excess:
+                break
+            connection.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            freed += size
+        logger.info(f"Caché compartida: {freed} bytes desalojados (total {total}, tope {self.max_bytes}).")
+
+    # --- desde el event loop ---
+
+    async def aget(self, namespace: str, key: str) -> bytes | None:
+        if not self.enabled:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(None, self.get, namespace, key)
+
+    async def aput(self, namespace: str, key: str, value: bytes, ttl_seconds: float | None = None):
+        if self.enabled:
+            await asyncio.get_running_loop().run_in_executor(None, self.put, namespace, key, value, ttl_seconds)
+
+    async def aadd(self, namespace: str, key: str, value: bytes, ttl_seconds: float | None = None) -> bytes | None:
+        if not self.enabled:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(None, self.add, namespace, key, value, ttl_seconds)
+
+    async def adelete(self, namespace: str, key: str, value: bytes | None = None):
+        if self.enabled:
+            await asyncio.get_running_loop().run_in_executor(None, self.delete, namespace, key, value)
+
+
+cache = SharedCache(SHARED_CACHE_PATH, SHARED_CACHE_MAX_BYTES)
@@ -0,0 +1,100 @@
+"""
+Línea de tiempo compacta por petición.
+
+Cada trabajo registra sus hitos (encolado, guardado, extracción, render, llamadas al
+modelo, escrituras en BBDD, intentos de webhook...) como `[ms_desde_inicio, evento, attrs]`.
+La línea de tiempo activa se propaga mediante una ContextVar, de modo que cualquier
+función del pipeline puede marcar eventos sin recibirla como parámetro.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+
+class JobTimeline:
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started_at = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self.events: list[list] = []
+        self.version = 0
+        self._changed = asyncio.Event()
+
+    def mark(self, event: str, **attrs):
+        """Añade un evento con el tiempo transcurrido en milisegundos."""
+        entry = [round((time.perf_counter() - self._t0) * 1000), event]
+        if attrs:
+            entry.append({k: v for k, v in attrs.items() if v is not None})
+        self.events.append(entry)
+        self.version += 1
+        # Despierta a los long-polls pendientes y prepara un evento nuevo para los siguientes.
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait_for_change(self, timeout: float) -> bool:
+        """Espera hasta el próximo evento. Devuelve False si vence el timeout."""
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def to_dict(self) -> dict:
+        return {"started_at": self.started_at.isoformat(timespec="milliseconds"), "events": list(self.events)}
+
+
+_current: ContextVar[JobTimeline | None] = ContextVar("job_timeline", default=None)
+# Líneas de tiempo de los trabajos activos en este proceso, para servir el estado en vivo.
+_active: dict[str, JobTimeline] = {}
+
+
+def start(request_id) -> JobTimeline:
+    """Crea la línea de tiempo de una petición nueva y la activa en el contexto actual."""
+    job_timeline = JobTimeline(str(request_id))
+    _active[job_timeline.request_id] = job_timeline
+    _current.set(job_timeline)
+    return job_timeline
+
+
+def resume(request_id) -> JobTimeline:
+    """Recupera (o crea, si la petición llegó por otra vía) la línea de tiempo y la activa."""
+    job_timeline = _active.get(str(request_id))
+    if job_timeline is None:
+        return start(request_id)
+    _current.set(job_timeline)
+    return job_timeline
+
+
+def finish(request_id):
+    """Deja de servir la línea de tiempo en vivo: a partir de aquí la fuente es la BBDD."""
+    _active.pop(str(request_id), None)
+
+
+def get_active(request_id) -> JobTimeline | None:
+    return _active.get(str(request_id))
+
+
+def mark(event: str, **attrs):
+    """Marca un evento en la línea de tiempo del contexto actual (no-op si no hay ninguna)."""
+    job_timeline = _current.get()
+    if job_timeline is not None:
+        job_timeline.mark(event, **attrs)
+
+
+@contextmanager
+def span(event: str, **attrs):
+    """
+    Marca un evento al terminar el bloque, con su duración (`ms`) y si falló (`error`).
+    Devuelve el dict de atributos para que el bloque añada datos conocidos al final (p. ej. tokens).
+    """
+    start_time = time.perf_counter()
+    failed = False
+    try:
+        yield attrs
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        mark(event, ms=round((time.perf_counter() - start_time) * 1000), error=True if failed else None, **attrs)
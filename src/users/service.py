@@ -1,3 +1,4 @@
+from src import metrics
 from src.config import logger, get_supabase_client
 from src.exceptions import InsufficientCreditsError, DatabaseError
 
@@ -7,7 +8,8 @@ async def get_user_credits(user_id: str) -> int | None:
     Returns None if the user is not found.
     """
     try:
-        response = await get_supabase_client().from_("users").select("credits").eq("id_user", user_id).single().execute()
+        with metrics.observe_supabase("users", "select"):
+            response = await get_supabase_client().from_("users").select("credits").eq("id_user", user_id).single().execute()
         if response.data:
             return response.data.get("credits")
         return None
@@ -26,7 +28,8 @@ async def deduct_credits_atomic(user_id: str, amount: int) -> bool:
     supabase = get_supabase_client()
     try:
         # 1. Fetch current credits
-        user_response = await supabase.from_("users").select("credits").eq("id_user", user_id).single().execute()
+        with metrics.observe_supabase("users", "select"):
+            user_response = await supabase.from_("users").select("credits").eq("id_user", user_id).single().execute()
         
         if not user_response.data:
             logger.error(f"Deduction failed: User '{user_id}' not found.")
@@ -41,7 +44,8 @@ async def deduct_credits_atomic(user_id: str, amount: int) -> bool:
 
         # 3. Perform deduction and update
         new_credits = current_credits - amount
-        update_response = await supabase.from_("users").update({"credits": new_credits}).eq("id_user", user_id).execute()
+        with metrics.observe_supabase("users", "update"):
+            update_response = await supabase.from_("users").update({"credits": new_credits}).eq("id_user", user_id).execute()
 
         # Post-update check could be added here if needed, but we'll trust the response for now
         if update_response.data:
@@ -0,0 +1,128 @@
+"""
+Calentamiento del proceso tras el arranque.
+
+Importar la app no carga el SDK de OpenAI ni las librerías de extracción; este módulo
+lo hace en paralelo nada más arrancar, junto con la apertura de las conexiones a
+Supabase y OpenAI, la comprobación del binario de Tesseract y el arranque de los hilos
+del executor. La readiness (`/health/ready`) solo se anuncia cuando ha terminado. Si falla
+el paso crítico (crear el cliente de OpenAI), se reintenta con espera creciente hasta que
+funcione, en vez de dejar el proceso sin readiness para siempre.
+"""
+import asyncio
+import os
+import time
+
+from src import metrics
+from src.config import logger, get_openai_client, get_supabase_client, OPENAI_CASSETTE_MODE
+
+# Espera entre reintentos del paso crítico: se duplica en cada fallo hasta el máximo.
+_CRITICAL_RETRY_BASE_SECONDS = 1.0
+_CRITICAL_RETRY_MAX_SECONDS = 30.0
+
+class WarmupState:
+    def __init__(self):
+        self.ready = False
+        self.finished = False
+        self.steps: dict[str, dict] = {}
+        self.duration_ms: int | None = None
+
+    def snapshot(self) -> dict:
+        return {"ready": self.ready, "finished": self.finished, "duration_ms": self.duration_ms, "steps": dict(self.steps)}
+
+
+state = WarmupState()
+
+metrics.register_callback_gauge("cv_ready", "1 si el proceso ha terminado el calentamiento y acepta trabajo.", lambda: int(state.ready))
+
+
+def _import_extraction_libraries():
+    import docx  # noqa: F401
+    import fitz  # noqa: F401
+    import pytesseract  # noqa: F401
+    from PIL import Image  # noqa: F401
+
+
+def preload_modules():
+    """
+    Importa las librerías pesadas sin crear clientes ni conexiones. Lo llama el proceso
+    maestro de `src/launcher.py` antes de hacer fork: los workers las heredan ya cargadas.
+    """
+    _import_extraction_libraries()
+    if OPENAI_CASSETTE_MODE != "replay":
+        import openai  # noqa: F401
+
+
+def _check_tesseract() -> str:
+    import pytesseract
+
+    return str(pytesseract.get_tesseract_version())
+
+
+async def _create_openai_client():
+    # Crear el cliente importa el SDK: se hace fuera del event loop.
+    await asyncio.get_running_loop().run_in_executor(None, get_openai_client)
+
+
+async def _warm_openai_pool():
+    if OPENAI_CASSETTE_MODE != "replay":
+        # Abre la conexión TLS del pool con una llamada que no consume tokens.
+        await get_openai_client().models.list()
+
+
+async def _warm_supabase():
+    with metrics.observe_supabase("endpoints", "select"):
+        await get_supabase_client().from_("endpoints").select("id").limit(1).execute()
+
+
+async def _warm_executor():
+    loop = asyncio.get_running_loop()
+    threads = min(32, (os.cpu_count() or 1) + 4)  # tamaño por defecto de ThreadPoolExecutor
+    await asyncio.gather(*(loop.run_in_executor(None, time.sleep, 0.01) for _ in range(threads)))
+
+
+async def _run_step(name: str, step, critical: bool) -> bool:
+    start = time.perf_counter()
+    try:
+        await step()
+        state.steps[name] = {"ms": round((time.perf_counter() - start) * 1000)}
+        return True
+    except Exception as e:
+        state.steps[name] = {"ms": round((time.perf_counter() - start) * 1000), "error": str(e)}
+        log = logger.error if critical else logger.warning
+        log(f"Calentamiento: el paso '{name}' falló: {e}")
+        return not critical
+
+
+async def _warm_openai() -> bool:
+    # Sin cliente de OpenAI no se puede procesar ningún CV: es el único paso crítico.
+    if not await _run_step("openai_client", _create_openai_client, critical=True):
+        return False
+    return await _run_step("openai_pool", _warm_openai_pool, critical=False)
+
+
+async def run():
+    """
+    Ejecuta todos los pasos en paralelo y marca el proceso como listo si los críticos van bien.
+    Si no, reintenta los críticos hasta que funcionen (la tarea se cancela al apagar).
+    """
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        _warm_openai(),
+        _run_step("supabase_pool", _warm_supabase, critical=False),
+        _run_step("extraction_libraries", lambda: loop.run_in_executor(None, _import_extraction_libraries), critical=False),
+        _run_step("tesseract", lambda: loop.run_in_executor(None, _check_tesseract), critical=False),
+        _run_step("executor", _warm_executor, critical=False),
+    )
+    state.duration_ms = round((time.perf_counter() - start) * 1000)
+    state.finished = True
+    state.ready = all(results)
+    logger.info(f"Calentamiento terminado en {state.duration_ms} ms (listo={state.ready}): {state.steps}")
+    delay = _CRITICAL_RETRY_BASE_SECONDS
+    while not state.ready:
+        logger.info(f"Calentamiento: se reintenta el cliente de OpenAI en {delay:.0f} s.")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, _CRITICAL_RETRY_MAX_SECONDS)
+        state.ready = await _warm_openai()
+        if state.ready:
+            logger.info("Calentamiento: cliente de OpenAI creado en un reintento; el proceso ya está listo.")
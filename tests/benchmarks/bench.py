@@ -0,0 +1,327 @@
+"""
+Micro-benchmarks de las partes CPU del pipeline.
+
+Cubre la extracción de texto (PDF, DOCX, imagen), el render de páginas a pixmap con
+codificación PNG/JPEG, la codificación base64 y la construcción del esquema/prompt,
+sobre el corpus `testCV/cv` y documentos sintéticos de muchas páginas generados a partir
+de `testCV/cv/sample_cv.md` (como `tests/generarCV.py`).
+
+Cada benchmark se ejecuta en un subproceso propio. Se informa del tiempo por página
+(mediana y mínimo), del pico de memoria asignada según tracemalloc y del crecimiento del
+RSS durante una pasada (pico menos el RSS previo, sin contar los imports; solo Linux).
+
+El script se ejecuta por ruta y solo depende de la librería estándar y de `src`, de modo
+que se puede lanzar contra otra revisión con `--src-root` (ver `compare.py`):
+    python tests/benchmarks/bench.py --pages 50 --repeat 5
+    python tests/benchmarks/bench.py --only render_png --json resultados.json
+"""
+import argparse
+import base64
+import ctypes
+import gc
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+CORPUS_DIR = REPO_ROOT / "testCV" / "cv"
+BASE_MARKDOWN = CORPUS_DIR / "sample_cv.md"
+
+BENCHMARKS = (
+    "extract_pdf",
+    "extract_pdf_layout",
+    "extract_docx",
+    "extract_image",
+    "render_png",
+    "render_jpeg",
+    "base64",
+    "prompt_build",
+)
+
+
+class Skip(Exception):
+    """El benchmark no aplica en este entorno o revisión."""
+
+
+# --- Documentos sintéticos ---
+
+def _variant_text(index: int) -> str:
+    # Mismas sustituciones que tests/generarCV.py.
+    content = BASE_MARKDOWN.read_text(encoding="utf-8")
+    content = content.replace("# Juan Pérez García", f"# Juan Pérez Variante {index}")
+    content = content.replace("juan.perez.dev@email.com", f"juan.variante{index}@email.com")
+    return content.replace("+34 600 123 456", f"+34 600 123 4{index % 100:02d}")
+
+
+def generate_documents(data_dir: Path, pages: int):
+    """Genera `synthetic.pdf` y `synthetic.docx` con `pages` páginas de CV cada uno."""
+    import fitz
+    from docx import Document
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    document = fitz.open()
+    for i in range(pages):
+        page = document.new_page()
+        page.insert_text((50, 50), _variant_text(i), fontname="helv", fontsize=10)
+    document.save(data_dir / "synthetic.pdf")
+    document.close()
+
+    docx_document = Document()
+    for i in range(pages):
+        for line in _variant_text(i).splitlines():
+            docx_document.add_paragraph(line)
+        docx_document.add_page_break()
+    docx_document.save(data_dir / "synthetic.docx")
+
+
+# --- Benchmarks: cada uno devuelve (función a medir, páginas por llamada) ---
+
+def _corpus_files(*suffixes: str) -> list[Path]:
+    return sorted(p for p in CORPUS_DIR.iterdir() if p.suffix.lower() in suffixes)
+
+
+def bench_extract_pdf(data_dir: Path):
+    from src.cv_processing import extraction
+    import fitz
+
+    files = [data_dir / "synthetic.pdf", *_corpus_files(".pdf")]
+    pages = 0
+    for path in files:
+        with fitz.open(path) as document:
+            pages += document.page_count
+    return (lambda: [extraction.extract_text_from_pdf(path) for path in files]), pages
+
+
+def bench_extract_pdf_layout(data_dir: Path):
+    from src.cv_processing import extraction
+    import fitz
+
+    files = [data_dir / "synthetic.pdf", *_corpus_files(".pdf")]
+    pages = 0
+    for path in files:
+        with fitz.open(path) as document:
+            pages += document.page_count
+    return (lambda: [extraction.extract_text_from_pdf_layout(path) for path in files]), pages
+
+
+def bench_extract_docx(data_dir: Path):
+    from src.cv_processing import extraction
+
+    path = data_dir / "synthetic.docx"
+    pages = int((data_dir / "pages").read_text())
+    return (lambda: extraction.extract_text_from_docx(path)), pages
+
+
+def bench_extract_image(data_dir: Path):
+    import pytesseract
+    from src.cv_processing import extraction
+
+    try:
+        pytesseract.get_tesseract_version()
+    except pytesseract.TesseractNotFoundError:
+        raise Skip("tesseract no está instalado")
+    files = _corpus_files(".png", ".jpg", ".jpeg")
+    return (lambda: [extraction.extract_text_from_image(path) for path in files]), len(files)
+
+
+def _bench_render(data_dir: Path, output: str):
+    import fitz
+
+    path = data_dir / "synthetic.pdf"
+
+    def render():
+        with fitz.open(path) as document:
+            for page in document:
+                pix = page.get_pixmap()
+                pix.tobytes(output)
+                del pix
+
+    with fitz.open(path) as document:
+        pages = document.page_count
+    return render, pages
+
+
+def bench_render_png(data_dir: Path):
+    return _bench_render(data_dir, "png")
+
+
+def bench_render_jpeg(data_dir: Path):
+    return _bench_render(data_dir, "jpg")
+
+
+def bench_base64(data_dir: Path):
+    images = _corpus_files(".png", ".jpg", ".jpeg")
+    try:
+        from src.cv_processing import memory
+        encode = lambda path: memory.file_to_data_url(path, "image/png")
+    except (ImportError, AttributeError):
+        # Revisiones anteriores: lectura completa + b64encode, como hacía el pipeline.
+        encode = lambda path: "data:image/png;base64," + base64.b64encode(path.read_bytes()).decode("utf-8")
+    return (lambda: [encode(path) for path in images]), len(images)
+
+
+def bench_prompt_build(data_dir: Path):
+    from src.cv_processing import extraction
+
+    text = extraction.extract_text_from_pdf(data_dir / "synthetic.pdf")
+    schema = json.loads((REPO_ROOT / "testCV" / "openai_response_pdf.json").read_text(encoding="utf-8"))
+    schema.pop("full_text", None)
+    pages = int((data_dir / "pages").read_text())
+    try:
+        from src.cv_processing import preextraction
+    except ImportError:
+        preextraction = None
+
+    def build():
+        model_text, model_schema = text, schema
+        if preextraction is not None:
+            pre = preextraction.preextract(text, schema)
+            model_text, model_schema = pre.text_for_model, pre.remaining_schema
+        schema_string = json.dumps(model_schema, indent=2, ensure_ascii=False)
+        user_prompt = f"Analiza el siguiente texto y extrae la información en el formato JSON especificado:\n---\n{model_text}"
+        return json.dumps([{"role": "system", "content": schema_string}, {"role": "user", "content": user_prompt}])
+
+    return build, pages
+
+
+def _proc_status_kib(field: str) -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(f"{field}:"):
+                return int(line.split()[1])
+    raise OSError(f"{field} no disponible")
+
+
+def _trim_heap():
+    """Devuelve al sistema la memoria libre de malloc: si no, la pasada reutiliza la del calentamiento sin crecer."""
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def rss_growth_mib(func) -> float | None:
+    """Pico de RSS de una pasada menos el RSS de partida (None fuera de Linux)."""
+    try:
+        gc.collect()
+        _trim_heap()
+        before = _proc_status_kib("VmRSS")
+        # Reinicia el pico (VmHWM) al RSS actual: el de los imports y pasadas anteriores no cuenta.
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        return None
+    func()
+    return round(max(_proc_status_kib("VmHWM") - before, 0) / 1024, 1)
+
+
+def run_benchmark(name: str, data_dir: Path, repeat: int) -> dict:
+    """Ejecuta un benchmark en este proceso y devuelve sus métricas."""
+    try:
+        func, pages = globals()[f"bench_{name}"](data_dir)
+    except Skip as e:
+        return {"name": name, "skipped": str(e)}
+    except (ImportError, AttributeError) as e:
+        return {"name": name, "skipped": f"no disponible en esta revisión: {e}"}
+
+    func()  # calentamiento (imports perezosos, cachés de fuentes)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    rss_growth = rss_growth_mib(func)
+
+    # Pasada aparte con tracemalloc: su sobrecoste no contamina los tiempos.
+    tracemalloc.start()
+    func()
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    pages = max(pages, 1)
+    return {
+        "name": name,
+        "pages": pages,
+        "repeat": repeat,
+        "ms_per_page_median": round(statistics.median(timings) / pages * 1000, 4),
+        "ms_per_page_min": round(min(timings) / pages * 1000, 4),
+        "peak_alloc_kib": round(peak_alloc / 1024, 1),
+        "rss_growth_mib": rss_growth,
+    }
+
+
+def run_all(names: list[str], src_root: Path, pages: int, repeat: int) -> list[dict]:
+    """Ejecuta cada benchmark en un subproceso contra el `src` de `src_root`."""
+    workdir = Path(tempfile.mkdtemp(prefix="cv-bench-"))
+    try:
+        data_dir = workdir / "data"
+        generate_documents(data_dir, pages)
+        (data_dir / "pages").write_text(str(pages))
+        env = {**os.environ, "OPENAI_API_KEY": os.getenv("OPENAI_API_KEY", "sk-bench"), "LOG_LEVEL": "ERROR"}
+        results = []
+        for name in names:
+            command = [
+                sys.executable, str(Path(__file__).resolve()), "--child", name,
+                "--src-root", str(src_root), "--data-dir", str(data_dir), "--repeat", str(repeat),
+            ]
+            # cwd aparte: la configuración de la app crea logs/ y temp/ en el directorio actual.
+            completed = subprocess.run(command, cwd=workdir, env=env, capture_output=True, text=True)
+            if completed.returncode != 0:
+                results.append({"name": name, "error": completed.stderr.strip().splitlines()[-1:]})
+                continue
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_results(results: list[dict]) -> str:
+    lines = [f"{'benchmark':<14} {'páginas':>8} {'ms/pág (med)':>13} {'ms/pág (min)':>13} {'alloc KiB':>11} {'RSS +MiB':>9}"]
+    for r in results:
+        if "ms_per_page_median" in r:
+            lines.append(
+                f"{r['name']:<14} {r['pages']:>8} {r['ms_per_page_median']:>13} {r['ms_per_page_min']:>13} "
+                f"{r['peak_alloc_kib']:>11} {str(r['rss_growth_mib'] if r['rss_growth_mib'] is not None else '-'):>9}"
+            )
+        else:
+            lines.append(f"{r['name']:<14} {r.get('skipped') or r.get('error')}")
+    return "\n".join(lines)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks de extracción y render.")
+    parser.add_argument("--pages", type=int, default=50, help="Páginas de los documentos sintéticos.")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones medidas por benchmark.")
+    parser.add_argument("--only", action="append", choices=BENCHMARKS, help="Ejecuta solo estos benchmarks.")
+    parser.add_argument("--src-root", type=Path, default=REPO_ROOT, help="Raíz del árbol cuyo `src` se mide.")
+    parser.add_argument("--json", type=Path, help="Guarda los resultados en este archivo JSON.")
+    parser.add_argument("--child", choices=BENCHMARKS, help=argparse.SUPPRESS)
+    parser.add_argument("--data-dir", type=Path, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    src_root = args.src_root.resolve()
+    if args.child:
+        sys.path.insert(0, str(src_root))
+        print(json.dumps(run_benchmark(args.child, args.data_dir, args.repeat)))
+        return 0
+
+    results = run_all(args.only or list(BENCHMARKS), src_root, args.pages, args.repeat)
+    print(format_results(results))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Compara los micro-benchmarks entre dos revisiones de git.
+
+Crea un worktree temporal por revisión y ejecuta contra cada uno el `bench.py` del árbol
+actual (así las revisiones antiguas, que no lo tienen, también se pueden medir). Los
+benchmarks que no existen en una revisión aparecen como no disponibles.
+
+Uso (desde la raíz del repositorio):
+    python tests/benchmarks/compare.py HEAD~3 HEAD --pages 50 --repeat 5
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import bench  # noqa: E402
+
+# Métricas comparadas (todas: más bajo es mejor).
+COMPARED_METRICS = ("ms_per_page_median", "peak_alloc_kib", "rss_growth_mib")
+
+
+def _git(*args: str) -> str:
+    return subprocess.run(["git", *args], cwd=bench.REPO_ROOT, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def run_revision(revision: str, pages: int, repeat: int, names: list[str]) -> list[dict]:
+    worktree = Path(tempfile.mkdtemp(prefix="cv-bench-worktree-"))
+    _git("worktree", "add", "--detach", str(worktree), revision)
+    try:
+        return bench.run_all(names, worktree, pages, repeat)
+    finally:
+        _git("worktree", "remove", "--force", str(worktree))
+
+
+def format_comparison(label_a: str, results_a: list[dict], label_b: str, results_b: list[dict]) -> str:
+    by_name_b = {r["name"]: r for r in results_b}
+    lines = [f"{'benchmark':<14} {'métrica':<20} {label_a[:14]:>14} {label_b[:14]:>14} {'cambio':>9}"]
+    for a in results_a:
+        b = by_name_b.get(a["name"], {})
+        for metric in COMPARED_METRICS:
+            value_a, value_b = a.get(metric), b.get(metric)
+            change = f"{(value_b - value_a) / value_a:+.1%}" if value_a and value_b is not None else "-"
+            lines.append(f"{a['name']:<14} {metric:<20} {str(value_a if value_a is not None else '-'):>14} "
+                         f"{str(value_b if value_b is not None else '-'):>14} {change:>9}")
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compara los micro-benchmarks de dos revisiones.")
+    parser.add_argument("base", help="Revisión de referencia (p. ej. main o HEAD~1).")
+    parser.add_argument("candidate", help="Revisión a comparar (p. ej. HEAD).")
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", action="append", choices=bench.BENCHMARKS)
+    args = parser.parse_args(argv)
+
+    names = args.only or list(bench.BENCHMARKS)
+    results_base = run_revision(args.base, args.pages, args.repeat, names)
+    results_candidate = run_revision(args.candidate, args.pages, args.repeat, names)
+    print(format_comparison(args.base, results_base, args.candidate, results_candidate))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
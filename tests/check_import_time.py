@@ -0,0 +1,65 @@
+"""
+Comprueba el presupuesto de tiempo de importación de la app (arranque en frío).
+
+Importa `src.main` en un intérprete limpio varias veces y falla (código 1) si el mejor
+tiempo supera el presupuesto o si alguna librería pesada se carga al importar, en lugar
+de en el calentamiento o en el primer uso.
+
+Uso (desde la raíz del repositorio):
+    python tests/check_import_time.py --budget-ms 800
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+# Deben cargarse de forma perezosa (ver src/warmup.py).
+HEAVY_MODULES = ("openai", "supabase", "fitz", "pymupdf", "docx", "PIL", "pytesseract")
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import src.main
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{"ms": elapsed_ms, "heavy": sorted(m for m in {HEAVY_MODULES!r} if m in sys.modules)}}))
+"""
+
+
+def measure() -> dict:
+    env = {**os.environ, "PYTHONPATH": str(REPO_ROOT)}
+    with tempfile.TemporaryDirectory(prefix="cv-import-") as workdir:
+        completed = subprocess.run([sys.executable, "-c", PROBE], cwd=workdir, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise SystemExit(f"La importación de src.main falló:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Presupuesto de tiempo de importación de src.main.")
+    parser.add_argument("--budget-ms", type=float, default=800.0)
+    parser.add_argument("--runs", type=int, default=3, help="Se toma el mejor tiempo (el primero calienta la caché de bytecode).")
+    args = parser.parse_args(argv)
+
+    results = [measure() for _ in range(args.runs)]
+    best_ms = min(r["ms"] for r in results)
+    heavy = results[-1]["heavy"]
+    print(f"Importación de src.main: {best_ms:.0f} ms (mejor de {args.runs}; presupuesto {args.budget_ms:.0f} ms)")
+
+    failed = False
+    if best_ms > args.budget_ms:
+        print("FALLO: se supera el presupuesto de importación.")
+        failed = True
+    if heavy:
+        print(f"FALLO: librerías pesadas cargadas al importar: {', '.join(heavy)}")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
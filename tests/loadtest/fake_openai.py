@@ -0,0 +1,240 @@
+"""
+Servidor local que imita `POST /v1/chat/completions` de OpenAI.
+
+Responde con un CV de ejemplo (testCV/openai_response_pdf.json) tras una latencia
+configurable y, con cierta probabilidad, con errores 500 o 429. Soporta respuestas
+normales y en streaming (SSE con chunk final de uso), como las que pide la API.
+
+También imita la Batch API (`/v1/files` y `/v1/batches`) que usa el modo diferido: un
+lote pasa a `completed` tras `batch_completion_ms` y su archivo de salida contiene la
+misma respuesta de ejemplo para cada línea de entrada.
+"""
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+CANNED_RESPONSE_PATH = Path(__file__).resolve().parents[2] / "testCV" / "openai_response_pdf.json"
+# Tamaño de cada trozo de contenido en streaming, en caracteres.
+STREAM_CHUNK_CHARS = 48
+
+
+@dataclass
+class FakeOpenAIConfig:
+    latency_ms: float = 800.0
+    # fixed | uniform | exponential | lognormal
+    latency_distribution: str = "lognormal"
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    # Retraso entre trozos del streaming; el total se descuenta de la latencia.
+    stream_chunk_delay_ms: float = 5.0
+    # Tiempo que tarda un lote de la Batch API en completarse.
+    batch_completion_ms: float = 2000.0
+
+    def sample_latency(self) -> float:
+        mean = self.latency_ms / 1000
+        if self.latency_distribution == "fixed":
+            return mean
+        if self.latency_distribution == "uniform":
+            return random.uniform(0, 2 * mean)
+        if self.latency_distribution == "exponential":
+            return random.expovariate(1 / mean) if mean > 0 else 0.0
+        # lognormal con sigma 0.5 y la media indicada (cola larga, como una API real)
+        sigma = 0.5
+        return random.lognormvariate(0, sigma) * mean / math.exp(sigma ** 2 / 2)
+
+
+def _canned_content() -> str:
+    data = json.loads(CANNED_RESPONSE_PATH.read_text(encoding="utf-8"))
+    data.pop("full_text", None)
+    return json.dumps(data, ensure_ascii=False)
+
+
+def _usage(request_body: bytes, content: str) -> dict:
+    prompt_tokens = max(1, len(request_body) // 4)
+    completion_tokens = max(1, len(content) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+class FakeOpenAI:
+    def __init__(self, config: FakeOpenAIConfig | None = None):
+        self.config = config or FakeOpenAIConfig()
+        self.content = _canned_content()
+        self.calls = 0
+        self.errors = 0
+        self.batch_requests = 0
+        self.files: dict[str, dict] = {}
+        self.batches: dict[str, dict] = {}
+        self.app = Starlette(routes=[
+            Route("/v1/chat/completions", self.chat_completions, methods=["POST"]),
+            Route("/v1/models", self.models, methods=["GET"]),
+            Route("/v1/files", self.create_file, methods=["POST"]),
+            Route("/v1/files/{file_id}/content", self.file_content, methods=["GET"]),
+            Route("/v1/batches", self.create_batch, methods=["POST"]),
+            Route("/v1/batches/{batch_id}", self.retrieve_batch, methods=["GET"]),
+        ])
+
+    def _completion(self, payload: dict, body: bytes) -> dict:
+        return {
+            "id": f"chatcmpl-fake-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake-model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": self.content},
+                "finish_reason": "stop",
+            }],
+            "usage": _usage(body, self.content),
+        }
+
+    async def models(self, request: Request):
+        return JSONResponse({"object": "list", "data": [{"id": "fake-model", "object": "model", "created": 0, "owned_by": "loadtest"}]})
+
+    def _maybe_error(self) -> JSONResponse | None:
+        roll = random.random()
+        if roll < self.config.rate_limit_rate:
+            self.errors += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (fake)", "type": "rate_limit_error"}},
+                status_code=429, headers={"retry-after": "1"},
+            )
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            self.errors += 1
+            return JSONResponse({"error": {"message": "Internal error (fake)", "type": "server_error"}}, status_code=500)
+        return None
+
+    async def chat_completions(self, request: Request):
+        self.calls += 1
+        body = await request.body()
+        payload = json.loads(body)
+        latency = self.config.sample_latency()
+
+        error = self._maybe_error()
+        if error is not None:
+            await asyncio.sleep(latency / 4)
+            return error
+
+        completion_id = f"chatcmpl-fake-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = payload.get("model", "fake-model")
+        usage = _usage(body, self.content)
+
+        if not payload.get("stream"):
+            await asyncio.sleep(latency)
+            return JSONResponse(self._completion(payload, body))
+
+        chunks = [self.content[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(self.content), STREAM_CHUNK_CHARS)]
+        chunk_delay = self.config.stream_chunk_delay_ms / 1000
+        first_token_delay = max(0.0, latency - chunk_delay * len(chunks))
+        include_usage = (payload.get("stream_options") or {}).get("include_usage", False)
+
+        def event(choices: list, chunk_usage: dict | None = None) -> str:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices,
+            }
+            if chunk_usage is not None:
+                chunk["usage"] = chunk_usage
+            return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            await asyncio.sleep(first_token_delay)
+            yield event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            for piece in chunks:
+                await asyncio.sleep(chunk_delay)
+                yield event([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+            yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if include_usage:
+                yield event([], usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    # --- Batch API ---
+
+    def _file_object(self, file_id: str) -> dict:
+        stored = self.files[file_id]
+        return {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(stored["content"]),
+            "created_at": stored["created_at"],
+            "filename": stored["filename"],
+            "purpose": stored["purpose"],
+            "status": "processed",
+        }
+
+    def _store_file(self, content: bytes, filename: str, purpose: str) -> str:
+        file_id = f"file-fake-{uuid.uuid4().hex[:12]}"
+        self.files[file_id] = {"content": content, "filename": filename, "purpose": purpose, "created_at": int(time.time())}
+        return file_id
+
+    async def create_file(self, request: Request):
+        form = await request.form()
+        upload = form["file"]
+        file_id = self._store_file(await upload.read(), upload.filename or "upload.jsonl", str(form.get("purpose", "batch")))
+        return JSONResponse(self._file_object(file_id))
+
+    async def file_content(self, request: Request):
+        stored = self.files.get(request.path_params["file_id"])
+        if stored is None:
+            return JSONResponse({"error": {"message": "No such file (fake)", "type": "invalid_request_error"}}, status_code=404)
+        return Response(stored["content"], media_type="application/octet-stream")
+
+    async def create_batch(self, request: Request):
+        payload = await request.json()
+        batch_id = f"batch_fake_{uuid.uuid4().hex[:12]}"
+        self.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": payload["endpoint"],
+            "completion_window": payload["completion_window"],
+            "status": "in_progress",
+            "input_file_id": payload["input_file_id"],
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        asyncio.get_running_loop().call_later(self.config.batch_completion_ms / 1000, self._complete_batch, batch_id)
+        return JSONResponse(self.batches[batch_id])
+
+    def _complete_batch(self, batch_id: str):
+        batch = self.batches[batch_id]
+        lines = [json.loads(raw) for raw in self.files[batch["input_file_id"]]["content"].splitlines() if raw.strip()]
+        output = []
+        for line in lines:
+            body = json.dumps(line["body"]).encode("utf-8")
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+                "custom_id": line["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": self._completion(line["body"], body)},
+                "error": None,
+            }, ensure_ascii=False))
+        self.batch_requests += len(lines)
+        batch["output_file_id"] = self._store_file("\n".join(output).encode("utf-8") + b"\n", f"{batch_id}_output.jsonl", "batch_output")
+        batch["status"] = "completed"
+        batch["request_counts"] = {"total": len(lines), "completed": len(lines), "failed": 0}
+
+    async def retrieve_batch(self, request: Request):
+        batch = self.batches.get(request.path_params["batch_id"])
+        if batch is None:
+            return JSONResponse({"error": {"message": "No such batch (fake)", "type": "invalid_request_error"}}, status_code=404)
+        return JSONResponse(batch)
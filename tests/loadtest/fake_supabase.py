@@ -0,0 +1,191 @@
+"""
+Stand-in en memoria de la API REST de Supabase (PostgREST) para pruebas de carga.
+
+Implementa solo lo que usa la aplicación: `GET` con filtros `eq`/`in`/`is`, `limit`,
+proyección de columnas y el recurso embebido `endpoints(...)` de `requests`; `POST`
+(insert, y upsert con `on_conflict`) y `PATCH` (update) devolviendo la representación
+(o nada con `return=minimal`), y respuestas de objeto único
+(`Accept: application/vnd.pgrst.object+json`). Además de los datos, permite añadir
+latencia por llamada para simular una base de datos remota.
+"""
+import asyncio
+import hashlib
+import json
+import uuid
+from datetime import datetime, timezone
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+SINGLE_OBJECT_MEDIA_TYPE = "application/vnd.pgrst.object+json"
+
+# Claves primarias generadas al insertar, por tabla.
+_GENERATED_KEYS = {
+    "requests": "id_request",
+    "request_logs": "id",
+    "webhooks": "id_webhook",
+}
+# Recursos embebidos: (tabla, recurso) -> (columna local, columna remota)
+_EMBEDDED = {
+    ("requests", "endpoints"): ("endpoint_id", "id"),
+}
+_FILTER_PARAMS = {"select", "limit", "offset", "order", "columns", "on_conflict"}
+
+
+def _split_select(select: str) -> list[str]:
+    """Separa la lista de columnas por comas de primer nivel (fuera de paréntesis)."""
+    parts, depth, current = [], 0, []
+    for char in select:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append("".join(current).strip())
+    return [part for part in parts if part]
+
+
+def _matches(row: dict, column: str, expression: str) -> bool:
+    operator, _, value = expression.partition(".")
+    current = row.get(column)
+    if operator == "eq":
+        return current is not None and str(current) == value
+    if operator == "neq":
+        return current is None or str(current) != value
+    if operator == "in":
+        return str(current) in [v.strip().strip('"') for v in value.strip("()").split(",")]
+    if operator == "is":
+        return current is None if value == "null" else str(current).lower() == value
+    raise ValueError(f"Operador no soportado por el stand-in: {operator}")
+
+
+def _error(message: str, status_code: int, code: str = "PGRST000") -> JSONResponse:
+    return JSONResponse({"message": message, "code": code, "details": None, "hint": None}, status_code=status_code)
+
+
+class FakeSupabase:
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.tables: dict[str, list[dict]] = {}
+        self.calls = 0
+        self.app = Starlette(routes=[
+            Route("/rest/v1/{table}", self.handle, methods=["GET", "POST", "PATCH", "DELETE"]),
+        ])
+
+    # --- Datos de prueba ---
+
+    def seed(self, schema: dict, callback_url: str, analysis_mode: str = "vision_first", credits: int = 10**12,
+             priority: str | None = None) -> dict:
+        """Crea un usuario, una API Key y un endpoint. Devuelve la API Key y el id del endpoint."""
+        user_id = str(uuid.uuid4())
+        api_key = str(uuid.uuid4())
+        endpoint_id = str(uuid.uuid4())
+        self.tables.setdefault("users", []).append({"id_user": user_id, "credits": credits})
+        self.tables.setdefault("api_keys", []).append({
+            "id_key": str(uuid.uuid4()),
+            "id_user": user_id,
+            "pre": api_key[:8],
+            "key_hash": hashlib.sha256(api_key.encode()).hexdigest(),
+        })
+        info = {"schema": schema, "callbackURL": callback_url, "analysis_mode": analysis_mode}
+        if priority:
+            info["priority"] = priority
+        self.tables.setdefault("endpoints", []).append({
+            "id": endpoint_id,
+            "id_user": user_id,
+            "name": "loadtest",
+            "secret_webhook": None,
+            "info": info,
+        })
+        return {"api_key": api_key, "endpoint_id": endpoint_id, "user_id": user_id}
+
+    # --- PostgREST ---
+
+    def _filtered(self, table: str, request: Request) -> list[dict]:
+        rows = self.tables.setdefault(table, [])
+        filters = [(k, v) for k, v in request.query_params.multi_items() if k not in _FILTER_PARAMS]
+        return [row for row in rows if all(_matches(row, column, expr) for column, expr in filters)]
+
+    def _project(self, table: str, row: dict, select: str | None) -> dict:
+        if not select or select == "*":
+            return dict(row)
+        projected = {}
+        for column in _split_select(select):
+            if "(" in column:
+                resource, _, inner = column.partition("(")
+                resource = resource.strip()
+                local, remote = _EMBEDDED[(table, resource)]
+                target = next((r for r in self.tables.get(resource, []) if str(r.get(remote)) == str(row.get(local))), None)
+                projected[resource] = self._project(resource, target, inner.rstrip(")")) if target else None
+            elif column == "*":
+                projected.update(row)
+            else:
+                projected[column] = row.get(column)
+        return projected
+
+    def _respond(self, request: Request, table: str, rows: list[dict], status_code: int = 200) -> Response:
+        select = request.query_params.get("select")
+        data = [self._project(table, row, select) for row in rows]
+        if SINGLE_OBJECT_MEDIA_TYPE in request.headers.get("accept", ""):
+            if len(data) != 1:
+                return _error(f"JSON object requested, multiple (or no) rows returned ({len(data)})", 406, "PGRST116")
+            return Response(json.dumps(data[0], default=str), status_code=status_code, media_type="application/json")
+        return Response(json.dumps(data, default=str), status_code=status_code, media_type="application/json")
+
+    async def handle(self, request: Request) -> Response:
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        table = request.path_params["table"]
+        try:
+            if request.method == "GET":
+                rows = self._filtered(table, request)
+                offset = int(request.query_params.get("offset", 0))
+                limit = request.query_params.get("limit")
+                rows = rows[offset:offset + int(limit)] if limit else rows[offset:]
+                return self._respond(request, table, rows)
+
+            if request.method == "POST":
+                body = await request.json()
+                new_rows = body if isinstance(body, list) else [body]
+                prefer = request.headers.get("prefer", "")
+                conflict_column = request.query_params.get("on_conflict")
+                inserted = []
+                for values in new_rows:
+                    row = dict(values)
+                    if conflict_column:
+                        existing = next((r for r in self.tables.get(table, []) if r.get(conflict_column) == row.get(conflict_column)), None)
+                        if existing is not None:
+                            if "resolution=merge-duplicates" in prefer:
+                                existing.update(row)
+                                inserted.append(existing)
+                            continue
+                    key = _GENERATED_KEYS.get(table)
+                    if key and key not in row:
+                        row[key] = str(uuid.uuid4())
+                    row.setdefault("created_at", datetime.now(timezone.utc).isoformat())
+                    self.tables.setdefault(table, []).append(row)
+                    inserted.append(row)
+                if "return=minimal" in prefer:
+                    return Response(status_code=201)
+                return self._respond(request, table, inserted, status_code=201)
+
+            if request.method == "PATCH":
+                changes = await request.json()
+                rows = self._filtered(table, request)
+                for row in rows:
+                    row.update(changes)
+                return self._respond(request, table, rows)
+
+            rows = self._filtered(table, request)
+            self.tables[table] = [row for row in self.tables.get(table, []) if row not in rows]
+            return self._respond(request, table, rows)
+        except (ValueError, KeyError) as e:
+            return _error(str(e), 400)
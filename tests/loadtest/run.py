@@ -0,0 +1,328 @@
+"""
+Prueba de carga de extremo a extremo sin dependencias externas.
+
+Arranca en este proceso un OpenAI falso, un stand-in en memoria de Supabase y un receptor
+de webhooks; lanza la API (uvicorn) como subproceso apuntando a ellos y envía el corpus
+de `testCV/cv` con la concurrencia indicada. Informa de throughput, latencia de subida,
+latencia de extremo a extremo (subida -> webhook) y memoria máxima de la API, y puede
+fallar si empeora respecto a una línea base guardada.
+
+Uso (desde la raíz del repositorio):
+    python -m tests.loadtest.run --requests 100 --concurrency 16
+    python -m tests.loadtest.run --save-baseline tests/loadtest/baseline.json
+    python -m tests.loadtest.run --baseline tests/loadtest/baseline.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import httpx
+import uvicorn
+
+from tests.loadtest.fake_openai import FakeOpenAI, FakeOpenAIConfig
+from tests.loadtest.fake_supabase import FakeSupabase
+from tests.loadtest.webhook_sink import WebhookSink
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_CORPUS = REPO_ROOT / "testCV" / "cv"
+CORPUS_SUFFIXES = (".pdf", ".png", ".jpg", ".jpeg", ".docx")
+
+# Esquema del endpoint de prueba: las claves de testCV/openai_response_pdf.json.
+LOADTEST_SCHEMA = {
+    "name": "Nombre completo",
+    "email": "Correo electrónico",
+    "phone": "Teléfono",
+    "resumen": "Resumen profesional",
+    "experiencia": [{"puesto": "", "empresa": "", "periodo": "", "descripcion": ""}],
+    "educacion": [{"titulo": "", "institucion": "", "periodo": ""}],
+    "habilidades": ["Habilidad"],
+    "soft_skills": ["Habilidad blanda"],
+}
+
+# Métricas comparadas con la línea base: nombre -> True si "más alto es mejor".
+BASELINE_METRICS = {
+    "throughput_jobs_per_s": True,
+    "upload_p95_s": False,
+    "e2e_p95_s": False,
+    "peak_rss_mib": False,
+}
+
+
+@dataclass
+class JobResult:
+    file: str
+    outcome: str  # completed | failed | upload_error | timeout
+    upload_s: float | None = None
+    e2e_s: float | None = None
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """Percentil por rango más cercano."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100 * len(ordered) + 0.5 - 1e-9))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def _peak_rss_mib(pid: int) -> float | None:
+    """
+    Memoria residente máxima del proceso (VmHWM, solo Linux). Con el lanzador se suma la
+    de sus workers (las páginas compartidas tras el fork cuentan en cada uno).
+    """
+    total = 0
+    try:
+        children = Path(f"/proc/{pid}/task/{pid}/children").read_text().split()
+        for process_id in [pid, *children]:
+            for line in Path(f"/proc/{process_id}/status").read_text().splitlines():
+                if line.startswith("VmHWM:"):
+                    total += int(line.split()[1])
+    except OSError:
+        pass
+    return round(total / 1024, 1) if total else None
+
+
+async def _serve(app, port: int) -> tuple[uvicorn.Server, asyncio.Task]:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+def _start_app(
+    port: int, openai_port: int, supabase_port: int, extra_env: dict, workdir: Path, launcher: bool = False,
+) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "PYTHONPATH": str(REPO_ROOT),
+        "OPENAI_API_KEY": "sk-loadtest",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+        "SUPABASE_URL": f"http://127.0.0.1:{supabase_port}",
+        "SUPABASE_KEY": "loadtest",
+        **extra_env,
+    }
+    server = ["src.launcher"] if launcher else ["uvicorn", "src.main:app"]
+    command = [sys.executable, "-m", *server, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    # Directorio de trabajo propio: los logs y temporales de la API no ensucian el repositorio.
+    return subprocess.Popen(command, cwd=workdir, env=env)
+
+
+async def _wait_ready(client: httpx.AsyncClient, base_url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"La API terminó durante el arranque (código {process.returncode}).")
+        try:
+            if (await client.get(f"{base_url}/health/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("La API no respondió a tiempo.")
+
+
+def _load_corpus(corpus_dir: Path) -> list[tuple[str, bytes]]:
+    files = sorted(p for p in corpus_dir.iterdir() if p.suffix.lower() in CORPUS_SUFFIXES)
+    if not files:
+        raise SystemExit(f"No hay archivos de CV en {corpus_dir}.")
+    return [(p.name, p.read_bytes()) for p in files]
+
+
+async def _run_job(
+    client: httpx.AsyncClient, sink: WebhookSink, base_url: str, credentials: dict,
+    name: str, content: bytes, timeout: float,
+) -> JobResult:
+    headers = {"Authorization": f"Bearer {credentials['api_key']}"}
+    start = time.perf_counter()
+    try:
+        response = await client.post(
+            f"{base_url}/{credentials['endpoint_id']}", headers=headers,
+            files={"file": (name, content, "application/octet-stream")}, timeout=timeout,
+        )
+        upload_s = time.perf_counter() - start
+        response.raise_for_status()
+        request_id = str(response.json()["request_id"])
+    except (httpx.HTTPError, KeyError, ValueError) as e:
+        print(f"  Error de subida para {name}: {e}")
+        return JobResult(name, "upload_error", upload_s=time.perf_counter() - start)
+
+    arrival = await sink.wait_for(request_id, timeout)
+    if arrival is None:
+        return JobResult(name, "timeout", upload_s=upload_s)
+    arrived_at, payload = arrival
+    return JobResult(name, payload.get("status", "failed"), upload_s=upload_s, e2e_s=arrived_at - start)
+
+
+def summarize(results: list[JobResult], wall_s: float, peak_rss_mib: float | None) -> dict:
+    uploads = [r.upload_s for r in results if r.upload_s is not None and r.outcome != "upload_error"]
+    e2e = [r.e2e_s for r in results if r.e2e_s is not None and r.outcome == "completed"]
+    outcomes: dict[str, int] = {}
+    for r in results:
+        outcomes[r.outcome] = outcomes.get(r.outcome, 0) + 1
+    summary = {
+        "requests": len(results),
+        "outcomes": outcomes,
+        "wall_s": round(wall_s, 3),
+        "throughput_jobs_per_s": round(outcomes.get("completed", 0) / wall_s, 3) if wall_s else 0.0,
+        "peak_rss_mib": peak_rss_mib,
+    }
+    for label, values in (("upload", uploads), ("e2e", e2e)):
+        for pct in (50, 90, 95, 99):
+            value = percentile(values, pct)
+            summary[f"{label}_p{pct}_s"] = round(value, 4) if value is not None else None
+        summary[f"{label}_max_s"] = round(max(values), 4) if values else None
+    return summary
+
+
+def compare_with_baseline(summary: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Devuelve la lista de regresiones que superan la tolerancia relativa."""
+    regressions = []
+    for metric, higher_is_better in BASELINE_METRICS.items():
+        current, reference = summary.get(metric), baseline.get(metric)
+        if current is None or not reference:
+            continue
+        change = (reference - current) / reference if higher_is_better else (current - reference) / reference
+        if change > max_regression:
+            regressions.append(f"{metric}: {reference} -> {current} ({change:+.1%} peor, tolerancia {max_regression:.0%})")
+    return regressions
+
+
+def _print_summary(summary: dict):
+    print("\n=== Resultado de la prueba de carga ===")
+    print(f"Peticiones: {summary['requests']}  Resultados: {summary['outcomes']}")
+    print(f"Duración: {summary['wall_s']} s  Throughput: {summary['throughput_jobs_per_s']} trabajos/s")
+    for label, title in (("upload", "Subida"), ("e2e", "Extremo a extremo")):
+        values = "  ".join(f"p{p}={summary[f'{label}_p{p}_s']}" for p in (50, 90, 95, 99))
+        print(f"{title} (s): {values}  max={summary[f'{label}_max_s']}")
+    print(f"Memoria máxima de la API: {summary['peak_rss_mib']} MiB")
+
+
+async def run(args: argparse.Namespace) -> dict:
+    corpus = _load_corpus(args.corpus)
+    fake_openai = FakeOpenAI(FakeOpenAIConfig(
+        latency_ms=args.openai_latency_ms,
+        latency_distribution=args.openai_latency_distribution,
+        error_rate=args.openai_error_rate,
+        rate_limit_rate=args.openai_rate_limit_rate,
+        batch_completion_ms=args.openai_batch_completion_ms,
+    ))
+    fake_supabase = FakeSupabase(latency_ms=args.supabase_latency_ms)
+    sink = WebhookSink()
+
+    openai_port, supabase_port, sink_port, app_port = (_free_port() for _ in range(4))
+    credentials = fake_supabase.seed(LOADTEST_SCHEMA, f"http://127.0.0.1:{sink_port}/hook", args.analysis_mode, priority=args.priority)
+    servers = [await _serve(fake_openai.app, openai_port), await _serve(fake_supabase.app, supabase_port), await _serve(sink.app, sink_port)]
+
+    extra_env = dict(item.split("=", 1) for item in args.app_env)
+    workdir = Path(tempfile.mkdtemp(prefix="cv-loadtest-"))
+    process = _start_app(app_port, openai_port, supabase_port, extra_env, workdir, launcher=args.launcher)
+    base_url = f"http://127.0.0.1:{app_port}"
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency)
+    try:
+        async with httpx.AsyncClient(limits=limits) as client:
+            await _wait_ready(client, base_url, process)
+            print(f"API lista en {base_url} (trabajo en {workdir}). Enviando {args.requests} CVs con concurrencia {args.concurrency}...")
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def bounded(index: int) -> JobResult:
+                name, content = corpus[index % len(corpus)]
+                async with semaphore:
+                    return await _run_job(client, sink, base_url, credentials, name, content, args.timeout)
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(bounded(i) for i in range(args.requests)))
+            wall_s = time.perf_counter() - start
+        peak_rss = _peak_rss_mib(process.pid)
+    finally:
+        process.terminate()
+        try:
+            # Fuera del event loop: la API puede necesitar los servidores falsos mientras drena.
+            await asyncio.to_thread(process.wait, timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        for server, task in servers:
+            server.should_exit = True
+            await task
+
+    summary = summarize(results, wall_s, peak_rss)
+    summary["config"] = {
+        "concurrency": args.concurrency,
+        "analysis_mode": args.analysis_mode,
+        "priority": args.priority,
+        "launcher": args.launcher,
+        "openai_latency_ms": args.openai_latency_ms,
+        "openai_latency_distribution": args.openai_latency_distribution,
+        "openai_error_rate": args.openai_error_rate,
+        "openai_rate_limit_rate": args.openai_rate_limit_rate,
+        "supabase_latency_ms": args.supabase_latency_ms,
+        "openai_calls": fake_openai.calls,
+        "openai_batch_requests": fake_openai.batch_requests,
+        "supabase_calls": fake_supabase.calls,
+    }
+    return summary
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Prueba de carga offline de la API de CVs.")
+    parser.add_argument("--requests", type=int, default=50, help="Número total de CVs a enviar.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Trabajos en vuelo (subida -> webhook) a la vez.")
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS, help="Directorio con los CVs de prueba.")
+    parser.add_argument("--analysis-mode", default="vision_first", help="analysis_mode del endpoint de prueba.")
+    parser.add_argument("--priority", choices=("deferred",), help="priority del endpoint de prueba (por defecto, tiempo real).")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Segundos máximos por trabajo.")
+    parser.add_argument("--openai-latency-ms", type=float, default=800.0)
+    parser.add_argument("--openai-latency-distribution", default="lognormal", choices=("fixed", "uniform", "exponential", "lognormal"))
+    parser.add_argument("--openai-error-rate", type=float, default=0.0, help="Fracción de respuestas 500.")
+    parser.add_argument("--openai-rate-limit-rate", type=float, default=0.0, help="Fracción de respuestas 429.")
+    parser.add_argument("--openai-batch-completion-ms", type=float, default=2000.0, help="Tiempo hasta completar un lote diferido.")
+    parser.add_argument("--supabase-latency-ms", type=float, default=5.0)
+    parser.add_argument("--launcher", action="store_true", help="Arranca la API con `python -m src.launcher` (WEB_WORKERS, CPU_WORKERS por --app-env).")
+    parser.add_argument("--app-env", action="append", default=[], metavar="CLAVE=VALOR", help="Variable de entorno extra para la API.")
+    parser.add_argument("--json-out", type=Path, help="Guarda el resumen en este archivo JSON.")
+    parser.add_argument("--save-baseline", type=Path, help="Guarda el resumen como línea base.")
+    parser.add_argument("--baseline", type=Path, help="Compara con esta línea base y falla si hay regresión.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Empeoramiento relativo tolerado (0.2 = 20%%).")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    summary = asyncio.run(run(args))
+    _print_summary(summary)
+
+    for path in (args.json_out, args.save_baseline):
+        if path:
+            path.write_text(json.dumps(summary, indent=2, ensure_ascii=False), encoding="utf-8")
+            print(f"Resumen guardado en {path}.")
+
+    if args.baseline:
+        regressions = compare_with_baseline(summary, json.loads(args.baseline.read_text(encoding="utf-8")), args.max_regression)
+        if regressions:
+            print("\nREGRESIÓN respecto a la línea base:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print("\nSin regresiones respecto a la línea base.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,39 @@
+"""
+Receptor local de webhooks: anota la hora de llegada del resultado de cada petición
+para medir la latencia de extremo a extremo.
+"""
+import asyncio
+import time
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+
+class WebhookSink:
+    def __init__(self):
+        self.arrivals: dict[str, tuple[float, dict]] = {}
+        self._waiters: dict[str, asyncio.Future] = {}
+        self.app = Starlette(routes=[Route("/hook", self.receive, methods=["POST"])])
+
+    async def receive(self, request: Request):
+        arrived_at = time.perf_counter()
+        payload = await request.json()
+        request_id = str(payload.get("request_id") or payload.get("batch_id")) # los callbacks de lote llevan batch_id
+        self.arrivals[request_id] = (arrived_at, payload)
+        waiter = self._waiters.pop(request_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(self.arrivals[request_id])
+        return JSONResponse({"ok": True})
+
+    async def wait_for(self, request_id: str, timeout: float) -> tuple[float, dict] | None:
+        """Espera el webhook de `request_id`. Devuelve (hora de llegada, payload) o None si vence."""
+        if request_id in self.arrivals:
+            return self.arrivals[request_id]
+        waiter = self._waiters.setdefault(request_id, asyncio.get_running_loop().create_future())
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            self._waiters.pop(request_id, None)
+            return None